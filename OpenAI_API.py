@@ -1,22 +1,70 @@
-from flask import Flask, request, jsonify, make_response
+import time
+# Taken before the heavier imports, so the startup timings include them
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, request, jsonify, send_file, stream_with_context
 from html.parser import HTMLParser
-from flask_cors import CORS
-import openai
+from werkzeug.exceptions import HTTPException
+import importlib
+import importlib.util
 import os
 import re
 import html
 import base64
 from io import BytesIO
-import requests
 import tempfile
 import logging
 import traceback
-import time
-from dotenv import load_dotenv
+import hashlib
+import hmac
+import heapq
+import queue
+import itertools
+import random
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
 import json
+import uuid
+import contextvars
+from contextlib import contextmanager
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access. The
+    OpenAI SDK alone takes about half a second to import; deferring it to the
+    first call (or the warm-up) lets a cold worker answer sooner."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+openai = LazyModule("openai")
+requests = LazyModule("requests")
+# optional; only the semantic cache needs it
+np = LazyModule("numpy") if importlib.util.find_spec("numpy") else None
+# Pillow is optional too, and only loaded with the first image that is resized
+image_processing = LazyModule("image_processing")
+PILLOW_INSTALLED = importlib.util.find_spec("PIL") is not None
+
+def load_env_file():
+    """Load .env for local development. Hosted deploys set real environment
+    variables and have no .env, so they skip importing python-dotenv."""
+    for directory in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        path = os.path.join(directory, ".env")
+        if os.path.exists(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
 
-# Load environment variables from .env file
-load_dotenv()
+load_env_file()
 
 # Configure logging
 logging.basicConfig(
@@ -25,17 +73,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger('miro_openai_api')
 
-app = Flask(__name__)
-CORS(app, origins=["http://localhost:3000", "https://miro.com", "https://konzepta-9v8j.vercel.app"], supports_credentials=True, methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"])
+CORS_ORIGINS = ["http://localhost:3000", "https://miro.com", "https://konzepta-9v8j.vercel.app"]
+CORS_METHODS = ["GET", "POST", "OPTIONS", "PUT", "DELETE"]
 
 # --- Config ---
-openai.api_key = os.environ.get("OPENAI_API_KEY")
-if not openai.api_key:
+if not os.environ.get("OPENAI_API_KEY"):
     logger.error("OPENAI_API_KEY environment variable not set!")
-    # In production, use a dummy value to prevent startup failure, but API calls will fail
     if os.environ.get("RENDER"):
         logger.warning("No OpenAI API key provided - API functionality will not work!")
-        openai.api_key = "dummy-key-for-startup"
 
 # --- Miro Config ---
 MIRO_TOKEN = os.environ.get("MIRO_TOKEN")
@@ -46,6 +91,8 @@ if not MIRO_TOKEN:
         logger.warning("Using dummy MIRO_TOKEN in production - functionality will be limited")
         MIRO_TOKEN = "dummy-token-for-startup"
     
+MIRO_API_BASE = os.environ.get("MIRO_API_BASE", "https://api.miro.com").rstrip("/")
+
 # No longer using a global MIRO_BOARD_ID - we'll get it from each request instead
 DEFAULT_BOARD_ID = os.environ.get("MIRO_BOARD_ID", "")
 if not DEFAULT_BOARD_ID:
@@ -56,10 +103,146 @@ TEXT_MODEL = os.environ.get("OPENAI_TEXT_MODEL", "gpt-4.1")
 IMAGE_MODEL = os.environ.get("OPENAI_IMAGE_MODEL", "gpt-image-1")
 IMAGE_SIZE = os.environ.get("OPENAI_IMAGE_SIZE", "1024x1024")
 IMAGE_QUALITY = os.environ.get("OPENAI_IMAGE_QUALITY", "low")
+# Images per prompt from /generate-image-ideas, made in one call where the
+# model accepts n > 1 and in parallel single calls where it doesn't
+IMAGE_IDEAS_PER_PROMPT = int(os.environ.get("IMAGE_IDEAS_PER_PROMPT", 1))
+IMAGE_IDEAS_MAX_PER_PROMPT = int(os.environ.get("IMAGE_IDEAS_MAX_PER_PROMPT", 6))
+IMAGE_MODEL_MAX_N = {"dall-e-3": 1}  # other models accept up to 10 images per call
+
+# --- Board snapshot config ---
+BOARD_SNAPSHOT_MAX_BOARDS = int(os.environ.get("BOARD_SNAPSHOT_MAX_BOARDS", 32))
+MIRO_FETCH_CONCURRENCY = int(os.environ.get("MIRO_FETCH_CONCURRENCY", 8))  # per request
+
+# --- Upstream rate limit config ---
+# Requests (and tokens) per minute we allow ourselves per upstream/model; the
+# buckets also shrink to what the rate-limit response headers report.
+OPENAI_TEXT_RPM = int(os.environ.get("OPENAI_TEXT_RPM", 500))
+OPENAI_TEXT_TPM = int(os.environ.get("OPENAI_TEXT_TPM", 200000))
+OPENAI_IMAGE_RPM = int(os.environ.get("OPENAI_IMAGE_RPM", 50))
+MIRO_RPM = int(os.environ.get("MIRO_RPM", 1000))
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", 3))
+UPSTREAM_MAX_WAIT = float(os.environ.get("UPSTREAM_MAX_WAIT", 30))  # longest wait for a rate-limit slot
+UPSTREAM_BACKOFF_BASE = 0.5  # seconds, doubled per retry, with full jitter
+UPSTREAM_BACKOFF_CAP = 20
+
+# --- HTTP connection config ---
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))  # keep-alive connections per host
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.3))  # seconds, doubled per retry
+
+# --- Batch idea generation config ---
+IDEAS_BATCH_SIZE = int(os.environ.get("IDEAS_BATCH_SIZE", 5))  # notes packed into one completion
+IDEAS_BATCH_MAX_NOTES = int(os.environ.get("IDEAS_BATCH_MAX_NOTES", 100))
+IDEAS_BATCH_CONCURRENCY = int(os.environ.get("IDEAS_BATCH_CONCURRENCY", 4))  # completions in flight per request
+TEXT_GLOBAL_CONCURRENCY = int(os.environ.get("TEXT_GLOBAL_CONCURRENCY", 16))
+
+# --- Concurrency config ---
+# Per-request cap on images generated in parallel, and the process-wide cap
+# shared by all requests (size of the image worker pool).
+IMAGE_REQUEST_CONCURRENCY = int(os.environ.get("IMAGE_REQUEST_CONCURRENCY", 4))
+IMAGE_GLOBAL_CONCURRENCY = int(os.environ.get("IMAGE_GLOBAL_CONCURRENCY", 8))
+IMAGE_PROMPT_TIMEOUT = float(os.environ.get("IMAGE_PROMPT_TIMEOUT", 90))  # seconds per prompt
+
+IMAGE_POOL = ThreadPoolExecutor(max_workers=IMAGE_GLOBAL_CONCURRENCY, thread_name_prefix="image-gen")
+TEXT_POOL = ThreadPoolExecutor(max_workers=TEXT_GLOBAL_CONCURRENCY, thread_name_prefix="text-gen")
+# Sized to the HTTP connection pool so fetches never wait for a socket
+MIRO_POOL = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="miro-fetch")
+
+# --- Startup config ---
+# Warm-up: load the SDKs, open pooled connections to OpenAI and Miro and
+# check both credentials in the background as soon as the app is created
+WARM_UP = os.environ.get("WARM_UP", "0").lower() in ("1", "true", "yes")
+WARM_UP_TIMEOUT = float(os.environ.get("WARM_UP_TIMEOUT", 10))  # seconds per check
+WARM_UP_RETRY_AFTER = 5  # seconds before /ready re-runs failed checks
+
+# --- Job config ---
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))  # jobs processed at the same time
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", 50))
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 3600))  # seconds a finished job is kept
+# "disk" shares job progress between all workers on the host, so any of them
+# can answer GET /jobs/<id>; "memory" keeps a job in the worker running it
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "disk").lower()
+JOB_STORE_DIR = os.environ.get("JOB_STORE_DIR") or os.path.join(tempfile.gettempdir(), "konzepta-jobs")
+JOB_STORE_MAX_ENTRIES = 10000
+JOB_STORE_MAX_BYTES = 256 * 1024 * 1024
+
+# --- Metrics config ---
+# Adds a Server-Timing header with the per-stage breakdown to every response
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "").lower() in ("1", "true", "yes")
 
 # --- Cache config ---
-REQUEST_CACHE = {}
-CACHE_EXPIRY = 300  # 5 minutes
+CACHE_EXPIRY = int(os.environ.get("CACHE_TTL_SECONDS", 300))  # 5 minutes
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 256))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))  # 64 MB
+# "memory" keeps a cache per worker; "disk" shares one cache between all
+# workers on the host and survives restarts.
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory").lower()
+CACHE_DIR = os.environ.get("CACHE_DIR") or os.path.join(tempfile.gettempdir(), "konzepta-cache")
+
+# --- Image delivery config ---
+# Generated images are stored on local disk and returned as signed, expiring
+# /images/<id> URLs; "base64" also embeds them in the JSON (legacy clients).
+IMAGE_DELIVERY = os.environ.get("IMAGE_DELIVERY", "url").lower()
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR") or os.path.join(tempfile.gettempdir(), "konzepta-images")
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024))  # 2 GB
+IMAGE_STORE_TTL = int(os.environ.get("IMAGE_STORE_TTL", 24 * 3600))  # seconds images are kept
+IMAGE_URL_TTL = int(os.environ.get("IMAGE_URL_TTL", 3600))  # seconds a signed URL stays valid
+# Base for image URLs when the API sits behind a proxy; defaults to the request host
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")
+# Proxies in front of the app whose X-Forwarded-Proto/Host are trusted, so a
+# TLS-terminating proxy still yields https image links; 0 ignores the headers
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", 0))
+# /generate-image-ideas returns bare image URLs the board loads itself. Links
+# to our /images route only work where the board can reach this server, so
+# without PUBLIC_BASE_URL its images stay data URIs (or OpenAI's own URLs).
+IMAGE_IDEAS_DELIVERY = "url" if PUBLIC_BASE_URL else "base64"
+
+# --- Image processing config ---
+# Generated images are resized to the board geometry the client sends and
+# re-encoded in worker processes; "original" serves them as generated.
+IMAGE_OUTPUT_FORMAT = os.environ.get("IMAGE_OUTPUT_FORMAT", "original").lower()  # jpeg | webp | png | original
+IMAGE_OUTPUT_QUALITY = int(os.environ.get("IMAGE_OUTPUT_QUALITY", 80))
+IMAGE_OUTPUT_WIDTH = int(os.environ.get("IMAGE_OUTPUT_WIDTH", 0))  # when no width is sent; 0 keeps the size
+IMAGE_WIDTH_STEP = int(os.environ.get("IMAGE_WIDTH_STEP", 64))  # widths round up to a multiple, bounding the variants
+IMAGE_THUMBNAIL_WIDTH = int(os.environ.get("IMAGE_THUMBNAIL_WIDTH", 256))
+IMAGE_PROCESS_WORKERS = int(os.environ.get("IMAGE_PROCESS_WORKERS", 2))  # 0 processes in the request thread
+
+# --- Latency SLO config ---
+# Optional hedging for /generate-ideas: when the primary completion runs past
+# a percentile of recent latencies, a second one is sent (to the fallback
+# model if set), the first to finish is used and the other is cancelled.
+TEXT_HEDGE_ENABLED = os.environ.get("TEXT_HEDGE", "0").lower() in ("1", "true", "yes")
+TEXT_FALLBACK_MODEL = os.environ.get("OPENAI_TEXT_FALLBACK_MODEL", "")  # empty hedges to TEXT_MODEL
+TEXT_HEDGE_PERCENTILE = float(os.environ.get("TEXT_HEDGE_PERCENTILE", 95))
+TEXT_HEDGE_MIN_DELAY = float(os.environ.get("TEXT_HEDGE_MIN_DELAY", 1))  # seconds
+TEXT_HEDGE_MAX_DELAY = float(os.environ.get("TEXT_HEDGE_MAX_DELAY", 8))  # also used until there are enough samples
+TEXT_HEDGE_WINDOW = int(os.environ.get("TEXT_HEDGE_WINDOW", 200))  # recent completions the percentile covers
+TEXT_HEDGE_MIN_SAMPLES = int(os.environ.get("TEXT_HEDGE_MIN_SAMPLES", 20))
+
+# --- Speculative generation config ---
+# Opt-in: Miro board webhooks (POST /webhooks/miro) report edited sticky notes
+# and their /generate-ideas suggestions are made before anyone clicks
+SPECULATIVE_ENABLED = os.environ.get("SPECULATIVE_IDEAS", "0").lower() in ("1", "true", "yes")
+MIRO_WEBHOOK_SECRET = os.environ.get("MIRO_WEBHOOK_SECRET", "")  # signs X-Miro-Signature
+SPECULATIVE_DEBOUNCE = float(os.environ.get("SPECULATIVE_DEBOUNCE", 4))  # seconds without edits to a note
+SPECULATIVE_BOARD_BUDGET = int(os.environ.get("SPECULATIVE_BOARD_BUDGET", 30))  # completions per board per window
+SPECULATIVE_BUDGET_WINDOW = float(os.environ.get("SPECULATIVE_BUDGET_WINDOW", 3600))  # seconds
+SPECULATIVE_TTL = float(os.environ.get("SPECULATIVE_TTL", 900))  # seconds pre-generated ideas are kept
+SPECULATIVE_CONCURRENCY = int(os.environ.get("SPECULATIVE_CONCURRENCY", 2))
+# Pre-generate with the custom prompt of the board's last click instead of the
+# default one. Anyone's click sets it for the whole board, so it is a guess.
+SPECULATIVE_LAST_PROMPT = os.environ.get("SPECULATIVE_LAST_PROMPT", "0").lower() in ("1", "true", "yes")
+SPECULATIVE_MAX_PENDING = 256  # debounced notes waiting per worker
+
+# --- Semantic cache config ---
+# Opt-in: /generate-ideas reuses suggestions for near-duplicate notes on the
+# same board. It costs an embeddings call per click.
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE", "0").lower() in ("1", "true", "yes")
+EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92))  # cosine similarity
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 512))  # per board
+SEMANTIC_CACHE_MAX_BOARDS = int(os.environ.get("SEMANTIC_CACHE_MAX_BOARDS", 64))
+SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", 3600))
 
 # --- HTML stripping utility ---
 class HTMLStripper(HTMLParser):
@@ -80,110 +263,1260 @@ def strip_html(html_content):
     stripper.feed(html_content)
     return stripper.get_data()
 
+def note_text(content):
+    """Plain text of a sticky note, as its prompts and cache keys see it"""
+    return strip_html(content).strip()
+
 def clean_html(raw_html):
     if not raw_html:
         return ""
     return re.sub(r"<.*?>", "", raw_html).strip()
 
-# --- OpenAI Client ---
+# --- Metrics ---
+class Metric:
+    """A labelled Prometheus metric kept in process memory"""
+
+    def __init__(self, name, help_text, kind):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{self._format_labels(labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text, "counter")
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text, "gauge")
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        super().__init__(name, help_text, "histogram")
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Holds this process's metrics and renders the Prometheus text format.
+
+    Each gunicorn worker keeps its own registry; scrape every worker, or run
+    a single worker, to see the whole picture.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register fn() -> [(name, help, kind, value)] read at scrape time"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, help_text, kind, value in collect():
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+STAGE_SECONDS = METRICS.register(Histogram(
+    "konzepta_stage_seconds", "Time spent in each stage of request handling"))
+REQUEST_SECONDS = METRICS.register(Histogram(
+    "konzepta_request_seconds", "Time to produce a response, by endpoint and status"))
+REQUESTS_IN_FLIGHT = METRICS.register(Gauge(
+    "konzepta_requests_in_flight", "Requests currently being handled, by endpoint"))
+UPSTREAM_RESPONSES = METRICS.register(Counter(
+    "konzepta_upstream_responses_total", "Responses from OpenAI and Miro, by upstream and status"))
+CACHE_LOOKUPS = METRICS.register(Counter(
+    "konzepta_cache_lookups_total", "Response cache lookups, by endpoint and result"))
+OPENAI_TOKENS = METRICS.register(Counter(
+    "konzepta_openai_tokens_total", "Tokens reported by completion responses, by model and kind"))
+TEXT_HEDGES = METRICS.register(Counter(
+    "konzepta_text_hedges_total",
+    "Latency-SLO completions by outcome (unhedged, primary, hedge, failed) and the model that answered"))
+SPECULATIVE_IDEAS = METRICS.register(Counter(
+    "konzepta_speculative_ideas_total",
+    "Pre-generated /generate-ideas suggestions by outcome (generated, used, unchanged, over_budget, dropped, failed)"))
+
+# Per-request stage timings for the Server-Timing header. A context variable
+# so that work handed to the thread pools can still record into it.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> [total seconds, calls]
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total = self.stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def header(self):
+        """Server-Timing value; parallel stages add up, so calls are counted too"""
+        with self._lock:
+            entries = [f'{stage};dur={total * 1000:.1f};desc="{calls} call{"s" if calls > 1 else ""}"'
+                       for stage, (total, calls) in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+def begin_request_timings():
+    """Start collecting the current request's stage timings"""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+def record_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block as one occurrence of `stage` (miro_fetch, openai_chat, ...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def submit_in_context(pool, fn, *args):
+    """pool.submit that carries the caller's request timings into the worker"""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+# --- OpenAI Client & HTTP Sessions ---
+# One OpenAI client and one pooled requests.Session per upstream, shared by
+# all threads of a process. Forked children (gunicorn workers) start with
+# empty pools so they never reuse a socket inherited from the parent.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _reset_clients():
+    global _clients_lock
+    _clients.clear()
+    _clients_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_clients)
+
 def get_openai_client():
+    with _clients_lock:
+        client = _clients.get("openai")
+        if client is not None:
+            return client
+        try:
+            from openai import OpenAI
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                logger.error("OPENAI_API_KEY environment variable not set or empty!")
+                # Provide a fallback for development purposes only
+                #api_key = ""
+                logger.warning("Using fallback API key - not recommended for production")
+
+            # Retries are handled by SCHEDULER so they respect our rate limits
+            client = _clients["openai"] = OpenAI(api_key=api_key, max_retries=0)
+            return client
+        except ImportError:
+            logger.error("Failed to import OpenAI. Make sure the package is installed.")
+            raise
+
+def get_http_session(name):
+    """Return the pooled session for an upstream: "miro" (authenticated) or "images"."""
+    with _clients_lock:
+        session = _clients.get(f"session:{name}")
+        if session is not None:
+            return session
+
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        if name == "miro":
+            # Miro calls go through SCHEDULER, which does the retrying
+            retry = 0
+        else:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                # 429s are handled by the callers' own rate limiting
+                respect_retry_after_header=False,
+                # Once retries run out, hand back the last response so callers
+                # still see its status instead of a RetryError
+                raise_on_status=False
+            )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if name == "miro":
+            session.headers.update({
+                "Authorization": f"Bearer {MIRO_TOKEN}",
+                "accept": "application/json"
+            })
+        _clients[f"session:{name}"] = session
+        return session
+
+# --- Upstream Scheduling ---
+# Priority classes: lower runs first when an upstream is short on quota
+PRIORITY_INTERACTIVE = 0  # single /generate-ideas clicks, Miro lookups
+PRIORITY_BATCH = 1        # /generate-ideas/batch
+PRIORITY_BULK = 2         # image generation
+PRIORITY_SPECULATIVE = 3  # pre-generation for edited notes nobody asked about yet
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+class UpstreamRateLimited(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# When the caller stops waiting for the current upstream call (monotonic
+# clock); SCHEDULER doesn't wait or retry past it
+_upstream_deadline = contextvars.ContextVar("upstream_deadline", default=None)
+
+@contextmanager
+def upstream_deadline(seconds):
+    """Bound the waits and retries of upstream calls made inside the block"""
+    if not seconds:
+        yield
+        return
+    token = _upstream_deadline.set(time.monotonic() + seconds)
     try:
-        from openai import OpenAI
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            logger.error("OPENAI_API_KEY environment variable not set or empty!")
-            # Provide a fallback for development purposes only
-            #api_key = ""
-            logger.warning("Using fallback API key - not recommended for production")
-        
-        return OpenAI(api_key=api_key)
-    except ImportError:
-        logger.error("Failed to import OpenAI. Make sure the package is installed.")
-        raise
+        yield
+    finally:
+        _upstream_deadline.reset(token)
+
+def parse_duration(value):
+    """Seconds in a rate-limit header, e.g. "12", "1.5", "6m0s" or "120ms"."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+class TokenBucket:
+    """Token bucket with priority-ordered waiters and additive-increase /
+    multiplicative-decrease of its refill rate on 429s."""
+
+    def __init__(self, name, per_minute, burst_seconds=10):
+        self.name = name
+        self.max_rate = per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = max(1.0, self.max_rate * burst_seconds)
+        self.tokens = self.capacity
+        self.paused_until = 0.0  # wall clock, since reset headers may be epochs
+        self._updated = time.monotonic()
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, cost=1, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """Block until `cost` tokens are available to this caller. Waiters are
+        served by priority, then arrival; raises UpstreamRateLimited if that
+        would take longer than `timeout` seconds."""
+        cost = min(cost, self.capacity)
+        timeout = UPSTREAM_MAX_WAIT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        ticket = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait_for = None
+                    if self._waiters[0] == ticket:
+                        wait_for = max(self.paused_until - time.time(), (cost - self.tokens) / self.rate, 0)
+                        if wait_for == 0:
+                            self.tokens -= cost
+                            return
+                    remaining = deadline - now
+                    if remaining <= 0 or (wait_for is not None and wait_for > remaining):
+                        raise UpstreamRateLimited(f"Rate limit for {self.name} exceeded", wait_for)
+                    self._cond.wait(min(wait_for, remaining) if wait_for is not None else remaining)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def enqueue(self, priority=PRIORITY_INTERACTIVE):
+        """Queue a caller that cannot wait on the lock (the ASGI app) alongside
+        blocked waiters; returns the ticket to pass to reserve() and dequeue()"""
+        ticket = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def reserve(self, ticket, cost=1):
+        """Non-blocking acquire for an enqueue()d caller: takes the tokens and
+        returns 0 once the ticket is first in line and they are available,
+        otherwise returns how long to sleep before asking again."""
+        cost = min(cost, self.capacity)
+        with self._cond:
+            self._refill(time.monotonic())
+            wait_for = max(self.paused_until - time.time(), (cost - self.tokens) / self.rate, 0)
+            if self._waiters[0] != ticket:
+                # Blocked waiters are woken on their turn; this caller has to poll
+                return max(wait_for, 0.01)
+            if wait_for == 0:
+                self.tokens -= cost
+                return 0
+            return wait_for
+
+    def dequeue(self, ticket):
+        with self._cond:
+            self._waiters.remove(ticket)
+            heapq.heapify(self._waiters)
+            self._cond.notify_all()
+
+    def refund(self, cost=1):
+        """Return tokens taken by an acquire whose call never went out"""
+        with self._cond:
+            self.tokens = min(self.capacity, self.tokens + min(cost, self.capacity))
+            self._cond.notify_all()
+
+    def delay(self):
+        """Seconds until a pause requested by the upstream ends"""
+        return max(0.0, self.paused_until - time.time())
+
+    def pause(self, seconds):
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self._cond.notify_all()
+
+    def observe(self, remaining, reset_seconds):
+        """Adopt the upstream's view of the remaining quota"""
+        with self._cond:
+            if remaining is not None:
+                self._refill(time.monotonic())
+                self.tokens = min(self.tokens, remaining)
+            if remaining == 0 and reset_seconds:
+                self.paused_until = max(self.paused_until, time.time() + reset_seconds)
+
+    def throttled(self):
+        with self._cond:
+            self.rate = max(self.max_rate * 0.1, self.rate * 0.5)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self._cond:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+class UpstreamScheduler:
+    """Central gate for OpenAI and Miro calls: per-upstream/per-model token
+    buckets, rate-limit header tracking and retries with jittered backoff."""
+
+    def __init__(self, default_rpm):
+        self.default_rpm = default_rpm
+        self._limits = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, key, per_minute):
+        self._limits[key] = per_minute
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(key, self._limits.get(key, self.default_rpm))
+            return bucket
+
+    def observe(self, key, headers, status_code=200, token_key=None):
+        """Update buckets from OpenAI (x-ratelimit-*) or Miro (X-RateLimit-*) headers"""
+        headers = headers or {}
+        if "x-ratelimit-remaining-requests" in headers:
+            self.bucket(key).observe(
+                int(float(headers["x-ratelimit-remaining-requests"])),
+                parse_duration(headers.get("x-ratelimit-reset-requests"))
+            )
+            if token_key and "x-ratelimit-remaining-tokens" in headers:
+                self.bucket(token_key).observe(
+                    int(float(headers["x-ratelimit-remaining-tokens"])),
+                    parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                )
+        elif "X-RateLimit-Remaining" in headers:
+            # Miro reports credits, not requests; only an empty budget matters here
+            if headers["X-RateLimit-Remaining"] == "0":
+                reset = parse_duration(headers.get("X-RateLimit-Reset")) or 1
+                # Epoch seconds, or seconds from now
+                self.bucket(key).observe(0, reset - time.time() if reset > 1e9 else reset)
+        if status_code == 429 and headers.get("Retry-After"):
+            self.bucket(key).pause(parse_duration(headers["Retry-After"]) or 1)
+
+    def acquire(self, key, priority=PRIORITY_INTERACTIVE, token_key=None, tokens=0, timeout=None):
+        """Take a request token and, with token_key, `tokens` from the TPM
+        bucket. Both are taken or neither: if the second wait fails, the
+        request token is handed back."""
+        bucket = self.bucket(key)
+        with stage_timer("rate_limit_wait"):
+            bucket.acquire(1, priority, timeout)
+            if token_key:
+                try:
+                    self.bucket(token_key).acquire(tokens, priority, timeout)
+                except UpstreamRateLimited:
+                    bucket.refund(1)
+                    raise
+
+    def call(self, key, fn, priority=PRIORITY_INTERACTIVE, token_key=None, tokens=0, idempotent=True):
+        """Run fn under the rate limits for `key`, retrying 429/5xx and
+        connection errors. fn may raise (OpenAI SDK) or return a response with
+        a status_code (requests); rate-limit headers are read from either.
+
+        Timeouts of non-idempotent calls (image generation) are not retried,
+        since the upstream may still be working on, and billing, the first
+        attempt. Waits and retries stop at the caller's upstream_deadline().
+        """
+        for attempt in range(UPSTREAM_MAX_RETRIES + 1):
+            self.acquire(key, priority, token_key, tokens, self.wait_limit(key))
+            response = error = None
+            try:
+                response = fn()
+            except (openai.APIStatusError, openai.APIConnectionError,
+                    requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            delay = self.retry_delay(key, attempt, response, error, token_key, idempotent)
+            if delay is None:
+                return response
+            time.sleep(delay)
+
+    # The steps of call() that don't wait, shared with the ASGI app's async call()
+    def wait_limit(self, key):
+        """Longest wait for a rate-limit slot before the next attempt"""
+        deadline = _upstream_deadline.get()
+        remaining = deadline - time.monotonic() if deadline else None
+        if remaining is not None and remaining <= 0:
+            raise TimeoutError(f"{key} call passed its deadline")
+        return min(UPSTREAM_MAX_WAIT, remaining) if remaining is not None else None
+
+    def retry_delay(self, key, attempt, response, error, token_key=None, idempotent=True):
+        """Record the outcome of one attempt (a response, or an exception the
+        upstream client raised) and return how long to wait before retrying,
+        or None when `response` should go back to the caller. Raises the
+        error, or UpstreamRateLimited, once it isn't worth retrying."""
+        bucket = self.bucket(key)
+        upstream = key.split(":", 1)[0]
+        deadline = _upstream_deadline.get()
+        if error is not None:
+            status = getattr(error, "status_code", None)
+            headers = error.response.headers if getattr(error, "response", None) is not None else {}
+            if status is not None and status not in RETRYABLE_STATUSES:
+                raise error
+            if not idempotent and isinstance(error, (openai.APITimeoutError, requests.exceptions.Timeout)):
+                UPSTREAM_RESPONSES.inc(upstream=upstream, status="error")
+                raise error
+        else:
+            status, headers = getattr(response, "status_code", 200), getattr(response, "headers", {})
+        UPSTREAM_RESPONSES.inc(upstream=upstream, status=status or "error")
+        self.observe(key, headers, status, token_key)
+
+        if error is None and status not in RETRYABLE_STATUSES:
+            bucket.succeeded()
+            return None
+        if status == 429:
+            bucket.throttled()
+        retry_after = parse_duration(headers.get("Retry-After"))
+        delay = max(retry_after or 0, random.uniform(0, min(UPSTREAM_BACKOFF_CAP, UPSTREAM_BACKOFF_BASE * 2 ** attempt)))
+        if attempt == UPSTREAM_MAX_RETRIES or (deadline and time.monotonic() + delay >= deadline):
+            if status == 429:
+                raise UpstreamRateLimited(f"Rate limit for {key} exceeded", retry_after) from error
+            if error is not None:
+                raise error
+            return None
+
+        logger.warning(f"{key} returned {status or type(error).__name__}, retrying in {delay:.1f}s "
+                       f"(attempt {attempt + 1}/{UPSTREAM_MAX_RETRIES})")
+        if status == 429:
+            bucket.pause(delay)
+        return delay
+
+SCHEDULER = UpstreamScheduler(default_rpm=OPENAI_TEXT_RPM)
+SCHEDULER.configure(f"openai:{TEXT_MODEL}", OPENAI_TEXT_RPM)
+SCHEDULER.configure(f"openai-tokens:{TEXT_MODEL}", OPENAI_TEXT_TPM)
+if TEXT_FALLBACK_MODEL:
+    # Hedges get the same quota; otherwise its token bucket would default to the RPM
+    SCHEDULER.configure(f"openai:{TEXT_FALLBACK_MODEL}", OPENAI_TEXT_RPM)
+    SCHEDULER.configure(f"openai-tokens:{TEXT_FALLBACK_MODEL}", OPENAI_TEXT_TPM)
+SCHEDULER.configure(f"openai:{IMAGE_MODEL}", OPENAI_IMAGE_RPM)
+SCHEDULER.configure("miro", MIRO_RPM)
+
+def openai_request(create, model, priority, tokens=0, idempotent=True, **params):
+    """Call an OpenAI SDK method through SCHEDULER and return the parsed result.
+
+    `create` is a with_raw_response method (e.g.
+    client.images.with_raw_response.generate) so rate-limit headers can be
+    read; `tokens` is the estimated token cost for the TPM bucket.
+    """
+    raw = SCHEDULER.call(
+        f"openai:{model}",
+        lambda: create(model=model, **params),
+        priority,
+        token_key=f"openai-tokens:{model}" if tokens else None,
+        tokens=tokens,
+        idempotent=idempotent
+    )
+    result = raw.parse()
+    record_token_usage(model, getattr(result, "usage", None))
+    return result
+
+def record_token_usage(model, usage):
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    OPENAI_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+def estimate_tokens(prompt, max_tokens):
+    return len(prompt) // 4 + max_tokens
+
+def rate_limited_response(e):
+    """429 for a view to return; a plain tuple, so the ASGI app can use it too"""
+    headers = {"Retry-After": str(int(e.retry_after + 0.999))} if e.retry_after else {}
+    return {"error": "Upstream rate limit exceeded, please retry", "details": str(e)}, 429, headers
+
+# --- Miro Board Items ---
+class MiroAPIError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def miro_get(url, priority=None, **kwargs):
+    """GET a Miro API URL on the pooled session, through the upstream scheduler"""
+    session = get_http_session("miro")
+    with stage_timer("miro_fetch"):
+        return SCHEDULER.call("miro", lambda: session.get(url, **kwargs),
+                              PRIORITY_INTERACTIVE if priority is None else priority)
+
+def fetch_board_item(board_id, item_id, timeout=8):
+    """Fetch a single board item, or None if it doesn't exist"""
+    r = miro_get(f"{MIRO_API_BASE}/v2/boards/{board_id}/items/{item_id}", timeout=timeout)
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise MiroAPIError(f"Failed to fetch Miro item {item_id}: {r.status_code}", r.status_code)
+    return r.json()
+
+def fetch_board_items(board_id, item_ids):
+    """Fetch several board items concurrently, dropping duplicate ids.
+
+    Returns (item_id, item, error) in first-seen order; item is None when the
+    item doesn't exist and error is set when fetching it failed.
+    """
+    item_ids = list(dict.fromkeys(item_ids))
+    outcomes = run_bounded(
+        lambda item_id: fetch_board_item(board_id, item_id),
+        item_ids, MIRO_POOL, MIRO_FETCH_CONCURRENCY
+    )
+    return [(item_id, item, error) for item_id, (item, error) in zip(item_ids, outcomes)]
+
+SHAPE_TYPES = ("shape", "sticky_note", "text")
+
+def shape_text(item):
+    """Plain text of a shape, sticky note or text item"""
+    return html.unescape(clean_html(item.get("data", {}).get("content", ""))).strip()
+
+def item_prompt_text(item):
+    """Best-effort plain text of an item, trying a few fields in order"""
+    candidates = [
+        item.get("data", {}).get("content"),
+        item.get("data", {}).get("plainText"),
+        item.get("text"),
+        item.get("title")
+    ]
+    cleaned = (html.unescape(clean_html(c or "")).strip() for c in candidates)
+    return next((c for c in cleaned if c), "")
+
+class BoardSnapshot:
+    """Items of one board seen so far, indexed by id"""
+
+    def __init__(self, board_id):
+        self.board_id = board_id
+        self.items_by_id = {}
+
+    def add(self, item):
+        if item.get("id"):
+            self.items_by_id[item["id"]] = item
+
+    def remove(self, item_id):
+        self.items_by_id.pop(item_id, None)
+
+    def apply(self, event_type, item):
+        """Apply a board webhook event ("create", "update" or "delete")"""
+        if event_type == "delete":
+            self.remove(item.get("id"))
+        else:
+            self.add(item)
+
+class BoardSnapshotStore:
+    """Per-board snapshots of the items lookup() has fetched and webhook
+    events have reported.
+
+    lookup() always fetches the requested items by id, so their content is
+    current. The snapshot only serves as an index: an id it knows to be of
+    another type isn't fetched at all.
+    """
+
+    def __init__(self, max_boards):
+        self.max_boards = max_boards
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, board_id, snapshot):
+        with self._lock:
+            self._snapshots[board_id] = snapshot
+            self._snapshots.move_to_end(board_id)
+            while len(self._snapshots) > self.max_boards:
+                self._snapshots.popitem(last=False)
+
+    def lookup(self, board_id, item_ids, types=None):
+        """Return the current items for item_ids in request order, skipping
+        unknown ids and, if `types` is given, ids of other types"""
+        item_ids = list(dict.fromkeys(item_ids))
+        with self._lock:
+            snapshot = self._snapshots.get(board_id)
+        if snapshot is None:
+            snapshot = BoardSnapshot(board_id)
+            self._store(board_id, snapshot)
+        if types is not None:
+            # An item's type never changes, so the index can rule ids out
+            known = snapshot.items_by_id
+            item_ids = [i for i in item_ids if i not in known or known[i].get("type") in types]
+
+        items = {}
+        for item_id, item, error in fetch_board_items(board_id, item_ids):
+            if isinstance(error, UpstreamRateLimited):
+                raise error
+            if error:
+                logger.warning(f"Error fetching Miro item {item_id}: {str(error)}")
+            elif item:
+                items[item_id] = item
+                snapshot.add(item)
+            else:
+                snapshot.remove(item_id)
+        return [items[i] for i in item_ids if i in items]
+
+    def apply_event(self, board_id, event_type, item):
+        """Keep a cached snapshot current from a webhook event; boards without
+        one are left to the next fetch"""
+        with self._lock:
+            snapshot = self._snapshots.get(board_id)
+        if snapshot is not None:
+            snapshot.apply(event_type, item)
+
+BOARD_SNAPSHOTS = BoardSnapshotStore(BOARD_SNAPSHOT_MAX_BOARDS)
+
+# --- Concurrency Utilities ---
+def iter_bounded(func, items, pool, limit, timeout=None):
+    """Run func over items on pool with at most `limit` calls in flight.
+
+    Yields (index, result, error) as each item finishes. An item still running
+    `timeout` seconds after it started is reported with a TimeoutError; time
+    spent queued for a pool thread doesn't count. Its thread can't be
+    interrupted, so it keeps its place in `limit` until it really finishes.
+    Once the caller stops iterating, items that haven't started are dropped.
+    """
+    items = list(items)
+    limit = max(1, limit)
+    pending = {}
+    abandoned = set()  # timed out, but still running on the pool
+    started = {}  # index -> when a pool thread picked the item up
+    stopped = threading.Event()
+    next_index = 0
+
+    def run(index):
+        if stopped.is_set():
+            return None  # nobody is waiting for it any more
+        started[index] = time.monotonic()
+        # Upstream retries give up when the caller does
+        with upstream_deadline(timeout):
+            return func(items[index])
+
+    try:
+        while next_index < len(items) or pending:
+            while next_index < len(items) and len(pending) + len(abandoned) < limit:
+                pending[submit_in_context(pool, run, next_index)] = next_index
+                next_index += 1
+
+            wait_for = None
+            if timeout and pending:
+                # An item that starts while we wait can't time out before this
+                deadlines = [started[index] + timeout for index in pending.values() if index in started]
+                if len(deadlines) < len(pending):
+                    deadlines.append(time.monotonic() + timeout)
+                wait_for = max(0, min(deadlines) - time.monotonic())
+            done, _ = wait(set(pending) | abandoned, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future in abandoned:
+                    abandoned.discard(future)
+                    continue
+                index = pending.pop(future)
+                try:
+                    yield index, future.result(), None
+                except Exception as e:
+                    yield index, None, e
+
+            now = time.monotonic()
+            for future, index in list(pending.items()):
+                if timeout and index in started and now >= started[index] + timeout:
+                    # The worker thread can't be interrupted; stop waiting for
+                    # it (upstream_deadline keeps it from retrying much longer)
+                    del pending[future]
+                    abandoned.add(future)
+                    yield index, None, TimeoutError(f"Timed out after {timeout:.0f}s")
+    finally:
+        # The caller gave up, e.g. a streaming client went away
+        stopped.set()
+        for future in pending:
+            future.cancel()
+
+def run_bounded(func, items, pool, limit, timeout=None):
+    """Like iter_bounded, but returns a list of (result, error) in input order"""
+    items = list(items)
+    outcomes = [(None, None)] * len(items)
+    for index, result, error in iter_bounded(func, items, pool, limit, timeout):
+        outcomes[index] = (result, error)
+    return outcomes
+
+# --- Streaming Utilities ---
+STREAM_MIMETYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+def get_stream_format(data, args, headers):
+    """Streaming is opt-in: "sse" or "ndjson", chosen by ?stream=, the
+    "stream" body field or the Accept header; None for a plain JSON response."""
+    mode = args.get("stream") or data.get("stream")
+    accept = headers.get("Accept", "")
+    if mode == "ndjson" or (not mode and "application/x-ndjson" in accept):
+        return "ndjson"
+    if mode in (True, "1", "true", "sse") or (not mode and "text/event-stream" in accept):
+        return "sse"
+    return None
+
+def format_event(event, payload, fmt):
+    if fmt == "ndjson":
+        return json.dumps({"event": event, **payload}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_response(events, fmt):
+    """Send (event, payload) pairs as Server-Sent Events or NDJSON lines"""
+    def generate():
+        try:
+            for event, payload in events:
+                yield format_event(event, payload, fmt)
+        except Exception as e:
+            logger.exception("Streaming response failed")
+            yield format_event("error", {"error": "Server error", "details": str(e)}, fmt)
+
+    response = Response(stream_with_context(generate()), mimetype=STREAM_MIMETYPES[fmt])
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # don't let proxies buffer the stream
+    return response
 
 # --- Caching Utilities ---
+class ResponseCache:
+    """Thread-safe in-memory LRU cache with a TTL and bounds on entries and bytes.
+
+    Sizes are measured as the length of the JSON-encoded value, which is what
+    dominates for the base64 image payloads we store.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        size = len(json.dumps(value, separators=(",", ":")))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                logger.warning(f"Not caching {key}: {size} bytes exceeds cache limit")
+                return
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), size, value)
+            self._bytes += size
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _over_limit(self):
+        return len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+
+    def _evict(self):
+        if not self._over_limit():
+            return
+        # Drop expired entries first, then the least recently used ones
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _, _) in self._entries.items() if expires_at <= now]:
+            self._remove(key)
+        while self._over_limit():
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+class DiskCache:
+    """Response cache shared by every worker process on the host.
+
+    Metadata lives in a SQLite database in WAL mode and each value is stored
+    as a JSON file next to it, so large image payloads stay off the Python
+    heap until they are read. Entries survive restarts and are evicted least
+    recently used once the entry or byte limit is exceeded.
+    """
+
+    def __init__(self, directory, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.payload_dir = os.path.join(directory, "payloads")
+        os.makedirs(self.payload_dir, exist_ok=True)
+        self.db_path = os.path.join(directory, "cache.sqlite3")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._connect().execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def _connect(self):
+        # SQLite connections must not cross threads or forked processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _unlink(self, filename):
+        try:
+            os.remove(os.path.join(self.payload_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT filename, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        value = None
+        if row and row[1] > time.time():
+            try:
+                with open(os.path.join(self.payload_dir, row[0]), encoding="utf-8") as f:
+                    value = json.load(f)
+            except (OSError, ValueError):
+                # Evicted by another worker between the lookup and the read
+                value = None
+        if value is None:
+            if row:
+                self.delete(key)
+            self._count("misses")
+            return None
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self._count("hits")
+        return value
+
+    def set(self, key, value, ttl=None):
+        payload = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            logger.warning(f"Not caching {key}: {len(payload)} bytes exceeds cache limit")
+            return
+        filename = hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+        fd, tmp_path = tempfile.mkstemp(dir=self.payload_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, os.path.join(self.payload_dir, filename))
+
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, filename, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, filename, len(payload), now + (ttl or self.ttl), now)
+        )
+        self._evict(conn)
+
+    def delete(self, key):
+        # SELECT then DELETE rather than DELETE ... RETURNING, which needs SQLite 3.35
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT filename FROM entries WHERE key = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row:
+            self._unlink(row[0])
+
+    def stats(self):
+        entries, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._lock:
+            return {
+                "entries": entries,
+                "bytes": total,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _evict(self, conn):
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if entries <= self.max_entries and total <= self.max_bytes:
+            return
+        # Serialize eviction across workers; expired entries go first, then LRU
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            removed = conn.execute("SELECT filename, size FROM entries WHERE expires_at <= ?", (now,)).fetchall()
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            entries -= len(removed)
+            total -= sum(size for _, size in removed)
+            evicted = []
+            for key, filename, size in conn.execute("SELECT key, filename, size FROM entries ORDER BY accessed_at"):
+                if entries <= self.max_entries and total <= self.max_bytes:
+                    break
+                evicted.append((key, filename))
+                entries -= 1
+                total -= size
+            conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for filename in [filename for filename, _ in removed] + [filename for _, filename in evicted]:
+            self._unlink(filename)
+        with self._lock:
+            self.evictions += len(evicted)
+
+if CACHE_BACKEND == "disk":
+    logger.info(f"Using shared disk cache in {CACHE_DIR}")
+    REQUEST_CACHE = DiskCache(CACHE_DIR, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_EXPIRY)
+else:
+    REQUEST_CACHE = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_EXPIRY)
+
 def get_cache_key(endpoint, params):
-    """Create a cache key from endpoint and parameters"""
-    return f"{endpoint}:{hash(frozenset(params.items() if isinstance(params, dict) else params))}"
+    """Create a stable, content-addressed cache key from endpoint and parameters"""
+    normalized = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{endpoint}:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
 
 def get_from_cache(endpoint, params):
     """Get cached response if available and not expired"""
-    key = get_cache_key(endpoint, params)
-    cached = REQUEST_CACHE.get(key)
-    if cached:
-        timestamp, value = cached
-        if time.time() - timestamp < CACHE_EXPIRY:
-            logger.info(f"Cache hit for {endpoint}")
-            return value
-    return None
+    value = REQUEST_CACHE.get(get_cache_key(endpoint, params))
+    CACHE_LOOKUPS.inc(endpoint=endpoint, result="miss" if value is None else "hit")
+    if value is not None:
+        logger.info(f"Cache hit for {endpoint}")
+    return value
 
 def save_to_cache(endpoint, params, value):
     """Save response to cache"""
-    key = get_cache_key(endpoint, params)
-    REQUEST_CACHE[key] = (time.time(), value)
+    REQUEST_CACHE.set(get_cache_key(endpoint, params), value)
 
-# --- Error Handling ---
-@app.errorhandler(Exception)
-def handle_exception(e):
-    logger.error(f"Unhandled exception: {str(e)}")
-    logger.error(traceback.format_exc())
-    return jsonify({"error": "Internal server error", "details": str(e)}), 500
+class SemanticCache:
+    """Near-duplicate lookup for /generate-ideas.
 
-# --- Routes ---
-@app.route('/', methods=['GET'])
-def root():
-    """Root endpoint that simply returns a status message"""
-    return jsonify({
-        "status": "ok",
-        "name": "AI Ideation Assistant API",
-        "version": "1.0.0",
-        "endpoints": [
-            "/health",
-            "/generate-ideas",
-            "/generate-image-ideas",
-            "/generate-text2image-sketches"
-        ]
-    })
+    Each scope (board, model and custom prompt) keeps its unit-normalised
+    embeddings in one NumPy matrix, so a lookup is a single matrix-vector
+    product. The matrix grows as rows are added, up to `max_entries`.
+    Scopes are evicted least recently used, and within a full scope the
+    least recently used row is overwritten.
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        "status": "ok",
-        "timestamp": time.time(),
-        "service": "miro-openai-api"
-    })
+    Entries stored for the exact same text are never returned, so clicking
+    the same note again still gets fresh ideas.
+    """
 
-@app.route('/generate-ideas', methods=['POST'])
-def generate_ideas():
-    """Generate text ideas based on sticky note content"""
-    start_time = time.time()
-    
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
+    INITIAL_ROWS = 16
 
-        content = data.get("content", "").strip()
-        custom_prompt = data.get("prompt", "").strip()
-        board_id = data.get("boardId", DEFAULT_BOARD_ID)
+    def __init__(self, threshold, max_entries, max_scopes, ttl):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self.ttl = ttl
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = itertools.count()
+        self.hits = self.misses = 0
 
-        if not content:
-            return jsonify({"error": "No sticky note content provided"}), 400
-            
-        # We don't strictly require board_id for text generation, but we'll log it
-        if board_id:
-            logger.info(f"Processing text generation for board: {board_id}")
+    @staticmethod
+    def _normalise(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope, vector, text=None):
+        """Return (value, similarity) of the closest live entry above the
+        threshold, other than one stored for `text`, or (None, best similarity)"""
+        query = self._normalise(vector)
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None or entry["count"] == 0 or entry["vectors"].shape[1] != query.shape[0]:
+                self.misses += 1
+                return None, 0.0
+            self._scopes.move_to_end(scope)
+            count = entry["count"]
+            similarities = entry["vectors"][:count] @ query
+            similarities[entry["expires"][:count] <= time.monotonic()] = -1.0
+            if text is not None:
+                similarities[[index for index in range(count) if entry["texts"][index] == text]] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+            entry["used"][best] = next(self._clock)
+            self.hits += 1
+            return entry["values"][best], similarity
+
+    def add(self, scope, vector, value, text=None):
+        row = self._normalise(vector)
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None or entry["vectors"].shape[1] != row.shape[0]:
+                rows = min(self.INITIAL_ROWS, self.max_entries)
+                entry = self._scopes[scope] = {
+                    "vectors": np.zeros((rows, row.shape[0]), dtype=np.float32),
+                    "expires": np.zeros(rows),
+                    "used": np.zeros(rows, dtype=np.int64),
+                    "values": [None] * rows,
+                    "texts": [None] * rows,
+                    "count": 0
+                }
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            self._scopes.move_to_end(scope)
+
+            if entry["count"] < self.max_entries:
+                index = entry["count"]
+                if index == len(entry["values"]):
+                    self._grow(entry)
+                entry["count"] += 1
+            else:
+                # Expired rows sort first since their expiry is in the past
+                live = entry["expires"] > time.monotonic()
+                index = int(np.argmin(np.where(live, entry["used"], -1)))
+            entry["vectors"][index] = row
+            entry["expires"][index] = time.monotonic() + self.ttl
+            entry["used"][index] = next(self._clock)
+            entry["values"][index] = value
+            entry["texts"][index] = text
+
+    def _grow(self, entry):
+        """Double a scope's capacity, up to max_entries"""
+        rows = min(len(entry["values"]) * 2, self.max_entries)
+        extra = rows - len(entry["values"])
+        entry["vectors"] = np.concatenate([entry["vectors"], np.zeros((extra, entry["vectors"].shape[1]), dtype=np.float32)])
+        entry["expires"] = np.concatenate([entry["expires"], np.zeros(extra)])
+        entry["used"] = np.concatenate([entry["used"], np.zeros(extra, dtype=np.int64)])
+        entry["values"].extend([None] * extra)
+        entry["texts"].extend([None] * extra)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scopes": len(self._scopes),
+                "entries": sum(entry["count"] for entry in self._scopes.values()),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+if SEMANTIC_CACHE_ENABLED and np is None:
+    logger.warning("numpy is not installed - the semantic cache for /generate-ideas is disabled")
+SEMANTIC_CACHE = (
+    SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_MAX_BOARDS, SEMANTIC_CACHE_TTL)
+    if SEMANTIC_CACHE_ENABLED and np is not None else None
+)
+
+def semantic_scope(board_id, custom_prompt):
+    return (board_id or "", TEXT_MODEL, custom_prompt)
+
+def semantic_text(clean_text, custom_prompt):
+    """What gets embedded for a /generate-ideas request"""
+    return f"{clean_text}\n\n{custom_prompt}" if custom_prompt else clean_text
+
+# --- Request Coalescing ---
+class SingleFlight:
+    """Coalesces concurrent identical calls into one upstream execution.
 
-        # Check cache
-        # cache_params = {"content": content, "prompt": custom_prompt}
-        # cached_response = get_from_cache("generate-ideas", cache_params)
-        # if cached_response:
-        #    return jsonify(cached_response)
+    The first caller for a key runs the function; callers arriving while it
+    is still in flight wait for it and share its result or exception. A
+    caller never waits on a call of lower priority (a click on a note that
+    is being pre-generated): it runs its own, and later callers join that.
+    """
 
-        clean_text = strip_html(content)
+    def __init__(self):
+        self._calls = {}  # key -> [done event, result, error, priority]
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn, priority=PRIORITY_INTERACTIVE):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None or call[3] > priority
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None, priority]
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logger.info(f"Waiting on in-flight request {key[:60]}")
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+
+        try:
+            call[1] = fn()
+            return call[1]
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                # A higher-priority caller may have taken the key over
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call[0].set()
+
+INFLIGHT = SingleFlight()
+
+@METRICS.collector
+def collect_cache_metrics():
+    stats = REQUEST_CACHE.stats()
+    return [
+        ("konzepta_cache_entries", "Entries in the response cache", "gauge", stats["entries"]),
+        ("konzepta_cache_bytes", "Bytes held by the response cache", "gauge", stats["bytes"]),
+        ("konzepta_cache_evictions_total", "Response cache evictions", "counter", stats["evictions"]),
+        ("konzepta_coalesced_requests_total", "Requests served by an identical in-flight call", "counter",
+         INFLIGHT.coalesced),
+        ("konzepta_semantic_cache_entries", "Entries in the semantic /generate-ideas cache", "gauge",
+         SEMANTIC_CACHE.stats()["entries"] if SEMANTIC_CACHE is not None else 0)
+    ]
 
-        base_prompt = f"""
+# --- Text Generation ---
+def build_ideas_prompt(clean_text, custom_prompt=""):
+    """Prompt for /generate-ideas: four new sticky notes for one note"""
+    base_prompt = f"""
        
             You are a professional AI ideation assistant supporting UX designers and clients in a live ideation workshop on a Miro board. Your role is to help the team stay in a generative, exploratory phase—not to propose solutions.
  
@@ -210,9 +1543,9 @@ def generate_ideas():
             Idea 4: ...
            
             """.strip()
-            
-        if custom_prompt:
-            prompt = f"""
+        
+    if custom_prompt:
+        prompt = f"""
             Respond to the sticky note and context below.
             
             Respond with:
@@ -226,321 +1559,2055 @@ def generate_ideas():
             Sticky Note: "{clean_text}"
             Context: "{custom_prompt}"
             """.strip()
-        
-        else:
-            prompt = base_prompt
-
-        logger.info(f"Text Generation - Prompt (length: {len(prompt)})")
+    
+    else:
+        prompt = base_prompt
 
-        try:
-            client = get_openai_client()
+    return prompt
 
-            response = client.chat.completions.create(
-                model=TEXT_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.9,
-                max_tokens=500
-            )
+def generate_suggestions(client, prompt, priority=PRIORITY_INTERACTIVE):
+    """Run the /generate-ideas completion for a prompt and return its text"""
+    with stage_timer("openai_chat"):
+        response = openai_request(
+            client.chat.completions.with_raw_response.create, TEXT_MODEL, priority,
+            tokens=estimate_tokens(prompt, 500),
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.9,
+            max_tokens=500
+        )
+    return response.choices[0].message.content
 
-            suggestions = response.choices[0].message.content
-            logger.info(f"AI response received (length: {len(suggestions)})")
+def build_batch_ideas_prompt(notes, custom_prompt=""):
+    """Prompt covering several notes at once; `notes` maps short keys to
+    cleaned note text and the model answers with JSON keyed the same way."""
+    context = f'\nAdditional context from the facilitator: "{custom_prompt}"\n' if custom_prompt else ""
+    return f"""
+You are a professional AI ideation assistant supporting UX designers and clients in a live ideation workshop on a Miro board. Your role is to help the team stay in a generative, exploratory phase—not to propose solutions.
 
-            result = {"suggestions": suggestions}
-            
-            # Cache the result
-            # save_to_cache("generate-ideas", cache_params, result)
-            
-            # Add timing info
-            processing_time = time.time() - start_time
-            logger.info(f"Text generation completed in {processing_time:.2f}s")
-            
-            return jsonify(result)
+For EACH sticky note below, suggest 4 new sticky notes that each:
+- Reframe or expand the original thought to open new directions.
+- Use different thinking lenses, including but not limited to: technical, sustainability, data-driven, time-sensitive, accessibility, risk-aware, regulatory, scalability, financial, commercial, user-centric, innovative, and visionary, to explore diverse perspectives.
+- DO NOT POSE QUESTION, GENERATE LEADING IDEAS
 
-        except Exception as e:
-            logger.error(f"OpenAI API Error: {str(e)}")
-            return jsonify({"error": "OpenAI API error", "details": str(e)}), 500
+Avoid naming tools, services, features, or systems. Do not propose fully-formed solutions. Use clear, simple language understandable to both designers and clients. Limit each idea to 15 words or fewer, with no markdown, asterisks, or hashes.
+{context}
+Sticky notes, as a JSON object of key to note text:
+{json.dumps(notes, ensure_ascii=False)}
 
-    except Exception as e:
-        logger.error(f"Generate ideas error: {str(e)}")
-        return jsonify({"error": "Failed to process request", "details": str(e)}), 500
+Respond with only a JSON object mapping every key above to a list of exactly four idea strings, e.g. {{"n1": ["...", "...", "...", "..."]}}.
+""".strip()
 
-@app.route('/generate-text2image-sketches', methods=['POST', 'OPTIONS'])
-def generate_text2image_sketches():
-    """Generate images based on selected sticky notes or shapes using OpenAI DALL-E"""
-    if request.method == 'OPTIONS':
-        response = make_response()
-        response.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
-        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        return response
+def format_suggestions(ideas):
+    """Render a list of ideas in the "Idea N: ..." text format of /generate-ideas"""
+    return "\n\n".join(f"Idea {i}: {idea}" for i, idea in enumerate(ideas, 1))
 
-    start_time = time.time()
-    
+def parse_batch_ideas(text, keys):
+    """Map each key to its list of ideas; keys missing or malformed are left out"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
-            
-        selected_shape_ids = data.get("selectedShapeIds", [])
-        content = data.get("content", "")
-        # Use board ID from request if provided, otherwise fall back to env variable
-        board_id = data.get("boardId", DEFAULT_BOARD_ID)
-        
-        if not board_id:
-            return jsonify({"error": "No board ID provided in request. Please specify 'boardId' parameter."}), 400
-            
-        logger.info(f"Using board ID: {board_id}")
-        
-        # Get position and geometry data from the frontend
-        position_data = data.get("positionData")
-        geometry_data = data.get("geometryData")
-        if position_data:
-            logger.info(f"Using position data from frontend: {position_data}")
-        if geometry_data:
-            logger.info(f"Using geometry data from frontend: {geometry_data}")
-        
-        logger.info(f"Image Generation - Processing request - IDs: {len(selected_shape_ids)}, Content: {bool(content)}")
-        
-        # Check cache 
-        cache_params = {"content": content, "ids": ",".join(selected_shape_ids)}
-        cached_response = get_from_cache("generate-text2image-sketches", cache_params)
-        if cached_response:
-            return jsonify(cached_response)
-        
-        # Method 1: If content is directly provided in the request
-        if content:
-            logger.info("Using provided content directly")
-            shape_items = [{
-                "id": "direct_content",
-                "text": content.strip()
-            }]
-        # Method 2: If shape IDs are provided, fetch from Miro
-        elif selected_shape_ids:
-            logger.info(f"Using selected shape IDs: {selected_shape_ids}")
-            headers = {
-                "Authorization": f"Bearer {MIRO_TOKEN}",
-                "accept": "application/json"
-            }
-            response = requests.get(
-                f"https://api.miro.com/v2/boards/{board_id}/items", 
-                headers=headers,
-                timeout=10
-            )
-            if response.status_code != 200:
-                return jsonify({"error": f"Failed to fetch Miro items: {response.status_code}"}), 500
-
-            shape_items = []
-            for item in response.json().get("data", []):
-                if item.get("type") in ["shape", "sticky_note", "text"] and item.get("id") in selected_shape_ids:
-                    raw_text = item.get("data", {}).get("content", "")
-                    raw_text = clean_html(raw_text)
-                    raw_text = html.unescape(raw_text)
-
-                    shape_items.append({
-                        "id": item.get("id", "unknown"),
-                        "text": raw_text.strip(),
-                    })
+        parsed = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+    results = {}
+    for key in keys:
+        ideas = parsed.get(key)
+        if isinstance(ideas, list):
+            ideas = [str(idea).strip() for idea in ideas if str(idea).strip()]
+            if ideas:
+                results[key] = ideas
+    return results
+
+def generate_batch_chunk(client, notes, custom_prompt=""):
+    """One completion for a chunk of {key: text} notes; returns {key: ideas}"""
+    prompt = build_batch_ideas_prompt(notes, custom_prompt)
+    with stage_timer("openai_chat"):
+        response = openai_request(
+            client.chat.completions.with_raw_response.create, TEXT_MODEL, PRIORITY_BATCH,
+            tokens=estimate_tokens(prompt, 200 * len(notes)),
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.9,
+            max_tokens=200 * len(notes),
+            response_format={"type": "json_object"}
+        )
+    return parse_batch_ideas(response.choices[0].message.content, notes)
+
+IDEA_MARKER = re.compile(r"Idea\s*(\d+)\s*[:\uff1a]")
+
+class IdeaStreamParser:
+    """Splits streamed completion text into "Idea N:" entries as they complete.
+
+    An idea is complete once the next marker or a line break follows it.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._emitted = 0
+
+    def feed(self, delta):
+        self.text += delta
+        return self._complete_ideas(final=False)
+
+    def finish(self):
+        return self._complete_ideas(final=True)
+
+    def _complete_ideas(self, final):
+        ideas = []
+        markers = list(IDEA_MARKER.finditer(self.text))
+        while self._emitted < len(markers):
+            marker = markers[self._emitted]
+            is_last = self._emitted + 1 >= len(markers)
+            body = self.text[marker.end():len(self.text) if is_last else markers[self._emitted + 1].start()].lstrip()
+            if is_last and "\n" not in body and not final:
+                break
+            self._emitted += 1
+            idea = body.split("\n", 1)[0].strip()
+            if idea:
+                ideas.append({"index": int(marker.group(1)), "text": idea})
+        return ideas
+
+def stream_completion(client, model, prompt):
+    """Start a streamed /generate-ideas completion; returns the SDK stream"""
+    return openai_request(
+        client.chat.completions.with_raw_response.create, model, PRIORITY_INTERACTIVE,
+        tokens=estimate_tokens(prompt, 500),
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.9,
+        max_tokens=500,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+def iter_deltas(stream, model):
+    """Content deltas of a completion stream, recording its token usage"""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        record_token_usage(model, getattr(chunk, "usage", None))
+
+def stream_ideas(client, prompt):
+    """Stream a completion, yielding ("idea", {...}) for each idea as soon as
+    it is complete and finally ("done", {"suggestions": ...})."""
+    parser = IdeaStreamParser()
+    with stage_timer("openai_chat"):
+        if TEXT_HEDGE_ENABLED:
+            deltas = race_completions(client, prompt, "first_token").deltas()
         else:
-            return jsonify({"error": "No content or shape IDs provided"}), 400
+            deltas = iter_deltas(stream_completion(client, TEXT_MODEL, prompt), TEXT_MODEL)
+        for delta in deltas:
+            for idea in parser.feed(delta):
+                yield "idea", idea
+    for idea in parser.finish():
+        yield "idea", idea
+    yield "done", {"suggestions": parser.text}
 
-        if not shape_items or all(not item.get("text") for item in shape_items):
-            return jsonify({"status": "no_valid_shapes_found"}), 200
-            
-        client = get_openai_client()
-        generated_images = []
+# --- Hedged Completions ---
+class LatencyTracker:
+    """Rolling window of recent latencies per series, e.g. "gpt-4.1:complete" """
+
+    def __init__(self, window):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, series, seconds):
+        with self._lock:
+            self._samples.setdefault(series, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, series, q, min_samples=1):
+        """q-th percentile of the window, or None with fewer than min_samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(series, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+TEXT_LATENCY = LatencyTracker(TEXT_HEDGE_WINDOW)
+
+def hedge_delay(until):
+    """Seconds to give the primary completion before hedging: the
+    TEXT_HEDGE_PERCENTILE of its recent time to `until` ("first_token" or
+    "complete"), clamped to the configured bounds"""
+    observed = TEXT_LATENCY.percentile(f"{TEXT_MODEL}:{until}", TEXT_HEDGE_PERCENTILE, TEXT_HEDGE_MIN_SAMPLES)
+    if observed is None:
+        return TEXT_HEDGE_MAX_DELAY
+    return min(max(observed, TEXT_HEDGE_MIN_DELAY), TEXT_HEDGE_MAX_DELAY)
+
+@METRICS.collector
+def hedge_delay_metrics():
+    if not TEXT_HEDGE_ENABLED:
+        return []
+    return [(f"konzepta_text_hedge_delay_seconds_{until}",
+             f"Current hedging deadline for the time to {until.replace('_', ' ')}", "gauge", hedge_delay(until))
+            for until in ("first_token", "complete")]
+
+class CompletionAttempt:
+    """One streamed completion run on TEXT_POOL. It signals `ready` when it
+    reaches the first token, finishes or fails, and can be abandoned:
+    closing the stream drops the HTTP response. A hedge is not `primary`."""
+
+    def __init__(self, client, model, prompt, ready, primary=True):
+        self.client = client
+        self.model = model
+        self.prompt = prompt
+        self.ready = ready
+        self.primary = primary
+        self.started = time.perf_counter()
+        self.first_token = False
+        self.done = False
+        self.error = None
+        self.text = ""
+        self._deltas = queue.Queue()
+        self._stream = None
+        self._cancelled = threading.Event()
+
+    def run(self):
+        try:
+            self._stream = stream_completion(self.client, self.model, self.prompt)
+            if self._cancelled.is_set():
+                return
+            for delta in iter_deltas(self._stream, self.model):
+                if self._cancelled.is_set():
+                    return
+                if not self.first_token:
+                    self.first_token = True
+                    self._observe("first_token")
+                    self.ready.set()
+                self.text += delta
+                self._deltas.put(delta)
+            self._observe("complete")
+        except Exception as e:
+            if not self._cancelled.is_set():
+                self.error = e
+        finally:
+            self._close()
+            self.done = True
+            self._deltas.put(None)
+            self.ready.set()
+
+    def reached(self, until):
+        """True once this attempt got to `until` without failing"""
+        return self.error is None and (self.done if until == "complete" else self.first_token or self.done)
+
+    def cancel(self):
+        if not self.done:
+            self._cancelled.set()
+            # What the primary has taken so far is a lower bound on its latency;
+            # keeping it stops the slowest calls from vanishing out of the
+            # percentile. A hedge started late, so its time says nothing.
+            if self.primary:
+                self._observe("first_token" if not self.first_token else "complete")
+            self._close()
+
+    def deltas(self):
+        """Content deltas, including those received before the caller started
+        reading; raises the attempt's error if it failed part way"""
+        while True:
+            delta = self._deltas.get()
+            if delta is None:
+                break
+            yield delta
+        if self.error is not None:
+            raise self.error
+
+    def _observe(self, until):
+        if self.model == TEXT_MODEL:
+            TEXT_LATENCY.observe(f"{self.model}:{until}", time.perf_counter() - self.started)
+
+    def _close(self):
+        try:
+            if self._stream is not None:
+                self._stream.close()
+        except Exception:
+            pass
+
+def race_completions(client, prompt, until):
+    """Run the /generate-ideas completion on TEXT_MODEL. If it hasn't reached
+    `until` within hedge_delay(), send a hedge (to TEXT_FALLBACK_MODEL when
+    set) and return whichever attempt gets there first, cancelling the other.
+    Streams race to the first token, since what was sent can't be taken back."""
+    ready = threading.Event()
+    primary = CompletionAttempt(client, TEXT_MODEL, prompt, ready)
+    submit_in_context(TEXT_POOL, primary.run)
+    attempts = [primary]
+    deadline = time.monotonic() + hedge_delay(until)
+
+    while True:
+        # Cleared before looking, so a signal that lands meanwhile isn't lost
+        ready.clear()
+        winner = next((attempt for attempt in attempts if attempt.reached(until)), None)
+        if winner is not None:
+            break
+        if all(attempt.done for attempt in attempts):
+            TEXT_HEDGES.inc(outcome="failed", model=TEXT_MODEL)
+            raise primary.error
+        timeout = max(0, deadline - time.monotonic()) if len(attempts) == 1 else None
+        if not ready.wait(timeout) and len(attempts) == 1:
+            fallback = TEXT_FALLBACK_MODEL or TEXT_MODEL
+            logger.info(f"Completion passed its {until} deadline, hedging to {fallback}")
+            hedge = CompletionAttempt(client, fallback, prompt, ready, primary=False)
+            submit_in_context(TEXT_POOL, hedge.run)
+            attempts.append(hedge)
+
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt.cancel()
+    outcome = "unhedged" if len(attempts) == 1 else ("primary" if winner is primary else "hedge")
+    TEXT_HEDGES.inc(outcome=outcome, model=winner.model)
+    return winner
+
+def hedged_suggestions(client, prompt):
+    """generate_suggestions under the latency SLO"""
+    with stage_timer("openai_chat"):
+        return race_completions(client, prompt, "complete").text
+
+def embed_text(client, text):
+    """Embedding vector for text, used by the semantic cache"""
+    with stage_timer("openai_embedding"):
+        response = openai_request(
+            client.embeddings.with_raw_response.create, EMBEDDING_MODEL, PRIORITY_INTERACTIVE,
+            input=text
+        )
+    return response.data[0].embedding
+
+def stream_cached_ideas(suggestions):
+    """Replay cached suggestions as the events stream_ideas would produce"""
+    parser = IdeaStreamParser()
+    for idea in parser.feed(suggestions) + parser.finish():
+        yield "idea", idea
+    yield "done", {"suggestions": suggestions}
+
+# --- Speculative Generation ---
+def ideas_cache_key(prompt):
+    """Key shared by in-flight /generate-ideas completions and pre-generated ideas"""
+    return get_cache_key("generate-ideas", {"prompt": prompt, "model": TEXT_MODEL})
+
+def take_speculative_ideas(prompt):
+    """Pre-generated suggestions for this prompt, if any. They are removed
+    as they are handed out, so clicking again gets fresh ideas."""
+    if not SPECULATIVE_ENABLED:
+        return None
+    key = ideas_cache_key(prompt)
+    suggestions = REQUEST_CACHE.get(key)
+    CACHE_LOOKUPS.inc(endpoint="generate-ideas-speculative", result="miss" if suggestions is None else "hit")
+    if suggestions is not None:
+        REQUEST_CACHE.delete(key)
+        SPECULATIVE_IDEAS.inc(outcome="used")
+        logger.info("Answered from pre-generated suggestions")
+    return suggestions
+
+def discard_speculative_ideas(prompt):
+    # A click that raced a pre-generation has been answered; don't hand its twin out next time
+    if SPECULATIVE_ENABLED:
+        REQUEST_CACHE.delete(ideas_cache_key(prompt))
+
+class SpeculativeIdeas:
+    """Pre-generates /generate-ideas suggestions for sticky notes reported as
+    created or edited by board webhooks.
+
+    Edits are debounced per note, so a note is generated for once typing
+    stops. Each board may start `budget` completions per `window` seconds.
+    They run at PRIORITY_SPECULATIVE, behind every user-triggered call,
+    and the results wait in REQUEST_CACHE under the key a click on that
+    note would look up. A click arriving mid-generation doesn't wait on it
+    in INFLIGHT, since the pre-generation may still be queued behind other
+    work; the click makes its own call.
+    """
+
+    def __init__(self, debounce, budget, window, ttl, concurrency, max_pending):
+        self.debounce = debounce
+        self.budget = budget
+        self.window = window
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="speculative")
+        self._pending = {}  # (board_id, item_id) -> (due, text)
+        self._started = {}  # board_id -> deque of completion start times
+        self._texts = OrderedDict()  # (board_id, item_id) -> text generated for
+        self._prompts = OrderedDict()  # board_id -> custom prompt of its last click
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def note_changed(self, board_id, item_id, text):
+        key = (board_id, item_id)
+        with self._cond:
+            if self._texts.get(key) == text:
+                # Moves and resizes arrive as updates too
+                SPECULATIVE_IDEAS.inc(outcome="unchanged")
+                return
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                SPECULATIVE_IDEAS.inc(outcome="dropped")
+                return
+            self._pending[key] = (time.monotonic() + self.debounce, text)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="speculative-debounce", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def note_deleted(self, board_id, item_id):
+        with self._cond:
+            self._pending.pop((board_id, item_id), None)
+            self._texts.pop((board_id, item_id), None)
+
+    def remember_prompt(self, board_id, custom_prompt):
+        """Pre-generate with the custom prompt the board last used, so the
+        prompt (and cache key) match what its next click sends. Only called
+        with SPECULATIVE_LAST_PROMPT; otherwise the default prompt is used."""
+        with self._cond:
+            self._prompts[board_id] = custom_prompt
+            self._prompts.move_to_end(board_id)
+            while len(self._prompts) > BOARD_SNAPSHOT_MAX_BOARDS:
+                self._prompts.popitem(last=False)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [key for key, (at, _) in self._pending.items() if at <= now]
+                if not due:
+                    self._cond.wait(min(at for at, _ in self._pending.values()) - now if self._pending else None)
+                    continue
+                batch = [(key, self._pending.pop(key)[1], self._prompts.get(key[0], "")) for key in due]
+            for key, text, custom_prompt in batch:
+                if self._spend(key[0]):
+                    self._remember_text(key, text)
+                    self._pool.submit(self._generate, key, text, custom_prompt)
+                else:
+                    SPECULATIVE_IDEAS.inc(outcome="over_budget")
+
+    def _spend(self, board_id):
+        """Take one completion from the board's budget, if it has any left"""
+        now = time.monotonic()
+        with self._cond:
+            started = self._started.setdefault(board_id, deque())
+            while started and now - started[0] > self.window:
+                started.popleft()
+            if len(started) >= self.budget:
+                return False
+            started.append(now)
+            return True
+
+    def _remember_text(self, key, text):
+        with self._cond:
+            self._texts[key] = text
+            self._texts.move_to_end(key)
+            while len(self._texts) > self.max_pending * 16:
+                self._texts.popitem(last=False)
+
+    def _generate(self, key, text, custom_prompt):
+        prompt = build_ideas_prompt(text, custom_prompt)
+        cache_key = ideas_cache_key(prompt)
+
+        def generate():
+            suggestions = generate_suggestions(get_openai_client(), prompt, PRIORITY_SPECULATIVE)
+            REQUEST_CACHE.set(cache_key, suggestions, self.ttl)
+            return suggestions
+
+        try:
+            INFLIGHT.do(cache_key, generate, PRIORITY_SPECULATIVE)
+            SPECULATIVE_IDEAS.inc(outcome="generated")
+        except Exception as e:
+            with self._cond:
+                self._texts.pop(key, None)
+            SPECULATIVE_IDEAS.inc(outcome="failed")
+            logger.warning(f"Pre-generating ideas for item {key[1]} failed: {str(e)}")
+
+SPECULATOR = SpeculativeIdeas(SPECULATIVE_DEBOUNCE, SPECULATIVE_BOARD_BUDGET, SPECULATIVE_BUDGET_WINDOW,
+                              SPECULATIVE_TTL, SPECULATIVE_CONCURRENCY, SPECULATIVE_MAX_PENDING)
+
+def verify_webhook_signature(body, signature, secret=None):
+    """X-Miro-Signature is the hex HMAC-SHA256 of the raw body. Nothing
+    verifies without a secret (MIRO_WEBHOOK_SECRET by default)."""
+    secret = MIRO_WEBHOOK_SECRET if secret is None else secret
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+def handle_miro_webhook(body, signature, snapshots):
+    """Process one Miro webhook delivery (raw bytes): answer the subscription
+    challenge, keep `snapshots` current and queue edited sticky notes for
+    pre-generation. Returns (payload, status)."""
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return {"error": "Invalid JSON"}, 400
+    if not isinstance(data, dict):
+        return {"error": "Expected a JSON object"}, 400
+    if "challenge" in data:
+        # Sent once when the subscription is created
+        return {"challenge": data["challenge"]}, 200
+    if not verify_webhook_signature(body, signature):
+        return {"error": "Invalid signature"}, 401
+
+    events = data.get("events") or [data.get("event") or {}]
+    if not isinstance(events, list):
+        return {"error": "Expected a list of events"}, 400
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        board_id, event_type, item = event.get("boardId"), event.get("type"), event.get("item")
+        if not board_id or not isinstance(item, dict) or not item.get("id"):
+            continue
+        snapshots.apply_event(board_id, event_type, item)
+        if item.get("type") != "sticky_note":
+            continue
+        fields = item.get("data") if isinstance(item.get("data"), dict) else {}
+        if event_type == "delete":
+            SPECULATOR.note_deleted(board_id, item["id"])
+        elif text := note_text(str(fields.get("content") or "")):
+            SPECULATOR.note_changed(board_id, item["id"], text)
+    return {"status": "ok"}, 200
+
+if SPECULATIVE_ENABLED and not MIRO_WEBHOOK_SECRET:
+    logger.error("SPECULATIVE_IDEAS is on but MIRO_WEBHOOK_SECRET is not set - /webhooks/miro rejects every event")
+
+# --- Image Storage ---
+IMAGE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+# sha256 of the generated image, with a suffix for resized/transcoded variants
+IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{64}(-[a-z0-9]+)?\.(png|jpg|webp)$")
+
+class ImageWriter:
+    """Streams bytes into the store under a temporary name, then renames the
+    file to the SHA-256 of its content (or the given image_id); image_id is
+    set on exit."""
+
+    def __init__(self, store, extension, image_id=None):
+        self.store = store
+        self.extension = extension
+        self.image_id = None
+        self._name = image_id
+        self._digest = hashlib.sha256()
+
+    def __enter__(self):
+        self._file = tempfile.NamedTemporaryFile(dir=self.store.directory, suffix=".part", delete=False)
+        return self
+
+    def write(self, chunk):
+        self._digest.update(chunk)
+        self._file.write(chunk)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is not None:
+            os.unlink(self._file.name)
+            return False
+        self.image_id = self._name or self._digest.hexdigest() + self.extension
+        os.replace(self._file.name, os.path.join(self.store.directory, self.image_id))
+        self.store.saved()
+        return False
+
+class ImageStore:
+    """Content-addressed image files on local disk, shared by every worker on
+    the host and served through HMAC-signed, expiring URLs."""
+
+    def __init__(self, directory, max_bytes, ttl, secret=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._secret = secret.encode() if secret else None
+        self._saves = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def secret(self):
+        """IMAGE_URL_SECRET, or a random key kept in the store directory so
+        all workers sign alike"""
+        if self._secret is None:
+            path = os.path.join(self.directory, ".url-secret")
+            if not os.path.exists(path):
+                with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as f:
+                    f.write(base64.urlsafe_b64encode(os.urandom(32)))
+                os.chmod(f.name, 0o600)
+                try:
+                    os.link(f.name, path)  # atomic; the first worker wins
+                except FileExistsError:
+                    pass
+                finally:
+                    os.unlink(f.name)
+            with open(path, "rb") as f:
+                self._secret = f.read().strip()
+        return self._secret
+
+    def writer(self, content_type="image/png", image_id=None):
+        return ImageWriter(self, IMAGE_EXTENSIONS.get((content_type or "").split(";")[0].strip(), ".png"), image_id)
+
+    def save(self, data, content_type="image/png", image_id=None):
+        with self.writer(content_type, image_id) as writer:
+            writer.write(data)
+        return writer.image_id
+
+    def save_response(self, response, chunk_size=64 * 1024):
+        """Stream a requests response body to disk without holding it in memory"""
+        with self.writer(response.headers.get("Content-Type")) as writer:
+            for chunk in response.iter_content(chunk_size):
+                writer.write(chunk)
+        return writer.image_id
+
+    def path(self, image_id):
+        if not image_id or not IMAGE_ID_PATTERN.match(image_id):
+            return None
+        path = os.path.join(self.directory, image_id)
+        return path if os.path.exists(path) else None
+
+    def mimetype(self, image_id):
+        extension = os.path.splitext(image_id)[1]
+        return next((mime for mime, ext in IMAGE_EXTENSIONS.items() if ext == extension), "application/octet-stream")
+
+    def read_base64(self, image_id):
+        with open(self.path(image_id), "rb") as f:
+            return base64.b64encode(f.read()).decode("utf-8")
+
+    def _signature(self, image_id, expires):
+        return hmac.new(self.secret, f"{image_id}:{expires}".encode(), hashlib.sha256).hexdigest()[:32]
 
-        for shape in shape_items:
-            raw_text = shape.get("text", "").strip()
-            if not raw_text:
+    def signed_url(self, image_id, base_url, ttl=IMAGE_URL_TTL):
+        expires = int(time.time()) + ttl
+        return f"{base_url}/images/{image_id}?expires={expires}&sig={self._signature(image_id, expires)}"
+
+    def verify(self, image_id, expires, signature):
+        try:
+            if int(expires) < time.time():
+                return False
+        except (TypeError, ValueError):
+            return False
+        return bool(signature) and hmac.compare_digest(self._signature(image_id, expires), signature)
+
+    def saved(self):
+        with self._lock:
+            self._saves += 1
+            due = self._saves % 50 == 1
+        if due:
+            self.purge()
+
+    def purge(self):
+        """Delete images past the TTL, then the oldest until under max_bytes"""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("."):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
                 continue
+            # Half-written .part files only count as stale after an hour
+            ttl = 3600 if entry.name.endswith(".part") else self.ttl
+            if stat.st_mtime < now - ttl:
+                self._remove(entry.path)
+            elif not entry.name.endswith(".part"):
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+IMAGE_STORE = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES, IMAGE_STORE_TTL, os.environ.get("IMAGE_URL_SECRET"))
+
+# --- Image Processing ---
+if IMAGE_OUTPUT_FORMAT != "original" and not PILLOW_INSTALLED:
+    logger.warning("Pillow is not installed - generated images are served without resizing")
+
+class ImageVariant:
+    """Width, format and quality a request wants its images delivered in"""
 
-            # Create prompt for DALL-E
-            full_prompt = (
-                    f"An image illustrating the core ideas of a UX brainstorming session. "
-                    f"Theme: '{raw_text}'. "
-                    f"Create a clean, high-quality, professional image that visually represents the theme. "
-                    f"Can include people, objects, or environments. Use simple, clear composition with a modern aesthetic. "
-                    f"Minimal visual clutter. No text. Neutral or soft background. "
-                    f"Design should support UX ideation by conveying the concept in an intuitive and visually engaging way."
+    def __init__(self, width, format, quality, thumbnail=False):
+        self.width = width
+        self.format = format
+        self.quality = quality
+        self.thumbnail = thumbnail
+
+    @property
+    def key(self):
+        return f"{self.format}-w{self.width}q{self.quality}" + ("-t" if self.thumbnail else "")
+
+    @property
+    def mimetype(self):
+        return image_processing.FORMATS[self.format][1]
+
+    def derived_id(self, image_id, width):
+        """Store id for `image_id` rendered at `width` in this variant"""
+        digest = image_id.split(".")[0].split("-")[0]
+        return f"{digest}-w{width}q{self.quality}{IMAGE_EXTENSIONS[self.mimetype]}"
+
+def get_image_variant(data, args):
+    """Variant for a request: the width comes from "width" or the board
+    "geometryData" the image is placed with, "format" and "quality" from the
+    body or query string. None serves images as generated."""
+    data = data or {}
+    fmt = str(data.get("format") or args.get("format") or IMAGE_OUTPUT_FORMAT).lower()
+    fmt = "jpeg" if fmt == "jpg" else fmt
+    if fmt == "original" or not PILLOW_INSTALLED or fmt not in image_processing.FORMATS:
+        return None
+
+    width = data.get("width") or args.get("width") or (data.get("geometryData") or {}).get("width")
+    try:
+        width = max(0, int(float(width or IMAGE_OUTPUT_WIDTH)))
+    except (TypeError, ValueError):
+        width = IMAGE_OUTPUT_WIDTH
+    if width:
+        # Round up so nearby geometries share one rendition
+        width = min(-(-width // IMAGE_WIDTH_STEP) * IMAGE_WIDTH_STEP, 4096)
+    try:
+        quality = min(max(int(data.get("quality") or args.get("quality") or IMAGE_OUTPUT_QUALITY), 1), 100)
+    except (TypeError, ValueError):
+        quality = IMAGE_OUTPUT_QUALITY
+    thumbnail = data.get("thumbnail") in (True, "1", "true") or args.get("thumbnail") in ("1", "true")
+    return ImageVariant(width, fmt, quality, thumbnail)
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    """Worker processes for image encoding, started on first use. They are
+    spawned rather than forked, as forking a process that runs threads can
+    leave locks held in the child."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
             )
-            logger.info(f"Generating image for: {raw_text[:50]}...")
+        return _process_pool
 
-            try:
-                # Use model to generate image
-                image_params = {
-                    "model": IMAGE_MODEL,
-                    "prompt": full_prompt,
-                    "size": IMAGE_SIZE,
-                    "n": 1
-                }
-                
-                # Add quality parameter if using compatible model
-                if IMAGE_MODEL == "dall-e-3":
-                    image_params["quality"] = IMAGE_QUALITY
-                
-                response = client.images.generate(**image_params)
-                
-                # Get the image URL
-                image_url = response.data[0].url
-                
-                # Download the image
-                image_response = requests.get(image_url, timeout=10)
-                if image_response.status_code == 200:
-                    # Convert to base64
-                    img_base64 = base64.b64encode(image_response.content).decode("utf-8")
-                    
-                    generated_images.append({
-                        "id": shape["id"],
-                        "prompt": raw_text,
-                        "base64_image": img_base64
-                    })
-                    logger.info(f"Successfully generated image for {shape['id']}")
+def render_image(image_id, variant, width):
+    """Store id of `image_id` resized to `width` and encoded per `variant`,
+    rendering it on first use. Renditions are files in IMAGE_STORE named
+    after their source, so every worker reuses them."""
+    derived_id = variant.derived_id(image_id, width)
+    if IMAGE_STORE.path(derived_id):
+        return derived_id
+
+    def render():
+        source = IMAGE_STORE.path(image_id)
+        if not source:
+            raise RuntimeError(f"Image {image_id} is no longer stored")
+        with stage_timer("image_process"):
+            if IMAGE_PROCESS_WORKERS > 0:
+                data = get_process_pool().submit(
+                    image_processing.transcode, source, width, variant.format, variant.quality
+                ).result()
+            else:
+                data = image_processing.transcode(source, width, variant.format, variant.quality)
+        return IMAGE_STORE.save(data, variant.mimetype, image_id=derived_id)
+
+    return INFLIGHT.do(f"render:{derived_id}", render)
+
+def process_image(image, variant):
+    """Image result with image_id swapped for its rendition in `variant` (and
+    a thumbnail_id if asked for). source_id keeps the generated original so
+    cached results can be rendered again in other variants. Results without
+    a stored image pass through, as do all of them if processing fails."""
+    if not isinstance(image, dict) or "image_id" not in image:
+        return image
+    source_id = image.get("source_id", image["image_id"])
+    original = {k: v for k, v in image.items() if k not in ("source_id", "thumbnail_id")}
+    original["image_id"] = source_id
+    if variant is None:
+        return original
+    try:
+        processed = {**original, "source_id": source_id, "image_id": render_image(source_id, variant, variant.width)}
+        if variant.thumbnail:
+            processed["thumbnail_id"] = render_image(source_id, variant, IMAGE_THUMBNAIL_WIDTH)
+        return processed
+    except Exception as e:
+        logger.warning(f"Could not process image {source_id}: {str(e)}")
+        return original
+
+def get_delivery(data, args, default=IMAGE_DELIVERY):
+    """"url" (signed image links) or "base64" (legacy inline images) for a request"""
+    delivery = ((data or {}).get("delivery") or args.get("delivery") or default).lower()
+    return delivery if delivery in ("url", "base64") else default
+
+def public_base_url():
+    return PUBLIC_BASE_URL or request.host_url.rstrip("/")
+
+def image_url_for(image_id, delivery, base_url=None):
+    """Signed link to a stored image, or a data URI for base64 delivery"""
+    if delivery == "base64":
+        return f"data:{IMAGE_STORE.mimetype(image_id)};base64,{IMAGE_STORE.read_base64(image_id)}"
+    return IMAGE_STORE.signed_url(image_id, base_url or public_base_url())
+
+def present_image(image, delivery, base_url=None):
+    """Client view of a generated image: image_id becomes a fresh signed
+    image_url (and base64_image for legacy delivery)"""
+    if "image_id" not in image:
+        return image
+    image = dict(image)
+    image.pop("source_id", None)
+    image_id = image.pop("image_id")
+    image["image_url"] = IMAGE_STORE.signed_url(image_id, base_url or public_base_url())
+    if "thumbnail_id" in image:
+        image["thumbnail_url"] = IMAGE_STORE.signed_url(image.pop("thumbnail_id"), base_url or public_base_url())
+    if delivery == "base64":
+        with stage_timer("base64_encode"):
+            image["base64_image"] = IMAGE_STORE.read_base64(image_id)
+    return image
+
+def images_available(images):
+    """False once any stored image behind a cached response has been purged"""
+    return all(IMAGE_STORE.path(image.get("source_id", image["image_id"])) for image in images if "image_id" in image)
+
+# --- Image Generation ---
+def build_sketch_prompt(raw_text):
+    """Prompt used by /generate-text2image-sketches for one shape"""
+    return (
+            f"An image illustrating the core ideas of a UX brainstorming session. "
+            f"Theme: '{raw_text}'. "
+            f"Create a clean, high-quality, professional image that visually represents the theme. "
+            f"Can include people, objects, or environments. Use simple, clear composition with a modern aesthetic. "
+            f"Minimal visual clutter. No text. Neutral or soft background. "
+            f"Design should support UX ideation by conveying the concept in an intuitive and visually engaging way."
+    )
+
+def build_image_idea_prompt(prompt, prompt_override=""):
+    """Prompt used by /generate-image-ideas for one prompt string"""
+    if prompt_override:
+        if "{content}" in prompt_override:
+            return prompt_override.replace("{content}", prompt)
+        return f"{prompt_override}. Context: {prompt}"
+    return (
+        f"Create a clean, high-quality image that visually represents this theme: '{prompt}'. "
+        f"Depict a realistic scene or metaphor involving people, environments, or objects. "
+        f"The image should have a modern, simple aesthetic with minimal visual clutter. "
+        f"There should be absolutely no text, labels, signs, symbols, characters, or written language in the image. "
+        f"Do not include UI elements, instructions, buttons, or any form of on-screen text. "
+        f"The image should have one clear subject and a neutral or soft background."
+    )
+
+def generate_sketch(client, shape, variant=None):
+    """Generate the sketch for one shape, put it in the image store and
+    render it in `variant`"""
+    raw_text = shape["text"]
+    logger.info(f"Generating image for: {raw_text[:50]}...")
+
+    image_params = {
+        "prompt": build_sketch_prompt(raw_text),
+        "size": IMAGE_SIZE,
+        "n": 1
+    }
+    # Add quality parameter if using compatible model
+    if IMAGE_MODEL == "dall-e-3":
+        image_params["quality"] = IMAGE_QUALITY
+
+    with stage_timer("openai_image"):
+        response = openai_request(
+            client.images.with_raw_response.generate, IMAGE_MODEL, PRIORITY_BULK, idempotent=False,
+            **image_params, timeout=IMAGE_PROMPT_TIMEOUT
+        )
+    image = response.data[0]
+    image_id = store_generated_image(image)
+
+    logger.info(f"Successfully generated image for {shape['id']}")
+    return process_image({
+        "id": shape["id"],
+        "prompt": raw_text,
+        "image_id": image_id
+    }, variant)
+
+def store_generated_image(image):
+    """Save an OpenAI image result (url or b64_json) to IMAGE_STORE; returns its id"""
+    if getattr(image, "b64_json", None):
+        with stage_timer("base64_decode"):
+            return IMAGE_STORE.save(base64.b64decode(image.b64_json))
+    if not getattr(image, "url", None):
+        raise RuntimeError("No image URL or base64 returned")
+
+    with stage_timer("image_download"):
+        with get_http_session("images").get(image.url, timeout=10, stream=True) as image_response:
+            UPSTREAM_RESPONSES.inc(upstream="images", status=image_response.status_code)
+            if image_response.status_code != 200:
+                raise RuntimeError(f"Failed to download image: {image_response.status_code}")
+            return IMAGE_STORE.save_response(image_response)
+
+def generate_image_idea(client, full_prompt, variant=None, n=1):
+    """Generate `n` images for one /generate-image-ideas prompt in a single
+    call. Each is returned as its OpenAI URL, or as {"image_id": ...} once
+    saved to IMAGE_STORE: always for base64 results, and for URLs when a
+    `variant` has to be rendered."""
+    logger.info(f"Generating {n} image(s) for prompt: {full_prompt[:60]}...")
+    with stage_timer("openai_image"):
+        rsp = openai_request(
+            client.images.with_raw_response.generate, IMAGE_MODEL, PRIORITY_BULK, idempotent=False,
+            prompt = full_prompt,
+            size = "1024x1024",
+            n = n,
+            timeout = IMAGE_PROMPT_TIMEOUT,
+            **({"quality": IMAGE_QUALITY} if IMAGE_MODEL == "dall-e-3" else {})
+        )
+    if not rsp.data:
+        raise RuntimeError("No image URL or base64 returned")
+    return [
+        img.url if getattr(img, "url", None) and variant is None
+        else process_image({"image_id": store_generated_image(img)}, variant)
+        for img in rsp.data
+    ]
+
+def get_images_per_prompt(data, args):
+    """Images per prompt for /generate-image-ideas: "imagesPerPrompt" from the
+    body or query string, capped at IMAGE_IDEAS_MAX_PER_PROMPT"""
+    value = (data or {}).get("imagesPerPrompt") or args.get("imagesPerPrompt") or IMAGE_IDEAS_PER_PROMPT
+    try:
+        return min(max(int(value), 1), IMAGE_IDEAS_MAX_PER_PROMPT)
+    except (TypeError, ValueError):
+        return IMAGE_IDEAS_PER_PROMPT
+
+def wants_image_groups(data, args):
+    """Requests opt into per-prompt groups and board positions with
+    "groups": true or ?groups=1"""
+    return data.get("groups") in (True, "1", "true") or args.get("groups") in ("1", "true")
+
+def image_idea_calls(prompt_count, per_prompt):
+    """(prompt index, n) for each upstream call: one call per prompt where the
+    model makes several images at once, else chunks of what it allows"""
+    step = IMAGE_MODEL_MAX_N.get(IMAGE_MODEL, 10)
+    return [
+        (index, min(step, per_prompt - start))
+        for index in range(prompt_count)
+        for start in range(0, per_prompt, step)
+    ]
+
+def get_image_idea_layout(data):
+    """Position and geometry the frontend places image ideas with"""
+    pos = data.get("positionData") or {
+        "x": 0, "y": 0, "origin": "center", "relativeTo": "canvas_center"
+    }
+    geo = dict(data.get("geometryData") or {"width": 600, "height": 600})
+    geo.setdefault("width", 600)
+    geo.setdefault("height", geo["width"])          # keeping it square.
+    return pos, geo
+
+def image_idea_position(pos, geo, row, column):
+    """Where the column-th image of the row-th prompt goes: one row per
+    prompt, with a gap between images"""
+    offset = geo["width"] + 50                      # maintaining a gap between images.
+    return {**pos, "x": pos.get("x", 0) + column * offset, "y": pos.get("y", 0) + row * (geo["height"] + 50)}
+
+def present_image_idea(result, delivery, base_url=None):
+    """URL for a generate_image_idea result"""
+    return image_url_for(result["image_id"], delivery, base_url) if isinstance(result, dict) else result
+
+def thumbnail_url_for(result, base_url=None):
+    """Signed thumbnail link for a generate_image_idea result, if one was rendered"""
+    if isinstance(result, dict) and "thumbnail_id" in result:
+        return IMAGE_STORE.signed_url(result["thumbnail_id"], base_url or public_base_url())
+    return None
+
+def sketch_shapes(content, items=()):
+    """Shapes ({"id", "text"}) to sketch: the direct content if given,
+    otherwise the text of the selected items"""
+    if content:
+        shape_items = [{"id": "direct_content", "text": content}]
+    else:
+        shape_items = [
+            {"id": item.get("id", "unknown"), "text": shape_text(item)}
+            for item in items if item.get("type") in SHAPE_TYPES
+        ]
+    shapes = [dict(shape, text=shape.get("text", "").strip()) for shape in shape_items]
+    return [shape for shape in shapes if shape["text"]]
+
+def resolve_sketch_shapes(board_id, content, selected_shape_ids):
+    return sketch_shapes(content, [] if content else BOARD_SNAPSHOTS.lookup(board_id, selected_shape_ids, SHAPE_TYPES))
+
+def image_prompts(fetched, free_txt):
+    """Prompt strings for /generate-image-ideas from fetch_board_items
+    outcomes and the free text, plus errors for items that couldn't be fetched"""
+    prompts = []
+    errors  = []
+
+    # 1. selected shapes
+    for _id, item, error in fetched:
+        if error:
+            logger.warning(f"Error fetching Miro item {_id}: {str(error)}")
+            errors.append({"id": _id, "error": str(error)})
+            continue
+        if item is None:
+            logger.warning("Couldn't fetch %s (404)", _id)
+            errors.append({"id": _id, "error": "Item not found"})
+            continue
+        if item.get("type") not in SHAPE_TYPES:
+            continue
+        extracted = item_prompt_text(item)
+        if extracted:
+            prompts.append(extracted)
+
+    # 2. free‑form text from request body.
+    if free_txt:
+        prompts.append(free_txt)
+
+    return prompts, errors
+
+def resolve_image_prompts(board_id, sel_ids, free_txt):
+    return image_prompts(fetch_board_items(board_id, sel_ids), free_txt)
+
+# --- Background Jobs ---
+class JobCancelled(Exception):
+    pass
+
+class JobQueueFull(Exception):
+    pass
+
+class Job:
+    """A long-running generation whose progress and partial results can be polled"""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.total = None
+        self.done = 0
+        self.results = []
+        self.errors = []
+        self.error = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def run_items(self, func, items, describe):
+        """Run func over items on the image pool, recording each result as it
+        finishes. `describe(item)` labels the error entry of a failed item."""
+        self.total = len(items)
+
+        def run(item):
+            if self.cancel_event.is_set():
+                raise JobCancelled()
+            return func(item)
+
+        for index, result, error in iter_bounded(
+                run, items, IMAGE_POOL, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT):
+            if isinstance(error, JobCancelled):
+                continue
+            with self._lock:
+                self.done += 1
+                if error:
+                    logger.error(f"Job {self.id} item {index} failed: {str(error)}")
+                    self.errors.append({"index": index, **describe(items[index]), "error": str(error)})
                 else:
-                    logger.error(f"Failed to download image: {image_response.status_code}")
+                    self.results.append({"index": index, **result})
+            JOBS.persist(self)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "type": self.kind,
+                "status": self.status,
+                "total": self.total,
+                "completed": len(self.results),
+                "failed": len(self.errors),
+                "progress": round(self.done / self.total, 3) if self.total else (1.0 if self.finished_at else 0.0),
+                "results": sorted(self.results, key=lambda result: result["index"]),
+                # Errors without an index happened before generation (e.g. Miro fetches)
+                "errors": sorted(self.errors, key=lambda error: error.get("index", -1)),
+                "error": self.error,
+                "createdAt": self.created_at,
+                "finishedAt": self.finished_at
+            }
+
+class JobStore:
+    """Runs jobs on a bounded background pool and keeps them for `ttl` seconds
+    after they finish. With a `shared` store factory (a DiskCache of its own,
+    apart from the evictable response cache), job snapshots are also written
+    there so any worker can answer GET /jobs/<id>. The store is only created
+    once a job needs it."""
+
+    def __init__(self, workers, max_pending, ttl, shared=None):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._shared_factory = shared
+        self._shared = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
 
+    @property
+    def shared(self):
+        if self._shared is None and self._shared_factory is not None:
+            with self._lock:
+                if self._shared is None:
+                    self._shared = self._shared_factory()
+        return self._shared
+
+    def submit(self, kind, fn, *args):
+        """Queue fn(job, *args) and return the new job"""
+        with self._lock:
+            self._purge()
+            pending = sum(1 for job in self._jobs.values() if job.finished_at is None)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs (max {self.max_pending})")
+            job = Job(kind)
+            self._jobs[job.id] = job
+        self.persist(job)
+        self._pool.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        if not job.cancel_event.is_set():
+            job.status = "running"
+            self.persist(job)
+            try:
+                fn(job, *args)
             except Exception as e:
-                logger.error(f"Error generating image for {shape['id']}: {str(e)}")
+                logger.exception(f"Job {job.id} failed")
+                job.error = str(e)
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+        else:
+            job.status = "failed" if job.error else "completed"
+        job.finished_at = time.time()
+        self.persist(job)
+        logger.info(f"Job {job.id} {job.status} in {job.finished_at - job.created_at:.2f}s")
+
+    def get(self, job_id):
+        """Snapshot of a job as a dict, or None if unknown or expired"""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        if self.shared is not None:
+            return self.shared.get(job_id)
+        return None
+
+    def cancel(self, job_id):
+        """Request cancellation; returns the job, or None if it isn't held by this worker"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job and job.finished_at is None:
+            job.cancel_event.set()
+            if job.status == "queued":
+                job.status = "cancelled"
+                self.persist(job)
+        return job
+
+    def persist(self, job):
+        if self.shared is not None:
+            self.shared.set(job.id, job.to_dict(), ttl=self.ttl)
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [i for i, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+JOBS = JobStore(
+    JOB_WORKERS, JOB_MAX_PENDING, JOB_RESULT_TTL,
+    partial(DiskCache, JOB_STORE_DIR, JOB_STORE_MAX_ENTRIES, JOB_STORE_MAX_BYTES, JOB_RESULT_TTL)
+    if JOB_BACKEND == "disk" else None
+)
+
+def present_job(job, delivery, base_url=None):
+    """Job snapshot with stored images turned into fresh signed URLs"""
+    if job["type"] == "generate-text2image-sketches":
+        results = [present_image(result, delivery, base_url) for result in job["results"]]
+    else:
+        results = [present_job_image_idea(result, delivery, base_url) for result in job["results"]]
+    return {**job, "results": results}
+
+def job_delivery(job, args):
+    """Delivery for a job's images: what the request it came from would get"""
+    return get_delivery(None, args, IMAGE_IDEAS_DELIVERY if job["type"] == "generate-image-ideas" else IMAGE_DELIVERY)
+
+def present_job_image_idea(result, delivery, base_url=None):
+    images = result.get("images", [])
+    presented = {k: v for k, v in result.items() if k != "images"}
+    presented["image_urls"] = [present_image_idea(image, delivery, base_url) for image in images]
+    if any(isinstance(image, dict) and "thumbnail_id" in image for image in images):
+        presented["thumbnail_urls"] = [thumbnail_url_for(image, base_url) for image in images]
+    return presented
+
+def wants_job(data, args):
+    """Requests opt into background processing with "async": true or ?async=1"""
+    return data.get("async") in (True, "1", "true") or args.get("async") in ("1", "true")
+
+def job_accepted(job):
+    return {"status": job.status, "jobId": job.id, "statusUrl": f"/jobs/{job.id}"}
+
+def run_sketch_job(job, board_id, content, selected_shape_ids, variant=None):
+    cache_params = {"content": content, "ids": ",".join(selected_shape_ids)}
+    cached = get_from_cache("generate-text2image-sketches", cache_params)
+    if cached and images_available(cached["images"]):
+        job.results = [{"index": index, **process_image(image, variant)} for index, image in enumerate(cached["images"])]
+        job.total = job.done = len(job.results)
+        return
+
+    shapes = resolve_sketch_shapes(board_id, content, selected_shape_ids)
+    client = get_openai_client()
+    job.run_items(partial(generate_sketch, client, variant=variant), shapes, lambda shape: {"id": shape["id"]})
+    if job.results and not job.errors and not job.cancel_event.is_set():
+        images = sorted(job.results, key=lambda result: result["index"])
+        save_to_cache("generate-text2image-sketches", cache_params, {
+            "status": "success",
+            "count": len(images),
+            "images": [{k: v for k, v in image.items() if k != "index"} for image in images]
+        })
+
+def run_image_ideas_job(job, board_id, sel_ids, free_txt, prompt_override, variant=None,
+                        per_prompt=IMAGE_IDEAS_PER_PROMPT):
+    prompts, errors = resolve_image_prompts(board_id, sel_ids, free_txt)
+    job.errors.extend(errors)
+    client = get_openai_client()
+
+    def generate(call):
+        index, n = call
+        images = generate_image_idea(client, build_image_idea_prompt(prompts[index], prompt_override), variant, n)
+        return {"prompt": prompts[index], "promptIndex": index, "images": images}
+
+    job.run_items(generate, image_idea_calls(len(prompts), per_prompt),
+                  lambda call: {"prompt": prompts[call[0]], "promptIndex": call[0]})
+
+# --- Startup & Warm-up ---
+STARTUP_PHASES = {}  # phase -> seconds after IMPORT_STARTED
+
+def startup_phase(phase):
+    """Record when this process first reached a cold-start phase: "import",
+    "app", "warm_up" or "first_response"."""
+    if phase not in STARTUP_PHASES:
+        seconds = STARTUP_PHASES.setdefault(phase, time.perf_counter() - IMPORT_STARTED)
+        logger.info(f"Startup: {phase.replace('_', ' ')} done after {seconds:.2f}s")
+
+def check_openai():
+    # Also loads the SDK and leaves a TLS connection in the client's pool
+    get_openai_client().models.retrieve(TEXT_MODEL, timeout=WARM_UP_TIMEOUT)
+
+def check_miro():
+    r = miro_get(f"{MIRO_API_BASE}/v1/oauth-token", timeout=WARM_UP_TIMEOUT)
+    if r.status_code != 200:
+        raise MiroAPIError(f"Miro token check failed: {r.status_code}", r.status_code)
+
+def check_semantic_cache():
+    np.zeros(1)
+
+def check_image_process():
+    # Loading Pillow and spawning the encoder processes takes a while; do it
+    # before the first image
+    image_processing.transcode
+    if IMAGE_PROCESS_WORKERS > 0:
+        pool = get_process_pool()
+        for future in [pool.submit(os.getpid) for _ in range(IMAGE_PROCESS_WORKERS)]:
+            future.result(timeout=WARM_UP_TIMEOUT)
+
+class WarmUp:
+    """Runs the startup checks in a background thread. Each check is
+    "pending", "ok" or the error it raised; the process is ready once all of
+    them pass. Failed checks run again when start() is called after
+    WARM_UP_RETRY_AFTER, so a blip at boot doesn't leave a worker unready."""
+
+    def __init__(self, checks):
+        self.checks = checks
+        self.results = {}
+        self._thread = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return all(self.results.get(name) == "ok" for name in self.checks)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and (self._thread.is_alive() or self.ready
+                                             or time.monotonic() - (self._finished or 0) < WARM_UP_RETRY_AFTER):
+                return
+            self._thread = threading.Thread(target=self._run, name="warm-up", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        names = [name for name in self.checks if self.results.get(name) != "ok"]
+        for name in names:
+            self.results[name] = "pending"
+        for name, (_, error) in zip(names, run_bounded(lambda name: self.checks[name](), names,
+                                                       MIRO_POOL, len(names))):
+            self.results[name] = "ok" if error is None else f"{type(error).__name__}: {error}"
+            if error is not None:
+                logger.warning(f"Warm-up check {name} failed: {self.results[name]}")
+        self._finished = time.monotonic()
+        if self.ready:
+            startup_phase("warm_up")
+
+    def after_fork(self):
+        # gunicorn --preload: the parent's thread and connections don't survive
+        # the fork, so a worker starts over
+        started = self._thread is not None
+        self.results, self._thread, self._lock = {}, None, threading.Lock()
+        if started:
+            self.start()
+
+WARMUP = WarmUp({
+    name: check for name, check in (
+        ("openai", check_openai),
+        ("miro", check_miro),
+        ("semantic_cache", check_semantic_cache if SEMANTIC_CACHE is not None else None),
+        ("image_process", check_image_process
+         if IMAGE_OUTPUT_FORMAT != "original" and PILLOW_INSTALLED else None)
+    ) if check is not None
+})
+os.register_at_fork(after_in_child=WARMUP.after_fork)
+
+@METRICS.collector
+def startup_metrics():
+    return [(f"konzepta_startup_{phase}_seconds", f"Seconds from import to {phase.replace('_', ' ')}", "gauge",
+             seconds) for phase, seconds in STARTUP_PHASES.items()] + [
+        ("konzepta_ready", "1 once every warm-up check has passed", "gauge", int(WARMUP.ready))
+    ]
+
+# --- Request Handling ---
+# Parsing, validation and response building for the routes, shared by the
+# Flask app below and the ASGI app in asgi.py. Each front end only does the
+# upstream I/O and the waiting, its own way; bodies returned as dicts or
+# (body, status) tuples are turned into JSON by either framework.
+class ApiError(Exception):
+    """A request a route turns away; answered with {"error": message} plus
+    `extra` fields and `status`"""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+    def response(self):
+        return {"error": str(self), **self.extra}, self.status
+
+def service_info():
+    return {
+        "status": "ok",
+        "name": "AI Ideation Assistant API",
+        "version": "1.0.0",
+        "endpoints": [
+            "/health",
+            "/ready",
+            "/generate-ideas",
+            "/generate-ideas/batch",
+            "/generate-image-ideas",
+            "/generate-text2image-sketches",
+            "/jobs/<id>",
+            "/images/<id>",
+            *(["/webhooks/miro"] if SPECULATIVE_ENABLED else []),
+            "/metrics"
+        ]
+    }
+
+def health_status():
+    return {
+        "status": "ok",
+        "timestamp": time.time(),
+        "service": "miro-openai-api",
+        "cache": REQUEST_CACHE.stats()
+    }
+
+def readiness(warmup):
+    """/ready body and status for a WarmUp (or the ASGI app's AsyncWarmUp),
+    starting its checks if they haven't run or some failed"""
+    warmup.start()
+    ready = warmup.ready
+    return {
+        "status": "ready" if ready else "warming_up",
+        "checks": warmup.results,
+        "startup_seconds": {phase: round(seconds, 3) for phase, seconds in STARTUP_PHASES.items()}
+    }, 200 if ready else 503
+
+def preflight_headers(origin):
+    return {
+        'Access-Control-Allow-Origin': origin or '*',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+    }
+
+class IdeasRequest:
+    """A /generate-ideas request: the note's prompt and where suggestions
+    for it may already be waiting"""
+
+    def __init__(self, data, args, headers):
+        if not data:
+            raise ApiError("No JSON data provided")
+        content = (data.get("content") or "").strip()
+        self.custom_prompt = (data.get("prompt") or "").strip()
+        self.board_id = data.get("boardId", DEFAULT_BOARD_ID)
+        if not content:
+            raise ApiError("No sticky note content provided")
+
+        # We don't strictly require board_id for text generation, but we'll log it
+        if self.board_id:
+            logger.info(f"Processing text generation for board: {self.board_id}")
+        self.started = time.time()
+        clean_text = note_text(content)
+        self.prompt = build_ideas_prompt(clean_text, self.custom_prompt)
+        self.key = ideas_cache_key(self.prompt)
+        logger.info(f"Text Generation - Prompt (length: {len(self.prompt)})")
+        self.stream_format = get_stream_format(data, args, headers)
+        self.scope = semantic_scope(self.board_id, self.custom_prompt)
+        self.embedded = semantic_text(clean_text, self.custom_prompt)
+        self.vector = None
+
+    def take_cached(self):
+        """Suggestions pre-generated after a webhook reported this note's edit"""
+        if SPECULATIVE_ENABLED and SPECULATIVE_LAST_PROMPT and self.board_id:
+            SPECULATOR.remember_prompt(self.board_id, self.custom_prompt)
+        return take_speculative_ideas(self.prompt)
+
+    def lookup_similar(self, vector):
+        """Suggestions cached for a near-duplicate note on this board, given
+        the embedding of self.embedded"""
+        self.vector = vector
+        cached, similarity = SEMANTIC_CACHE.lookup(self.scope, vector, self.embedded)
+        CACHE_LOOKUPS.inc(endpoint="generate-ideas-semantic", result="miss" if cached is None else "hit")
+        if cached is not None:
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f})")
+        return cached
+
+    def finish(self, suggestions):
+        """Record freshly generated suggestions"""
+        discard_speculative_ideas(self.prompt)
+        if self.vector is not None:
+            SEMANTIC_CACHE.add(self.scope, self.vector, suggestions, self.embedded)
+
+    def response(self, suggestions):
+        self.finish(suggestions)
+        logger.info(f"AI response received (length: {len(suggestions)})")
+        logger.info(f"Text generation completed in {time.time() - self.started:.2f}s")
+        return {"suggestions": suggestions}
+
+    def failed(self, e):
+        logger.error(f"OpenAI API Error: {str(e)}")
+        return ApiError("OpenAI API error", 500, details=str(e))
+
+class BatchIdeasRequest:
+    """A /generate-ideas/batch request.
+
+    Expects {"notes": [{"id": ..., "content": ...}, ...], "prompt": ...} and
+    answers with one result per note in input order, each with either
+    "suggestions" (same format as /generate-ideas) or an "error".
+    """
+
+    def __init__(self, data):
+        if not data:
+            raise ApiError("No JSON data provided")
+        notes = data.get("notes")
+        if not isinstance(notes, list) or not notes:
+            raise ApiError("No notes provided")
+        if len(notes) > IDEAS_BATCH_MAX_NOTES:
+            raise ApiError(f"Too many notes (max {IDEAS_BATCH_MAX_NOTES})")
+        self.started = time.time()
+        self.custom_prompt = (data.get("prompt") or "").strip()
+
+        self.results = []
+        self.pending = {}  # short key sent to the model -> (result index, cleaned text)
+        for index, note in enumerate(notes):
+            note = note if isinstance(note, dict) else {"content": note}
+            self.results.append({"id": str(note.get("id", index))})
+            text = note_text(str(note.get("content") or ""))
+            if text:
+                self.pending[f"n{index + 1}"] = (index, text)
+            else:
+                self.results[index]["error"] = "No sticky note content provided"
+
+        keys = list(self.pending)
+        self.chunks = [
+            {key: self.pending[key][1] for key in keys[i:i + IDEAS_BATCH_SIZE]}
+            for i in range(0, len(keys), IDEAS_BATCH_SIZE)
+        ]
+        self.retry_keys = []
+        logger.info(f"Batch text generation - {len(keys)} notes in {len(self.chunks)} completions")
+
+    def add_chunks(self, outcomes):
+        """Take the (ideas, error) of each chunk's completion. Notes the
+        batched completions dropped are left in retry_prompts() to be run
+        one by one, so a single bad note can't take its whole chunk down."""
+        ideas_by_key = {}
+        for chunk, (ideas, error) in zip(self.chunks, outcomes):
+            if error:
+                logger.error(f"Batch completion failed for {len(chunk)} notes: {str(error)}")
+            else:
+                ideas_by_key.update(ideas)
+        for key, ideas in ideas_by_key.items():
+            index = self.pending[key][0]
+            self.results[index]["suggestions"] = format_suggestions(ideas)
+            self.results[index]["ideas"] = ideas
+        self.retry_keys = [key for key in self.pending if key not in ideas_by_key]
+        if self.retry_keys:
+            logger.info(f"Retrying {len(self.retry_keys)} notes individually")
+
+    def retry_prompts(self):
+        return [build_ideas_prompt(self.pending[key][1], self.custom_prompt) for key in self.retry_keys]
+
+    def add_retried(self, outcomes):
+        """Take the (suggestions, error) of each retry_prompts() completion"""
+        for key, (suggestions, error) in zip(self.retry_keys, outcomes):
+            index = self.pending[key][0]
+            if error:
+                self.results[index]["error"] = str(error)
+            else:
+                self.results[index]["suggestions"] = suggestions
+
+    def response(self):
+        failed = sum(1 for result in self.results if "error" in result)
+        logger.info(f"Batch text generation completed in {time.time() - self.started:.2f}s ({failed} failed)")
+        return {
+            "status": "success",
+            "count": len(self.results) - failed,
+            "failed": failed,
+            "results": self.results
+        }
+
+class SketchRequest:
+    """A /generate-text2image-sketches request. Images are presented for
+    `base_url`, the public address of the app that received it."""
+    endpoint = "generate-text2image-sketches"
+
+    def __init__(self, data, args, headers, base_url):
+        if not data:
+            raise ApiError("No JSON data provided")
+        self.selected_shape_ids = data.get("selectedShapeIds", [])
+        self.content = data.get("content", "")
+        # Use board ID from request if provided, otherwise fall back to env variable
+        self.board_id = data.get("boardId", DEFAULT_BOARD_ID)
+        if not self.board_id:
+            raise ApiError("No board ID provided in request. Please specify 'boardId' parameter.")
+        logger.info(f"Using board ID: {self.board_id}")
+        logger.info(f"Image Generation - Processing request - IDs: {len(self.selected_shape_ids)}, "
+                    f"Content: {bool(self.content)}")
+        if not self.content and not self.selected_shape_ids:
+            raise ApiError("No content or shape IDs provided")
+
+        self.started = time.time()
+        self.variant = get_image_variant(data, args)
+        self.wants_job = wants_job(data, args)
+        self.delivery = get_delivery(data, args)
+        self.base_url = base_url
+        self.stream_format = get_stream_format(data, args, headers)
+        self.cache_params = {"content": self.content, "ids": ",".join(self.selected_shape_ids)}
+        # Identical requests already in flight share one set of generations
+        self.key = get_cache_key(self.endpoint, {
+            **self.cache_params, "model": IMAGE_MODEL, "size": IMAGE_SIZE,
+            "variant": self.variant and self.variant.key
+        })
+        self.shapes = []
+        self._images = []
+        self._errors = []
+
+    def submit_job(self):
+        """Run the request as a background job instead; returns the 202 reply"""
+        try:
+            job = JOBS.submit(self.endpoint, run_sketch_job,
+                              self.board_id, self.content, self.selected_shape_ids, self.variant)
+        except JobQueueFull as e:
+            raise ApiError(str(e), 503)
+        return job_accepted(job), 202
+
+    def present(self, image):
+        return present_image(process_image(image, self.variant), self.delivery, self.base_url)
+
+    def cached(self):
+        """Cached result with its images presented (rendered again if this
+        request wants another variant), or None"""
+        cached = get_from_cache(self.endpoint, self.cache_params)
+        if cached and images_available(cached["images"]):
+            return {**cached, "images": [self.present(image) for image in cached["images"]]}
+        return None
+
+    def cached_events(self, cached):
+        for index, image in enumerate(cached["images"]):
+            yield "image", {"index": index, **image}
+        yield "done", {"status": "success", "count": len(cached["images"]), "errors": 0}
+
+    def resolve(self, items=()):
+        """Set the shapes to sketch from the direct content or, without it,
+        the selected board items"""
+        self.shapes = sketch_shapes(self.content, items)
+        self._images = [None] * len(self.shapes)
+        return self.shapes
+
+    def no_shapes_events(self):
+        yield "done", {"status": "no_valid_shapes_found", "count": 0, "errors": 0}
+
+    def add(self, index, image, error):
+        """Take a streamed shape's outcome; returns its event"""
+        if error:
+            logger.error(f"Error generating image for {self.shapes[index]['id']}: {str(error)}")
+            self._errors.append({"id": self.shapes[index]["id"], "error": str(error)})
+            return "error", {"index": index, **self._errors[-1]}
+        self._images[index] = image
+        return "image", {"index": index, **self.present(image)}
+
+    def done(self):
+        """Final event of a streamed response, caching it if every image was made"""
+        images = [image for image in self._images if image]
+        if images and not self._errors:
+            save_to_cache(self.endpoint, self.cache_params, {
+                "status": "success",
+                "count": len(images),
+                "images": images
+            })
+        return "done", {"status": "success", "count": len(images), "errors": len(self._errors)}
+
+    def collect(self, outcomes):
+        """Result from the (image, error) of every shape, cached unless some
+        images failed and are worth retrying"""
+        generated_images = []
+        errors = []
+        for shape, (image, error) in zip(self.shapes, outcomes):
+            if error:
+                logger.error(f"Error generating image for {shape['id']}: {str(error)}")
+                errors.append({"id": shape["id"], "error": str(error)})
+            else:
+                generated_images.append(image)
 
         result = {
             "status": "success",
             "count": len(generated_images),
             "images": generated_images
         }
-        
-        # Cache the result
-        if generated_images:
-            save_to_cache("generate-text2image-sketches", cache_params, result)
-            
-        # Add timing info
-        processing_time = time.time() - start_time
-        logger.info(f"Image generation completed in {processing_time:.2f}s")
-        
-        return jsonify(result)
+        if errors:
+            result["errors"] = errors
+        if generated_images and not errors:
+            save_to_cache(self.endpoint, self.cache_params, result)
+        return result
 
-    except Exception as e:
+    def response(self, result):
+        logger.info(f"Image generation completed in {time.time() - self.started:.2f}s")
+        return {**result, "images": [present_image(image, self.delivery, self.base_url) for image in result["images"]]}
+
+    def failed(self, e):
         logger.error(f"Image generation error: {str(e)}")
         logger.error(traceback.format_exc())
-        return jsonify({"error": "Server error", "details": str(e)}), 500
+        return ApiError("Server error", 500, details=str(e))
 
-@app.route('/generate-image-ideas', methods=['POST'])
-def generate_image_ideas():
-    """Generate 3 image ideas for each prompt (free text or selected shapes)
-       and return their URLs for the frontend to place on the board."""
-    t0 = time.time()
+class ImageIdeasRequest:
+    """A /generate-image-ideas request: image ideas for each prompt (free
+    text or selected shapes), IMAGE_IDEAS_PER_PROMPT of them unless
+    "imagesPerPrompt" says otherwise, returned as URLs; grouped by prompt
+    with a board position for each when the request asks for "groups"."""
+    endpoint = "generate-image-ideas"
 
-    try:
-        # -------- request & sanity checks --------
-        data      = request.get_json(force=True) or {}
-        sel_ids   = data.get("selectedShapeIds", [])
-        free_txt  = (data.get("content") or "").strip()
-        board_id  = data.get("boardId") or DEFAULT_BOARD_ID
-        if not board_id:
-            return jsonify(error="No board ID provided"), 400
-        if not sel_ids and not free_txt:
-            return jsonify(error="No content or shape IDs provided"), 400
+    def __init__(self, data, args, headers, base_url):
+        data = data or {}
+        self.sel_ids  = data.get("selectedShapeIds", [])
+        self.free_txt = (data.get("content") or "").strip()
+        self.board_id = data.get("boardId") or DEFAULT_BOARD_ID
+        if not self.board_id:
+            raise ApiError("No board ID provided")
+        if not self.sel_ids and not self.free_txt:
+            raise ApiError("No content or shape IDs provided")
 
+        self.started = time.time()
         # -------- placement & geometry --------
-        pos = data.get("positionData") or {
-            "x": 0, "y": 0, "origin": "center", "relativeTo": "canvas_center"
-        }
-        geo = data.get("geometryData") or {"width": 600, "height": 600}
-        geo.setdefault("height", geo["width"])          # keeping it square.
-        offset = geo["width"] + 50                      # maintaining a gap between images.
+        self.pos, self.geo = get_image_idea_layout(data)
+        self.per_prompt = get_images_per_prompt(data, args)
+        self.grouped = wants_image_groups(data, args)
+        self.prompt_override = (data.get("prompt") or "").strip()
+        self.variant = get_image_variant(data, args)
+        self.wants_job = wants_job(data, args)
+        self.delivery = get_delivery(data, args, IMAGE_IDEAS_DELIVERY)
+        self.base_url = base_url
+        self.stream_format = get_stream_format(data, args, headers)
+        self.prompts = []
+        self.full_prompts = []
+        self.errors = []
+        self.calls = []
+        self._placed = []
 
-        # -------- gather prompt strings --------
-        prompts      = []
-        miro_headers = {"Authorization": f"Bearer {MIRO_TOKEN}",
-                        "accept": "application/json"}
+    def submit_job(self):
+        """Run the request as a background job instead; returns the 202 reply"""
+        try:
+            job = JOBS.submit(self.endpoint, run_image_ideas_job, self.board_id, self.sel_ids, self.free_txt,
+                              self.prompt_override, self.variant, self.per_prompt)
+        except JobQueueFull as e:
+            raise ApiError(str(e), 503, status="error")
+        return job_accepted(job), 202
 
-        def clean(text: str) -> str:
-            return html.unescape(clean_html(text or "")).strip()
+    def resolve(self, fetched):
+        """Set the prompts from fetch_board_items outcomes for sel_ids and the
+        free text; returns them"""
+        self.prompts, self.errors = image_prompts(fetched, self.free_txt)
+        self.full_prompts = [build_image_idea_prompt(prompt, self.prompt_override) for prompt in self.prompts]
+        self.calls = image_idea_calls(len(self.prompts), self.per_prompt)
+        self._placed = [0] * len(self.prompts)
+        return self.prompts
 
-        # 1. selected shapes
-        for _id in sel_ids:
-            try:
-                r = requests.get(f"https://api.miro.com/v2/boards/{board_id}/items/{_id}",
-                                headers=miro_headers, timeout=8)
-                if r.status_code != 200:
-                    logger.warning("Couldn't fetch %s (%s)", _id, r.status_code)
-                    continue
-                item = r.json()
-                if item.get("type") not in {"sticky_note", "shape", "text"}:
-                    continue
-                # try a few fields in order
-                candidates = [
-                    item.get("data", {}).get("content"),
-                    item.get("data", {}).get("plainText"),
-                    item.get("text"),
-                    item.get("title")
-                ]
-                extracted = next((clean(c) for c in candidates if clean(c)), "")
-                if extracted:
-                    prompts.append(extracted)
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"Error fetching Miro item {_id}: {str(e)}")
+    def no_prompts(self):
+        return {"status": "no_valid_shapes_found", **({"errors": self.errors} if self.errors else {})}, 200
+
+    @property
+    def key(self):
+        # Identical requests already in flight share one set of generations
+        return get_cache_key(self.endpoint, {
+            "prompts": self.prompts, "prompt": self.prompt_override, "model": IMAGE_MODEL, "size": "1024x1024",
+            "variant": self.variant and self.variant.key, "per_prompt": self.per_prompt
+        })
+
+    def error_events(self):
+        """Events for the items that couldn't be fetched"""
+        return [("error", error) for error in self.errors]
+
+    def add(self, call_index, images, error):
+        """Take a streamed call's outcome; returns its events"""
+        index = self.calls[call_index][0]
+        if error:
+            logger.error(f"Error generating image for prompt '{self.prompts[index][:30]}': {str(error)}")
+            return [("error", {"index": index, "prompt": self.prompts[index], "error": str(error)})]
+        events = []
+        for image in images:
+            thumbnail_url = thumbnail_url_for(image, self.base_url)
+            events.append(("image", {
+                "index": index,
+                "prompt": self.prompts[index],
+                "image_url": present_image_idea(image, self.delivery, self.base_url),
+                **({"thumbnail_url": thumbnail_url} if thumbnail_url else {}),
+                **({"imageIndex": self._placed[index],
+                    "positionData": image_idea_position(self.pos, self.geo, index, self._placed[index])}
+                   if self.grouped else {})
+            }))
+            self._placed[index] += 1
+        return events
+
+    def done(self):
+        return "done", {
+            "status": "success",
+            "count": sum(self._placed),
+            **({"geometryData": self.geo} if self.grouped else {}),
+            "processing_time_seconds": round(time.time() - self.started, 2)
+        }
+
+    def response(self, outcomes):
+        """Reply from the (images, error) of every call"""
+        errors = list(self.errors)
+        groups = [{"prompt": prompt, "image_urls": [], "positions": []} for prompt in self.prompts]
+        for (index, _), (images, error) in zip(self.calls, outcomes):
+            if error:
+                logger.error(f"Error generating image for prompt '{self.prompts[index][:30]}': {str(error)}")
+                errors.append({"prompt": self.prompts[index], "error": str(error)})
                 continue
+            group = groups[index]
+            for image in images:
+                group["positions"].append(image_idea_position(self.pos, self.geo, index, len(group["image_urls"])))
+                group["image_urls"].append(present_image_idea(image, self.delivery, self.base_url))
+                if self.variant and self.variant.thumbnail:
+                    group.setdefault("thumbnail_urls", []).append(thumbnail_url_for(image, self.base_url))
+
+        image_urls = [url for group in groups for url in group["image_urls"]]
+        thumbnail_urls = [url for group in groups for url in group.get("thumbnail_urls", [])]
+        return {
+            "status": "success",
+            "image_urls": image_urls,
+            **({"groups": groups, "geometryData": self.geo} if self.grouped else {}),
+            **({"thumbnail_urls": thumbnail_urls} if self.variant and self.variant.thumbnail else {}),
+            "processing_time_seconds": round(time.time() - self.started, 2),
+            **({"errors": errors} if errors else {})
+        }
+
+    def failed(self, e):
+        logger.exception("generate-image-ideas failed")
+        return ApiError(str(e), 500, status="error")
+
+def job_status(job_id, args, base_url):
+    """Progress and results-so-far of a background generation job"""
+    job = JOBS.get(job_id)
+    if not job:
+        raise ApiError("Job not found", 404)
+    return present_job(job, job_delivery(job, args), base_url)
+
+def cancel_job_status(job_id, args, base_url):
+    """Cancel a job; images already generated stay in its results"""
+    job = JOBS.cancel(job_id)
+    if job:
+        job = job.to_dict()
+        return present_job(job, job_delivery(job, args), base_url)
+    if JOBS.get(job_id):
+        raise ApiError("Job is running on another worker", 409)
+    raise ApiError("Job not found", 404)
+
+def stored_image_path(image_id, args):
+    """Path of a stored image, for holders of a signed, unexpired URL"""
+    if not IMAGE_STORE.verify(image_id, args.get("expires"), args.get("sig")):
+        raise ApiError("Invalid or expired image link", 403)
+    path = IMAGE_STORE.path(image_id)
+    if not path:
+        raise ApiError("Image not found", 404)
+    return path
+
+# --- Request Instrumentation ---
+# Routes are registered on a blueprint; create_app() builds the Flask app
+api = Blueprint("api", __name__)
+# Endpoints that don't count as the first successful response
+PROBE_ENDPOINTS = ("root", "health_check", "readiness_check", "metrics")
+
+def endpoint_name():
+    """Route function name, without the blueprint prefix"""
+    return (request.endpoint or "unknown").rpartition(".")[2]
+
+@api.before_app_request
+def start_request_metrics():
+    request.environ["konzepta.timings"] = begin_request_timings()
+    REQUESTS_IN_FLIGHT.inc(endpoint=endpoint_name())
+
+@api.after_app_request
+def add_server_timing(response):
+    timings = request.environ.get("konzepta.timings")
+    if timings is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - timings.started,
+                                endpoint=endpoint_name(), status=response.status_code)
+        if METRICS_SERVER_TIMING:
+            response.headers["Server-Timing"] = timings.header()
+    if response.status_code < 300 and endpoint_name() not in PROBE_ENDPOINTS:
+        startup_phase("first_response")
+    return response
+
+@api.teardown_app_request
+def finish_request_metrics(exc=None):
+    # Streamed responses tear down once more after the body is sent; count once
+    if request.environ.pop("konzepta.timings", None) is not None:
+        REQUESTS_IN_FLIGHT.dec(endpoint=endpoint_name())
+
+# --- Error Handling ---
+@api.app_errorhandler(ApiError)
+def handle_api_error(e):
+    return e.response()
+
+@api.app_errorhandler(UpstreamRateLimited)
+def handle_rate_limited(e):
+    logger.warning(f"Upstream rate limited: {str(e)}")
+    return rate_limited_response(e)
+
+@api.app_errorhandler(Exception)
+def handle_exception(e):
+    if isinstance(e, HTTPException):
+        # Unknown routes and wrong methods keep their 404/405
+        return e
+    logger.error(f"Unhandled exception: {str(e)}")
+    logger.error(traceback.format_exc())
+    return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+# --- Routes ---
+@api.route('/', methods=['GET'])
+def root():
+    """Root endpoint that simply returns a status message"""
+    return service_info()
 
-        # 2. free‑form text from request body.
-        if free_txt:
-            prompts.append(free_txt)
+@api.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return health_status()
+
+@api.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once the SDKs are loaded, upstream connections are
+    open and both credentials were accepted, 503 until then. Starts the
+    warm-up if WARM_UP is off, and retries checks that failed."""
+    return readiness(WARMUP)
 
-        if not prompts:
-            return jsonify(status="no_valid_shapes_found"), 200
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this worker process"""
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+@api.route('/generate-ideas', methods=['POST'])
+def generate_ideas():
+    """Generate text ideas based on sticky note content"""
+    ideas = IdeasRequest(request.get_json(silent=True), request.args, request.headers)
+    client = get_openai_client()
+    cached = ideas.take_cached()
+    # Check the semantic cache for a near-duplicate note on this board
+    if cached is None and SEMANTIC_CACHE is not None:
+        try:
+            cached = ideas.lookup_similar(embed_text(client, ideas.embedded))
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {str(e)}")
+
+    if ideas.stream_format:
+        if cached is not None:
+            return stream_response(stream_cached_ideas(cached), ideas.stream_format)
+
+        def events():
+            for event, payload in stream_ideas(client, ideas.prompt):
+                if event == "done":
+                    ideas.finish(payload["suggestions"])
+                yield event, payload
+        return stream_response(events(), ideas.stream_format)
+
+    if cached is not None:
+        return {"suggestions": cached}
+    try:
+        # Identical requests already in flight share one completion
+        generate = hedged_suggestions if TEXT_HEDGE_ENABLED else generate_suggestions
+        suggestions = INFLIGHT.do(ideas.key, lambda: generate(client, ideas.prompt))
+    except UpstreamRateLimited:
+        raise
+    except Exception as e:
+        raise ideas.failed(e) from e
+    return ideas.response(suggestions)
+
+@api.route('/generate-ideas/batch', methods=['POST'])
+def generate_ideas_batch():
+    """Generate text ideas for many sticky notes, several notes per completion"""
+    batch = BatchIdeasRequest(request.get_json(silent=True))
+    client = get_openai_client()
+    batch.add_chunks(run_bounded(
+        lambda chunk: generate_batch_chunk(client, chunk, batch.custom_prompt),
+        batch.chunks, TEXT_POOL, IDEAS_BATCH_CONCURRENCY
+    ))
+    batch.add_retried(run_bounded(
+        lambda prompt: generate_suggestions(client, prompt),
+        batch.retry_prompts(), TEXT_POOL, IDEAS_BATCH_CONCURRENCY
+    ))
+    return batch.response()
+
+@api.route('/generate-text2image-sketches', methods=['POST', 'OPTIONS'])
+def generate_text2image_sketches():
+    """Generate images based on selected sticky notes or shapes using OpenAI DALL-E"""
+    if request.method == 'OPTIONS':
+        return "", 200, preflight_headers(request.headers.get('Origin'))
+
+    sketches = SketchRequest(request.get_json(silent=True), request.args, request.headers, public_base_url())
+    # Long selections can run as a background job instead
+    if sketches.wants_job:
+        return sketches.submit_job()
+
+    try:
+        cached = sketches.cached()
+        if cached is not None:
+            if sketches.stream_format:
+                return stream_response(sketches.cached_events(cached), sketches.stream_format)
+            return cached
+
+        try:
+            shapes = sketches.resolve(
+                [] if sketches.content else
+                BOARD_SNAPSHOTS.lookup(sketches.board_id, sketches.selected_shape_ids, SHAPE_TYPES)
+            )
+        except MiroAPIError as e:
+            return {"error": str(e)}, 500
+        if not shapes:
+            if sketches.stream_format:
+                return stream_response(sketches.no_shapes_events(), sketches.stream_format)
+            return {"status": "no_valid_shapes_found"}, 200
 
-        # -------- generate images and return URLs --------
         client = get_openai_client()
-        image_urls = []
+        generate = partial(generate_sketch, client, variant=sketches.variant)
+        if sketches.stream_format:
+            def events():
+                for index, image, error in iter_bounded(
+                        generate, shapes, IMAGE_POOL, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT):
+                    yield sketches.add(index, image, error)
+                yield sketches.done()
+            return stream_response(events(), sketches.stream_format)
 
-        prompt_override = (data.get("prompt") or "").strip()
-        for prompt in prompts:
-            try:
-                if prompt_override:
-                    if "{content}" in prompt_override:
-                        full_prompt = prompt_override.replace("{content}", prompt)
-                    else:
-                        full_prompt = f"{prompt_override}. Context: {prompt}"
-                else:
-                    full_prompt = (
-                        f"Create a clean, high-quality image that visually represents this theme: '{prompt}'. "
-                        f"Depict a realistic scene or metaphor involving people, environments, or objects. "
-                        f"The image should have a modern, simple aesthetic with minimal visual clutter. "
-                        f"There should be absolutely no text, labels, signs, symbols, characters, or written language in the image. "
-                        f"Do not include UI elements, instructions, buttons, or any form of on-screen text. "
-                        f"The image should have one clear subject and a neutral or soft background."
-                    )
-                logger.info(f"Generating image for prompt: {full_prompt[:60]}...")
-                rsp = client.images.generate(
-                    model = IMAGE_MODEL,
-                    prompt = full_prompt,
-                    size = "1024x1024",
-                    n = 1,
-                    **({"quality": IMAGE_QUALITY} if IMAGE_MODEL == "dall-e-3" else {})
-                )
-                img = rsp.data[0]
-                if getattr(img, "url", None):
-                    image_urls.append(img.url)
-                elif getattr(img, "b64_json", None):
-                    image_urls.append(f"data:image/png;base64,{img.b64_json}")
-                else:
-                    logger.warning(f"No image URL or base64 returned for prompt: {full_prompt[:30]}")
-            except Exception as e:
-                logger.error(f"Error generating image for prompt '{prompt[:30]}': {str(e)}")
-                continue
+        result = INFLIGHT.do(sketches.key, lambda: sketches.collect(
+            run_bounded(generate, shapes, IMAGE_POOL, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT)
+        ))
+        return sketches.response(result)
 
-        return jsonify(
-            status="success",
-            image_urls=image_urls,
-            processing_time_seconds=round(time.time() - t0, 2)
-        )
+    except UpstreamRateLimited:
+        raise
+    except Exception as e:
+        raise sketches.failed(e) from e
+
+@api.route('/generate-image-ideas', methods=['POST'])
+def generate_image_ideas():
+    """Generate image ideas for the selected shapes or free text"""
+    ideas = ImageIdeasRequest(request.get_json(force=True, silent=True), request.args, request.headers,
+                              public_base_url())
+    # Long selections can run as a background job instead
+    if ideas.wants_job:
+        return ideas.submit_job()
 
+    try:
+        if not ideas.resolve(fetch_board_items(ideas.board_id, ideas.sel_ids)):
+            return ideas.no_prompts()
+
+        client = get_openai_client()
+
+        def generate(call):
+            index, n = call
+            return generate_image_idea(client, ideas.full_prompts[index], ideas.variant, n)
+
+        if ideas.stream_format:
+            def events():
+                yield from ideas.error_events()
+                for call_index, images, error in iter_bounded(
+                        generate, ideas.calls, IMAGE_POOL, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT):
+                    yield from ideas.add(call_index, images, error)
+                yield ideas.done()
+            return stream_response(events(), ideas.stream_format)
+
+        outcomes = INFLIGHT.do(ideas.key, lambda: run_bounded(
+            generate, ideas.calls, IMAGE_POOL, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT
+        ))
+        return ideas.response(outcomes)
+
+    except UpstreamRateLimited:
+        raise
     except Exception as e:
-        logger.exception("generate-image-ideas failed")
-        return jsonify(error=str(e), status="error"), 500
+        raise ideas.failed(e) from e
+
+def miro_webhook():
+    """Miro board events: keep board snapshots current and pre-generate
+    ideas for edited sticky notes. Only registered with SPECULATIVE_IDEAS."""
+    return handle_miro_webhook(request.get_data(), request.headers.get("X-Miro-Signature"), BOARD_SNAPSHOTS)
+
+if SPECULATIVE_ENABLED:
+    api.add_url_rule('/webhooks/miro', view_func=miro_webhook, methods=['POST'])
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    return job_status(job_id, request.args, public_base_url())
+
+@api.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    return cancel_job_status(job_id, request.args, public_base_url())
+
+@api.route('/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """Serve a stored image. Supports conditional requests (ETag) and byte ranges."""
+    path = stored_image_path(image_id, request.args)
+    # Content-addressed, so the digest is a strong ETag and the bytes never change
+    return send_file(path, mimetype=IMAGE_STORE.mimetype(image_id), conditional=True,
+                     etag=image_id.split(".")[0], max_age=IMAGE_URL_TTL)
+
+# --- App Factory ---
+def create_app(warm_up=None):
+    """Build the Flask app, e.g. `gunicorn "OpenAI_API:create_app()"`.
+
+    The OpenAI SDK, requests, numpy and Pillow load on first use. With
+    WARM_UP on (or warm_up=True), a background thread loads them, opens
+    upstream connections and checks credentials right away; otherwise the
+    first /ready call starts it. /ready reports when it is done.
+    """
+    from flask_cors import CORS
+
+    app = Flask(__name__)
+    if PROXY_HOPS:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS, x_host=PROXY_HOPS)
+    CORS(app, origins=CORS_ORIGINS, supports_credentials=True, methods=CORS_METHODS)
+    app.register_blueprint(api)
+    startup_phase("app")
+    if WARM_UP if warm_up is None else warm_up:
+        WARMUP.start()
+    return app
+
+def __getattr__(name):
+    # Keeps `OpenAI_API:app` and `from OpenAI_API import app` working; the app
+    # is only built when asked for, so asgi.py can import this module cheaply
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+startup_phase("import")
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5050))
     logger.info(f"Starting Miro OpenAI API Server on port {port}")
     logger.info(f"Text model: {TEXT_MODEL}, Image model: {IMAGE_MODEL}")
-    logger.info(f"CORS origins: {app.config['CORS_ORIGINS'] if 'CORS_ORIGINS' in app.config else 'Default'}")
-    app.run(debug=True, port=port, host='0.0.0.0')
+    logger.info(f"CORS origins: {', '.join(CORS_ORIGINS)}")
+    create_app().run(debug=True, port=port, host='0.0.0.0')
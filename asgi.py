@@ -0,0 +1,809 @@
+"""Asyncio (ASGI) serving mode for the Miro OpenAI API.
+
+Serves the same routes, JSON contracts and CORS rules as OpenAI_API.py, but
+upstream calls go through AsyncOpenAI and httpx, so one process can keep
+hundreds of image generations in flight without starving /health or
+/generate-ideas. Request parsing, validation and response building, prompts,
+caching and configuration are shared with the Flask app; its synchronous
+helpers (caches, job store, image files) are called through
+asyncio.to_thread so they never block the event loop.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5050
+"""
+import asyncio
+import base64
+import os
+import time
+import traceback
+from functools import partial
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+from quart import Quart, Response, g, jsonify, request, send_file
+from quart_cors import cors
+from werkzeug.exceptions import HTTPException
+
+from OpenAI_API import (
+    BOARD_SNAPSHOT_MAX_BOARDS, CORS_METHODS, CORS_ORIGINS, EMBEDDING_MODEL, HTTP_POOL_SIZE,
+    HTTP_RETRIES, IDEAS_BATCH_CONCURRENCY, IMAGE_MODEL, IMAGE_PROMPT_TIMEOUT, IMAGE_QUALITY,
+    IMAGE_REQUEST_CONCURRENCY, IMAGE_SIZE, IMAGE_STORE, IMAGE_URL_TTL, METRICS,
+    METRICS_SERVER_TIMING, MIRO_API_BASE, MIRO_FETCH_CONCURRENCY, MIRO_TOKEN, PRIORITY_BATCH,
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, PROBE_ENDPOINTS, PROXY_HOPS, PUBLIC_BASE_URL,
+    REQUESTS_IN_FLIGHT, REQUEST_SECONDS, SCHEDULER, SEMANTIC_CACHE, SHAPE_TYPES,
+    SPECULATIVE_ENABLED, STREAM_MIMETYPES, TEXT_FALLBACK_MODEL, TEXT_HEDGES, TEXT_HEDGE_ENABLED,
+    TEXT_LATENCY, TEXT_MODEL, UPSTREAM_MAX_RETRIES, UPSTREAM_MAX_WAIT, UPSTREAM_RESPONSES,
+    WARM_UP, WARM_UP_RETRY_AFTER, WARM_UP_TIMEOUT,
+    ApiError, BatchIdeasRequest, BoardSnapshot, IdeaStreamParser, IdeasRequest,
+    ImageIdeasRequest, MiroAPIError, SketchRequest, UpstreamRateLimited,
+    begin_request_timings, build_batch_ideas_prompt, build_sketch_prompt, cancel_job_status,
+    estimate_tokens, format_event, handle_miro_webhook, health_status, hedge_delay, job_status,
+    logger, parse_batch_ideas, preflight_headers, process_image, rate_limited_response,
+    readiness, record_token_usage, service_info, stage_timer, startup_phase, stored_image_path,
+    stream_cached_ideas
+)
+
+# Generations in flight across the whole process; cheap here since each one
+# is a coroutine rather than a thread.
+ASYNC_IMAGE_CONCURRENCY = int(os.environ.get("ASYNC_IMAGE_CONCURRENCY", 200))
+
+app = Quart(__name__)
+app = cors(app, allow_origin=CORS_ORIGINS, allow_credentials=True, allow_methods=CORS_METHODS)
+
+# --- Async clients ---
+# Created once the event loop is running and shared by every request.
+clients = {}
+
+@app.before_serving
+async def open_clients():
+    def transport():
+        limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+        return httpx.AsyncHTTPTransport(retries=HTTP_RETRIES, limits=limits)
+
+    # Retries are handled by call() so they respect the shared rate limits
+    clients["openai"] = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+    clients["miro"] = httpx.AsyncClient(
+        base_url=MIRO_API_BASE,
+        headers={"Authorization": f"Bearer {MIRO_TOKEN}", "accept": "application/json"},
+        transport=transport(),
+        timeout=10
+    )
+    clients["images"] = httpx.AsyncClient(transport=transport(), timeout=10, follow_redirects=True)
+    clients["image_slots"] = asyncio.Semaphore(ASYNC_IMAGE_CONCURRENCY)
+    startup_phase("app")
+    if WARM_UP:
+        WARMUP.start()
+
+@app.after_serving
+async def close_clients():
+    WARMUP.cancel()
+    await clients["openai"].close()
+    await clients["miro"].aclose()
+    await clients["images"].aclose()
+    clients.clear()
+
+# --- Concurrency Utilities ---
+async def iter_bounded(func, items, limit, timeout=None):
+    """Async counterpart of OpenAI_API.iter_bounded: runs the coroutine
+    function over items with at most `limit` in flight and yields
+    (index, result, error) as each finishes."""
+    slots = asyncio.Semaphore(max(1, limit))
+
+    async def run(index, item):
+        async with slots:
+            try:
+                return index, await asyncio.wait_for(func(item), timeout), None
+            except asyncio.TimeoutError:
+                return index, None, TimeoutError(f"Timed out after {timeout:.0f}s")
+            except Exception as e:
+                return index, None, e
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stop outstanding work if the consumer went away (e.g. a closed stream)
+        for task in tasks:
+            task.cancel()
+
+async def gather_bounded(func, items, limit, timeout=None):
+    """Like iter_bounded, but returns a list of (result, error) in input order"""
+    items = list(items)
+    outcomes = [(None, None)] * len(items)
+    async for index, result, error in iter_bounded(func, items, limit, timeout):
+        outcomes[index] = (result, error)
+    return outcomes
+
+async def as_async(events):
+    for event in events:
+        yield event
+
+def stream_response(events, fmt):
+    """Send (event, payload) pairs from an iterator or async iterator as SSE or NDJSON"""
+    if not hasattr(events, "__aiter__"):
+        events = as_async(events)
+
+    async def generate():
+        try:
+            async for event, payload in events:
+                yield format_event(event, payload, fmt)
+        except Exception as e:
+            logger.exception("Streaming response failed")
+            yield format_event("error", {"error": "Server error", "details": str(e)}, fmt)
+
+    response = Response(generate(), mimetype=STREAM_MIMETYPES[fmt])
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# --- Request Coalescing ---
+class SingleFlight:
+    """Async counterpart of OpenAI_API.SingleFlight"""
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, coro_fn):
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: a waiter giving up must not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._calls[key]
+
+INFLIGHT = SingleFlight()
+
+# --- Upstream Scheduling ---
+async def acquire_tokens(key, cost, priority, timeout):
+    """Take `cost` tokens from the shared SCHEDULER bucket for `key`, sleeping
+    on the event loop instead of blocking. The caller queues with blocked
+    Flask-side waiters and is served in the same priority/arrival order."""
+    bucket = SCHEDULER.bucket(key)
+    deadline = time.monotonic() + (UPSTREAM_MAX_WAIT if timeout is None else timeout)
+    ticket = bucket.enqueue(priority)
+    try:
+        while True:
+            wait_for = bucket.reserve(ticket, cost)
+            if not wait_for:
+                return
+            if time.monotonic() + wait_for > deadline:
+                raise UpstreamRateLimited(f"Rate limit for {key} exceeded", wait_for)
+            await asyncio.sleep(wait_for)
+    finally:
+        bucket.dequeue(ticket)
+
+async def acquire(key, priority=PRIORITY_INTERACTIVE, token_key=None, tokens=0, timeout=None):
+    """Async counterpart of SCHEDULER.acquire"""
+    with stage_timer("rate_limit_wait"):
+        await acquire_tokens(key, 1, priority, timeout)
+        if token_key:
+            try:
+                await acquire_tokens(token_key, tokens, priority, timeout)
+            except BaseException:
+                # The request never goes out; hand its request token back
+                SCHEDULER.bucket(key).refund(1)
+                raise
+
+async def call(key, fn, priority=PRIORITY_INTERACTIVE, token_key=None, tokens=0, idempotent=True):
+    """Async counterpart of SCHEDULER.call, for a coroutine function fn: the
+    same rate limits, retries and backoff, sleeping on the event loop"""
+    for attempt in range(UPSTREAM_MAX_RETRIES + 1):
+        await acquire(key, priority, token_key, tokens, SCHEDULER.wait_limit(key))
+        response = error = None
+        try:
+            response = await fn()
+        except (openai.APIStatusError, openai.APIConnectionError, httpx.TransportError) as e:
+            error = e
+        delay = SCHEDULER.retry_delay(key, attempt, response, error, token_key, idempotent)
+        if delay is None:
+            return response
+        await asyncio.sleep(delay)
+
+async def openai_request(create, model, priority, tokens=0, idempotent=True, **params):
+    """Async counterpart of OpenAI_API.openai_request"""
+    raw = await call(
+        f"openai:{model}",
+        lambda: create(model=model, **params),
+        priority,
+        token_key=f"openai-tokens:{model}" if tokens else None,
+        tokens=tokens,
+        idempotent=idempotent
+    )
+    result = raw.parse()
+    record_token_usage(model, getattr(result, "usage", None))
+    return result
+
+# --- Warm-up ---
+async def check_openai():
+    await clients["openai"].models.retrieve(TEXT_MODEL, timeout=WARM_UP_TIMEOUT)
+
+async def check_miro():
+    r = await miro_get("/v1/oauth-token", timeout=WARM_UP_TIMEOUT)
+    if r.status_code != 200:
+        raise MiroAPIError(f"Miro token check failed: {r.status_code}", r.status_code)
+
+class AsyncWarmUp:
+    """Async counterpart of OpenAI_API.WarmUp for this server's own clients:
+    opens their connections and checks both credentials as a task."""
+
+    def __init__(self, checks):
+        self.checks = checks
+        self.results = {}
+        self._task = None
+        self._finished = 0
+
+    @property
+    def ready(self):
+        return all(self.results.get(name) == "ok" for name in self.checks)
+
+    def start(self):
+        if self._task is not None and (not self._task.done() or self.ready
+                                       or time.monotonic() - self._finished < WARM_UP_RETRY_AFTER):
+            return
+        self._task = asyncio.create_task(self._run())
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        names = [name for name in self.checks if self.results.get(name) != "ok"]
+        for name in names:
+            self.results[name] = "pending"
+        errors = await asyncio.gather(*(self.checks[name]() for name in names), return_exceptions=True)
+        for name, error in zip(names, errors):
+            self.results[name] = "ok" if error is None else f"{type(error).__name__}: {error}"
+            if error is not None:
+                logger.warning(f"Warm-up check {name} failed: {self.results[name]}")
+        self._finished = time.monotonic()
+        if self.ready:
+            startup_phase("warm_up")
+
+WARMUP = AsyncWarmUp({"openai": check_openai, "miro": check_miro})
+
+# --- Miro Board Items ---
+async def miro_get(path, **kwargs):
+    """GET a Miro API path under the Flask app's shared Miro rate limit"""
+    with stage_timer("miro_fetch"):
+        return await call("miro", lambda: clients["miro"].get(path, **kwargs))
+
+async def fetch_board_item(board_id, item_id):
+    r = await miro_get(f"/v2/boards/{board_id}/items/{item_id}", timeout=8)
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise MiroAPIError(f"Failed to fetch Miro item {item_id}: {r.status_code}", r.status_code)
+    return r.json()
+
+async def fetch_board_items(board_id, item_ids):
+    """Fetch several board items concurrently; returns (item_id, item, error)"""
+    item_ids = list(dict.fromkeys(item_ids))
+    outcomes = await gather_bounded(
+        lambda item_id: fetch_board_item(board_id, item_id), item_ids, MIRO_FETCH_CONCURRENCY
+    )
+    return [(item_id, item, error) for item_id, (item, error) in zip(item_ids, outcomes)]
+
+class BoardSnapshotStore:
+    """Async counterpart of OpenAI_API.BoardSnapshotStore"""
+
+    def __init__(self, max_boards):
+        self.max_boards = max_boards
+        self._snapshots = {}
+
+    def _store(self, board_id, snapshot):
+        # Dicts keep insertion order, so re-inserting makes this the newest
+        self._snapshots.pop(board_id, None)
+        self._snapshots[board_id] = snapshot
+        while len(self._snapshots) > self.max_boards:
+            evicted = next(iter(self._snapshots))
+            del self._snapshots[evicted]
+
+    def apply_event(self, board_id, event_type, item):
+        snapshot = self._snapshots.get(board_id)
+        if snapshot is not None:
+            snapshot.apply(event_type, item)
+
+    async def lookup(self, board_id, item_ids, types=None):
+        item_ids = list(dict.fromkeys(item_ids))
+        snapshot = self._snapshots.get(board_id)
+        if snapshot is None:
+            snapshot = BoardSnapshot(board_id)
+        self._store(board_id, snapshot)
+        if types is not None:
+            known = snapshot.items_by_id
+            item_ids = [i for i in item_ids if i not in known or known[i].get("type") in types]
+
+        items = {}
+        for item_id, item, error in await fetch_board_items(board_id, item_ids):
+            if isinstance(error, UpstreamRateLimited):
+                raise error
+            if error:
+                logger.warning(f"Error fetching Miro item {item_id}: {str(error)}")
+            elif item:
+                items[item_id] = item
+                snapshot.add(item)
+            else:
+                snapshot.remove(item_id)
+        return [items[i] for i in item_ids if i in items]
+
+BOARD_SNAPSHOTS = BoardSnapshotStore(BOARD_SNAPSHOT_MAX_BOARDS)
+
+# --- Generation ---
+async def generate_suggestions(prompt, priority=PRIORITY_INTERACTIVE):
+    if TEXT_HEDGE_ENABLED:
+        with stage_timer("openai_chat"):
+            return (await race_completions(prompt, "complete")).text
+    with stage_timer("openai_chat"):
+        response = await openai_request(
+            clients["openai"].chat.completions.with_raw_response.create, TEXT_MODEL, priority,
+            tokens=estimate_tokens(prompt, 500),
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.9,
+            max_tokens=500
+        )
+    return response.choices[0].message.content
+
+async def embed_text(text):
+    with stage_timer("openai_embedding"):
+        response = await openai_request(
+            clients["openai"].embeddings.with_raw_response.create, EMBEDDING_MODEL, PRIORITY_INTERACTIVE,
+            input=text
+        )
+    return response.data[0].embedding
+
+async def generate_batch_chunk(notes, custom_prompt=""):
+    prompt = build_batch_ideas_prompt(notes, custom_prompt)
+    with stage_timer("openai_chat"):
+        response = await openai_request(
+            clients["openai"].chat.completions.with_raw_response.create, TEXT_MODEL, PRIORITY_BATCH,
+            tokens=estimate_tokens(prompt, 200 * len(notes)),
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.9,
+            max_tokens=200 * len(notes),
+            response_format={"type": "json_object"}
+        )
+    return parse_batch_ideas(response.choices[0].message.content, notes)
+
+async def stream_completion(model, prompt):
+    return await openai_request(
+        clients["openai"].chat.completions.with_raw_response.create, model, PRIORITY_INTERACTIVE,
+        tokens=estimate_tokens(prompt, 500),
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.9,
+        max_tokens=500,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+async def iter_deltas(stream, model):
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        record_token_usage(model, getattr(chunk, "usage", None))
+
+async def stream_ideas(prompt):
+    if TEXT_HEDGE_ENABLED:
+        deltas = (await race_completions(prompt, "first_token")).deltas()
+    else:
+        deltas = iter_deltas(await stream_completion(TEXT_MODEL, prompt), TEXT_MODEL)
+    parser = IdeaStreamParser()
+    async for delta in deltas:
+        for idea in parser.feed(delta):
+            yield "idea", idea
+    for idea in parser.finish():
+        yield "idea", idea
+    yield "done", {"suggestions": parser.text}
+
+# --- Hedged Completions ---
+class CompletionAttempt:
+    """Async counterpart of OpenAI_API.CompletionAttempt: one streamed
+    completion run as a task, setting `ready` when it reaches the first
+    token, finishes or fails. Cancelling the task closes the stream."""
+
+    def __init__(self, model, prompt, ready, primary=True):
+        self.model = model
+        self.prompt = prompt
+        self.ready = ready
+        self.primary = primary
+        self.started = time.perf_counter()
+        self.first_token = False
+        self.done = False
+        self.error = None
+        self.text = ""
+        self._deltas = asyncio.Queue()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        stream = None
+        try:
+            stream = await stream_completion(self.model, self.prompt)
+            async for delta in iter_deltas(stream, self.model):
+                if not self.first_token:
+                    self.first_token = True
+                    self._observe("first_token")
+                    self.ready.set()
+                self.text += delta
+                self._deltas.put_nowait(delta)
+            self._observe("complete")
+        except Exception as e:
+            self.error = e
+        finally:
+            if stream is not None:
+                await stream.close()
+            self.done = True
+            self._deltas.put_nowait(None)
+            self.ready.set()
+
+    def reached(self, until):
+        return self.error is None and (self.done if until == "complete" else self.first_token or self.done)
+
+    def cancel(self):
+        if not self.done:
+            # Time the primary has taken so far is a lower bound on its latency
+            if self.primary:
+                self._observe("first_token" if not self.first_token else "complete")
+            self.task.cancel()
+
+    async def deltas(self):
+        try:
+            while (delta := await self._deltas.get()) is not None:
+                yield delta
+        finally:
+            # The client went away mid-stream
+            if not self.done:
+                self.task.cancel()
+        if self.error is not None:
+            raise self.error
+
+    def _observe(self, until):
+        if self.model == TEXT_MODEL:
+            TEXT_LATENCY.observe(f"{self.model}:{until}", time.perf_counter() - self.started)
+
+async def race_completions(prompt, until):
+    """Run the completion on TEXT_MODEL, hedging to TEXT_FALLBACK_MODEL (or
+    TEXT_MODEL again) once it is hedge_delay() late to `until`; the first
+    attempt to get there wins and the other is cancelled."""
+    ready = asyncio.Event()
+    primary = CompletionAttempt(TEXT_MODEL, prompt, ready)
+    attempts = [primary]
+    deadline = time.monotonic() + hedge_delay(until)
+
+    while True:
+        ready.clear()
+        winner = next((attempt for attempt in attempts if attempt.reached(until)), None)
+        if winner is not None:
+            break
+        if all(attempt.done for attempt in attempts):
+            TEXT_HEDGES.inc(outcome="failed", model=TEXT_MODEL)
+            raise primary.error
+        if len(attempts) > 1:
+            await ready.wait()
+            continue
+        try:
+            await asyncio.wait_for(ready.wait(), max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            fallback = TEXT_FALLBACK_MODEL or TEXT_MODEL
+            logger.info(f"Completion passed its {until} deadline, hedging to {fallback}")
+            attempts.append(CompletionAttempt(fallback, prompt, ready, primary=False))
+
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt.cancel()
+    outcome = "unhedged" if len(attempts) == 1 else ("primary" if winner is primary else "hedge")
+    TEXT_HEDGES.inc(outcome=outcome, model=winner.model)
+    return winner
+
+async def generate_sketch(shape, variant=None):
+    raw_text = shape["text"]
+    logger.info(f"Generating image for: {raw_text[:50]}...")
+    image_params = {
+        "prompt": build_sketch_prompt(raw_text),
+        "size": IMAGE_SIZE,
+        "n": 1
+    }
+    if IMAGE_MODEL == "dall-e-3":
+        image_params["quality"] = IMAGE_QUALITY
+
+    async with clients["image_slots"]:
+        with stage_timer("openai_image"):
+            response = await openai_request(
+                clients["openai"].images.with_raw_response.generate, IMAGE_MODEL, PRIORITY_BULK, idempotent=False,
+                **image_params, timeout=IMAGE_PROMPT_TIMEOUT
+            )
+        image_id = await store_generated_image(response.data[0])
+    logger.info(f"Successfully generated image for {shape['id']}")
+    # Resizing waits on OpenAI_API's process pool, so it runs off the event loop
+    return await asyncio.to_thread(process_image, {"id": shape["id"], "prompt": raw_text, "image_id": image_id}, variant)
+
+async def store_generated_image(image):
+    """Async counterpart of OpenAI_API.store_generated_image"""
+    if getattr(image, "b64_json", None):
+        # Decoding multi-MB images would stall the event loop
+        with stage_timer("base64_decode"):
+            return await asyncio.to_thread(lambda: IMAGE_STORE.save(base64.b64decode(image.b64_json)))
+    if not getattr(image, "url", None):
+        raise RuntimeError("No image URL or base64 returned")
+
+    with stage_timer("image_download"):
+        async with clients["images"].stream("GET", image.url) as image_response:
+            UPSTREAM_RESPONSES.inc(upstream="images", status=image_response.status_code)
+            if image_response.status_code != 200:
+                raise RuntimeError(f"Failed to download image: {image_response.status_code}")
+            # File writes, and the store purge on exit, run off the event loop
+            writer = await asyncio.to_thread(IMAGE_STORE.writer(image_response.headers.get("Content-Type")).__enter__)
+            try:
+                async for chunk in image_response.aiter_bytes(64 * 1024):
+                    await asyncio.to_thread(writer.write, chunk)
+            except BaseException as e:
+                await asyncio.to_thread(writer.__exit__, type(e), e, e.__traceback__)
+                raise
+            await asyncio.to_thread(writer.__exit__, None, None, None)
+    return writer.image_id
+
+def forwarded(header):
+    """Value the PROXY_HOPS-th proxy from us set in an X-Forwarded-* header,
+    as werkzeug's ProxyFix picks it for the Flask app"""
+    values = [value.strip() for value in request.headers.get(header, "").split(",")]
+    return values[-PROXY_HOPS] if PROXY_HOPS and len(values) >= PROXY_HOPS and values[-PROXY_HOPS] else None
+
+def request_base_url():
+    if PUBLIC_BASE_URL:
+        return PUBLIC_BASE_URL
+    scheme = forwarded("X-Forwarded-Proto") or request.scheme
+    host = forwarded("X-Forwarded-Host") or request.host
+    return f"{scheme}://{host}"
+
+async def generate_image_idea(full_prompt, variant=None, n=1):
+    logger.info(f"Generating {n} image(s) for prompt: {full_prompt[:60]}...")
+    async with clients["image_slots"]:
+        with stage_timer("openai_image"):
+            rsp = await openai_request(
+                clients["openai"].images.with_raw_response.generate, IMAGE_MODEL, PRIORITY_BULK, idempotent=False,
+                prompt = full_prompt,
+                size = "1024x1024",
+                n = n,
+                timeout = IMAGE_PROMPT_TIMEOUT,
+                **({"quality": IMAGE_QUALITY} if IMAGE_MODEL == "dall-e-3" else {})
+            )
+    if not rsp.data:
+        raise RuntimeError("No image URL or base64 returned")
+    images = []
+    for img in rsp.data:
+        if getattr(img, "url", None) and variant is None:
+            images.append(img.url)
+        else:
+            images.append(await asyncio.to_thread(process_image, {"image_id": await store_generated_image(img)}, variant))
+    return images
+
+# --- Request Instrumentation ---
+# Same metrics and Server-Timing header as the Flask app's hooks
+@app.before_request
+async def start_request_metrics():
+    g.timings = begin_request_timings()
+    REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint or "unknown")
+
+@app.after_request
+async def add_server_timing(response):
+    timings = g.get("timings")
+    if timings is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - timings.started,
+                                endpoint=request.endpoint or "unknown", status=response.status_code)
+        if METRICS_SERVER_TIMING:
+            response.headers["Server-Timing"] = timings.header()
+    if response.status_code < 300 and request.endpoint not in PROBE_ENDPOINTS:
+        startup_phase("first_response")
+    return response
+
+@app.teardown_request
+async def finish_request_metrics(exc=None):
+    if g.pop("timings", None) is not None:
+        REQUESTS_IN_FLIGHT.dec(endpoint=request.endpoint or "unknown")
+
+# --- Error Handling ---
+@app.errorhandler(ApiError)
+async def handle_api_error(e):
+    return e.response()
+
+@app.errorhandler(UpstreamRateLimited)
+async def handle_rate_limited(e):
+    logger.warning(f"Upstream rate limited: {str(e)}")
+    return rate_limited_response(e)
+
+@app.errorhandler(Exception)
+async def handle_exception(e):
+    if isinstance(e, HTTPException):
+        # Unknown routes and wrong methods keep their 404/405
+        return e
+    logger.error(f"Unhandled exception: {str(e)}")
+    logger.error(traceback.format_exc())
+    return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+# --- Routes ---
+# Request handling is shared with the Flask app (OpenAI_API's IdeasRequest,
+# SketchRequest, ...); these wrappers do the upstream calls and waiting, and
+# run the shared helpers, which may touch the disk, in threads.
+@app.route('/', methods=['GET'])
+async def root():
+    return service_info()
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    return await asyncio.to_thread(health_status)
+
+@app.route('/ready', methods=['GET'])
+async def readiness_check():
+    return readiness(WARMUP)
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return Response(await asyncio.to_thread(METRICS.render), mimetype="text/plain; version=0.0.4")
+
+@app.route('/generate-ideas', methods=['POST'])
+async def generate_ideas():
+    ideas = IdeasRequest(await request.get_json(silent=True), request.args, request.headers)
+    cached = await asyncio.to_thread(ideas.take_cached)
+    if cached is None and SEMANTIC_CACHE is not None:
+        try:
+            cached = await asyncio.to_thread(ideas.lookup_similar, await embed_text(ideas.embedded))
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {str(e)}")
+
+    if ideas.stream_format:
+        if cached is not None:
+            return stream_response(stream_cached_ideas(cached), ideas.stream_format)
+
+        async def events():
+            async for event, payload in stream_ideas(ideas.prompt):
+                if event == "done":
+                    await asyncio.to_thread(ideas.finish, payload["suggestions"])
+                yield event, payload
+        return stream_response(events(), ideas.stream_format)
+
+    if cached is not None:
+        return {"suggestions": cached}
+    try:
+        suggestions = await INFLIGHT.do(ideas.key, lambda: generate_suggestions(ideas.prompt))
+    except UpstreamRateLimited:
+        raise
+    except Exception as e:
+        raise ideas.failed(e) from e
+    return await asyncio.to_thread(ideas.response, suggestions)
+
+@app.route('/generate-ideas/batch', methods=['POST'])
+async def generate_ideas_batch():
+    batch = BatchIdeasRequest(await request.get_json(silent=True))
+    batch.add_chunks(await gather_bounded(
+        lambda chunk: generate_batch_chunk(chunk, batch.custom_prompt), batch.chunks, IDEAS_BATCH_CONCURRENCY
+    ))
+    batch.add_retried(await gather_bounded(generate_suggestions, batch.retry_prompts(), IDEAS_BATCH_CONCURRENCY))
+    return batch.response()
+
+@app.route('/generate-text2image-sketches', methods=['POST', 'OPTIONS'])
+async def generate_text2image_sketches():
+    if request.method == 'OPTIONS':
+        return "", 200, preflight_headers(request.headers.get('Origin'))
+
+    sketches = SketchRequest(await request.get_json(silent=True), request.args, request.headers,
+                             request_base_url())
+    # Background jobs run on the shared thread pool of OpenAI_API
+    if sketches.wants_job:
+        return await asyncio.to_thread(sketches.submit_job)
+
+    try:
+        cached = await asyncio.to_thread(sketches.cached)
+        if cached is not None:
+            if sketches.stream_format:
+                return stream_response(sketches.cached_events(cached), sketches.stream_format)
+            return cached
+
+        try:
+            shapes = sketches.resolve(
+                [] if sketches.content else
+                await BOARD_SNAPSHOTS.lookup(sketches.board_id, sketches.selected_shape_ids, SHAPE_TYPES)
+            )
+        except MiroAPIError as e:
+            return {"error": str(e)}, 500
+        if not shapes:
+            if sketches.stream_format:
+                return stream_response(sketches.no_shapes_events(), sketches.stream_format)
+            return {"status": "no_valid_shapes_found"}, 200
+
+        generate = partial(generate_sketch, variant=sketches.variant)
+        if sketches.stream_format:
+            async def events():
+                async for index, image, error in iter_bounded(
+                        generate, shapes, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT):
+                    yield await asyncio.to_thread(sketches.add, index, image, error)
+                yield await asyncio.to_thread(sketches.done)
+            return stream_response(events(), sketches.stream_format)
+
+        async def generate_all():
+            outcomes = await gather_bounded(generate, shapes, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT)
+            return await asyncio.to_thread(sketches.collect, outcomes)
+
+        result = await INFLIGHT.do(sketches.key, generate_all)
+        return await asyncio.to_thread(sketches.response, result)
+
+    except UpstreamRateLimited:
+        raise
+    except Exception as e:
+        raise sketches.failed(e) from e
+
+@app.route('/generate-image-ideas', methods=['POST'])
+async def generate_image_ideas():
+    ideas = ImageIdeasRequest(await request.get_json(force=True, silent=True), request.args, request.headers,
+                              request_base_url())
+    if ideas.wants_job:
+        return await asyncio.to_thread(ideas.submit_job)
+
+    try:
+        if not ideas.resolve(await fetch_board_items(ideas.board_id, ideas.sel_ids)):
+            return ideas.no_prompts()
+
+        async def generate(call):
+            index, n = call
+            return await generate_image_idea(ideas.full_prompts[index], ideas.variant, n)
+
+        if ideas.stream_format:
+            async def events():
+                for event in ideas.error_events():
+                    yield event
+                async for call_index, images, error in iter_bounded(
+                        generate, ideas.calls, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT):
+                    for event in await asyncio.to_thread(ideas.add, call_index, images, error):
+                        yield event
+                yield ideas.done()
+            return stream_response(events(), ideas.stream_format)
+
+        outcomes = await INFLIGHT.do(ideas.key, lambda: gather_bounded(
+            generate, ideas.calls, IMAGE_REQUEST_CONCURRENCY, IMAGE_PROMPT_TIMEOUT
+        ))
+        return await asyncio.to_thread(ideas.response, outcomes)
+
+    except UpstreamRateLimited:
+        raise
+    except Exception as e:
+        raise ideas.failed(e) from e
+
+async def miro_webhook():
+    return await asyncio.to_thread(handle_miro_webhook, await request.get_data(),
+                                   request.headers.get("X-Miro-Signature"), BOARD_SNAPSHOTS)
+
+if SPECULATIVE_ENABLED:
+    app.add_url_rule('/webhooks/miro', view_func=miro_webhook, methods=['POST'])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+async def get_job(job_id):
+    return await asyncio.to_thread(job_status, job_id, request.args, request_base_url())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+async def cancel_job(job_id):
+    return await asyncio.to_thread(cancel_job_status, job_id, request.args, request_base_url())
+
+@app.route('/images/<image_id>', methods=['GET'])
+async def get_image(image_id):
+    path = await asyncio.to_thread(stored_image_path, image_id, request.args)
+    return await send_file(path, mimetype=IMAGE_STORE.mimetype(image_id), conditional=True,
+                           cache_timeout=IMAGE_URL_TTL)
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.environ.get("PORT", 5050))
+    logger.info(f"Starting Miro OpenAI API Server (ASGI) on port {port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
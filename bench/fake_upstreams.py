@@ -0,0 +1,354 @@
+"""Local stand-ins for the OpenAI and Miro APIs used by the benchmark.
+
+Serves the subset of both APIs that OpenAI_API.py calls, with configurable
+latency, error rates and payload sizes, so load tests cost nothing and are
+reproducible:
+
+    POST /v1/chat/completions          (plain, streamed and json_object)
+    POST /v1/images/generations        (url or b64_json)
+    POST /v1/embeddings                (bag-of-words vectors; reworded notes stay close)
+    GET  /v1/models/<model>            (warm-up credential check)
+    GET  /files/<name>.png             (image downloads)
+    GET  /v2/boards/<board>/items      (paginated with cursor/limit)
+    GET  /v2/boards/<board>/items/<id> (any id resolves to a sticky note)
+    GET  /v1/oauth-token               (warm-up credential check)
+
+and stands in for Miro's board webhooks: send_board_event() posts a signed
+sticky-note event to the API's /webhooks/miro.
+
+    python bench/fake_upstreams.py --port 8900 --chat-latency 0.8 --image-latency 4
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+app = Flask(__name__)
+
+config = argparse.Namespace(
+    chat_latency=0.8,
+    embedding_latency=0.05,
+    image_latency=4.0,
+    miro_latency=0.05,
+    download_latency=0.05,
+    jitter=0.2,
+    error_rate=0.0,
+    rate_limit_rate=0.0,
+    slow_rate=0.0,
+    slow_latency=20.0,
+    image_bytes=1_500_000,
+    image_format="url",
+    ideas=4,
+    idea_words=12,
+    items=200,
+    stream_chunk_delay=0.02,
+    seed=None
+)
+
+_random = random.Random()
+_random_lock = threading.Lock()
+_image_body = b""
+
+WORDS = ("explore reframe community access signal journey trust shared habit "
+         "insight future local seasonal network repair playful calm data").split()
+
+def uniform(low, high):
+    with _random_lock:
+        return _random.uniform(low, high)
+
+def chance(rate):
+    with _random_lock:
+        return rate > 0 and _random.random() < rate
+
+def sleep(base):
+    """Sleep `base` seconds, +/- the configured jitter fraction"""
+    if base > 0:
+        time.sleep(base * uniform(1 - config.jitter, 1 + config.jitter))
+
+def injected_error(openai_style=True):
+    """A 429 or 500 according to the configured rates, or None"""
+    if chance(config.rate_limit_rate):
+        body = {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}}
+        return jsonify(body if openai_style else {"status": 429, "message": "Too many requests"}), 429, {"Retry-After": "1"}
+    if chance(config.error_rate):
+        body = {"error": {"message": "The server had an error (fake)", "type": "server_error"}}
+        return jsonify(body if openai_style else {"status": 500, "message": "Internal error"}), 500
+    return None
+
+def openai_headers():
+    return {
+        "x-ratelimit-limit-requests": "100000",
+        "x-ratelimit-remaining-requests": "99999",
+        "x-ratelimit-reset-requests": "1ms",
+        "x-ratelimit-limit-tokens": "100000000",
+        "x-ratelimit-remaining-tokens": "99999999",
+        "x-ratelimit-reset-tokens": "1ms"
+    }
+
+def fake_idea():
+    with _random_lock:
+        return " ".join(_random.choice(WORDS) for _ in range(config.idea_words)).capitalize()
+
+def fake_ideas_text():
+    return "\n\n".join(f"Idea {i}: {fake_idea()}" for i in range(1, config.ideas + 1))
+
+def batch_keys(prompt):
+    """Keys of the {key: note} object embedded in a batch ideas prompt"""
+    for line in prompt.splitlines():
+        line = line.strip()
+        if line.startswith("{") and line.endswith("}"):
+            try:
+                return list(json.loads(line))
+            except ValueError:
+                pass
+    return list(re.findall(r'"(n\d+)"', prompt))
+
+def usage(prompt, completion):
+    prompt_tokens, completion_tokens = len(prompt) // 4, len(completion) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+# --- OpenAI ---
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    error = injected_error()
+    if error:
+        return error
+    body = request.get_json()
+    prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+    model = body.get("model", "fake")
+
+    # Long-tail outliers, to exercise hedging
+    stall = config.slow_latency if chance(config.slow_rate) else 0
+
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        content = json.dumps({key: [fake_idea() for _ in range(config.ideas)] for key in batch_keys(prompt)})
+    else:
+        content = fake_ideas_text()
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if not body.get("stream"):
+        time.sleep(stall)
+        sleep(config.chat_latency)
+        return jsonify({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(prompt, content)
+        }), 200, openai_headers()
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+    pieces = re.findall(r"\S+\s*", content)
+    # Spread the configured latency over the stream: a third before the first token
+    first_token = config.chat_latency / 3
+
+    def chunk(delta, finish_reason=None, **extra):
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+            **extra
+        }) + "\n\n"
+
+    def events():
+        time.sleep(stall)
+        sleep(first_token)
+        yield chunk({"role": "assistant", "content": ""})
+        for piece in pieces:
+            sleep(config.stream_chunk_delay)
+            yield chunk({"content": piece})
+        yield chunk({}, "stop")
+        if include_usage:
+            yield chunk(None, usage=usage(prompt, content))
+        yield "data: [DONE]\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers=openai_headers())
+
+@app.route('/v1/images/generations', methods=['POST'])
+def image_generations():
+    error = injected_error()
+    if error:
+        return error
+    body = request.get_json()
+    sleep(config.image_latency)
+    n = int(body.get("n") or 1)
+    b64 = config.image_format == "b64" or body.get("response_format") == "b64_json"
+    if b64:
+        encoded = base64.b64encode(_image_body).decode("ascii")
+        data = [{"b64_json": encoded} for _ in range(n)]
+    else:
+        base = request.host_url.rstrip("/")
+        data = [{"url": f"{base}/files/{uuid.uuid4().hex}.png"} for _ in range(n)]
+    return jsonify({"created": int(time.time()), "data": data}), 200, openai_headers()
+
+EMBEDDING_DIMENSIONS = 256
+STOP_WORDS = {"a", "an", "the", "in", "of", "for", "to", "and", "on", "with"}
+
+def fake_embedding(text):
+    """Hashed bag of words: the same words in any order give the same vector"""
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word not in STOP_WORDS:
+            digest = hashlib.md5(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSIONS] += 1.0
+    return vector
+
+@app.route('/v1/embeddings', methods=['POST'])
+def embeddings():
+    error = injected_error()
+    if error:
+        return error
+    body = request.get_json()
+    inputs = body.get("input")
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    sleep(config.embedding_latency)
+    return jsonify({
+        "object": "list",
+        "model": body.get("model", "fake"),
+        "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text)} for i, text in enumerate(inputs)],
+        "usage": {"prompt_tokens": sum(len(text) // 4 for text in inputs), "total_tokens": sum(len(text) // 4 for text in inputs)}
+    }), 200, openai_headers()
+
+@app.route('/v1/models/<model>', methods=['GET'])
+def model_info(model):
+    sleep(config.miro_latency)
+    return jsonify({"id": model, "object": "model", "created": 0, "owned_by": "system"}), 200, openai_headers()
+
+@app.route('/files/<name>', methods=['GET'])
+def image_file(name):
+    sleep(config.download_latency)
+    return Response(_image_body, mimetype="image/png")
+
+# --- Miro ---
+def miro_item(item_id):
+    return {
+        "id": str(item_id),
+        "type": "sticky_note",
+        "data": {"content": f"<p>Sticky note {item_id}: {fake_idea()}</p>", "shape": "square"},
+        "position": {"x": 0, "y": 0}
+    }
+
+def miro_headers():
+    return {"X-RateLimit-Limit": "100000", "X-RateLimit-Remaining": "99999", "X-RateLimit-Reset": "60"}
+
+@app.route('/v2/boards/<board_id>/items', methods=['GET'])
+def board_items(board_id):
+    error = injected_error(openai_style=False)
+    if error:
+        return error
+    sleep(config.miro_latency)
+    start = int(request.args.get("cursor") or 0)
+    limit = min(int(request.args.get("limit", 10)), 50)
+    ids = range(start, min(start + limit, config.items))
+    body = {"data": [miro_item(i) for i in ids], "size": len(ids), "limit": limit, "total": config.items}
+    if start + limit < config.items:
+        body["cursor"] = str(start + limit)
+    return jsonify(body), 200, miro_headers()
+
+@app.route('/v2/boards/<board_id>/items/<item_id>', methods=['GET'])
+def board_item(board_id, item_id):
+    error = injected_error(openai_style=False)
+    if error:
+        return error
+    sleep(config.miro_latency)
+    return jsonify(miro_item(item_id)), 200, miro_headers()
+
+@app.route('/v1/oauth-token', methods=['GET'])
+def oauth_token():
+    sleep(config.miro_latency)
+    return jsonify({"type": "oauth", "team": {"id": "bench-team"}, "scopes": ["boards:read", "boards:write"]}), 200, miro_headers()
+
+# --- Miro webhooks ---
+def board_event(board_id, item_id, content, event_type="update"):
+    """A board webhook delivery for a sticky note, shaped like Miro's"""
+    item = {**miro_item(item_id), "data": {"content": content, "shape": "square"}}
+    return {"subscriptionId": "fake-subscription", "event": {"boardId": board_id, "type": event_type, "item": item}}
+
+def send_board_event(url, board_id, item_id, content, event_type="update", secret=None):
+    """POST a board event to an API's /webhooks/miro, signed like Miro does
+    when `secret` is given; returns the response status"""
+    body = json.dumps(board_event(board_id, item_id, content, event_type)).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Miro-Signature"] = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    with urllib.request.urlopen(urllib.request.Request(url, body, headers), timeout=10) as response:
+        return response.status
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"})
+
+def configure(**options):
+    """Apply options (same names as the CLI flags) and rebuild the image body"""
+    global _image_body
+    for key, value in options.items():
+        if value is not None:
+            setattr(config, key, value)
+    _random.seed(config.seed)
+    _image_body = noise_png(config.image_bytes)
+
+def noise_png(size):
+    """A decodable PNG of random pixels, about `size` bytes, so the image
+    processing stage has real work to do; without Pillow, random bytes
+    behind a PNG signature"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\x89PNG\r\n\x1a\n" + os.urandom(max(0, size - 8))
+    # Noise barely compresses: 3 bytes per RGB pixel
+    side = max(16, int((size / 3) ** 0.5))
+    output = io.BytesIO()
+    Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(output, "PNG")
+    return output.getvalue()
+
+def start(host="127.0.0.1", port=0, **options):
+    """Serve in a background thread (for tests and scripts); returns (server, base_url)"""
+    configure(**options)
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--chat-latency", type=float, help="seconds per completion (default: 0.8)")
+    parser.add_argument("--image-latency", type=float, help="seconds per image generation (default: 4)")
+    parser.add_argument("--embedding-latency", type=float, help="seconds per embedding call (default: 0.05)")
+    parser.add_argument("--miro-latency", type=float, help="seconds per Miro call (default: 0.05)")
+    parser.add_argument("--download-latency", type=float, help="seconds per image download (default: 0.05)")
+    parser.add_argument("--jitter", type=float, help="latency spread as a fraction (default: 0.2)")
+    parser.add_argument("--error-rate", type=float, help="fraction of calls answered with 500 (default: 0)")
+    parser.add_argument("--rate-limit-rate", type=float, help="fraction of calls answered with 429 (default: 0)")
+    parser.add_argument("--slow-rate", type=float, help="fraction of completions stalled by --slow-latency (default: 0)")
+    parser.add_argument("--slow-latency", type=float, help="extra seconds for stalled completions (default: 20)")
+    parser.add_argument("--image-bytes", type=int, help="size of generated images (default: 1.5 MB)")
+    parser.add_argument("--image-format", choices=["url", "b64"], help="how images are returned (default: url)")
+    parser.add_argument("--ideas", type=int, help="ideas per completion (default: 4)")
+    parser.add_argument("--idea-words", type=int, help="words per idea (default: 12)")
+    parser.add_argument("--items", type=int, help="items listed on every board (default: 200)")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible runs")
+    args = vars(parser.parse_args())
+    host, port = args.pop("host"), args.pop("port")
+    configure(**args)
+    print(f"Fake OpenAI/Miro upstreams on http://{host}:{port}", flush=True)
+    make_server(host, port, app, threaded=True).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+"""Load benchmark for the Miro OpenAI API against local fake upstreams.
+
+Starts bench/fake_upstreams.py and the API server (pointed at the fakes via
+OPENAI_BASE_URL and MIRO_API_BASE), drives the generation endpoints at each
+concurrency level and reports throughput, latency percentiles and the
+server's peak RSS, plus how long the server took from spawn to its first
+successful response. Results can be saved and compared against a baseline:
+
+    python bench/run_bench.py --concurrency 1,8,32 --requests 64 --json baseline.json
+    python bench/run_bench.py --concurrency 1,8,32 --requests 64 --compare baseline.json
+
+Exits non-zero when --compare finds a regression beyond --tolerance.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_upstreams import send_board_event
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+ENDPOINTS = ("generate-ideas", "generate-image-ideas", "generate-text2image-sketches")
+BOARD_ID = "bench-board"
+WEBHOOK_SECRET = "bench-webhook-secret"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before it was ready")
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} was not ready after {timeout}s")
+
+def measure_cold_start(server_url, process, spawned, args, timeout=60):
+    """Seconds from spawning the server until /health, /ready and a first
+    /generate-ideas each succeed, polled side by side. ready_s is None for
+    servers without /ready."""
+    deadline = time.monotonic() + timeout
+    payload = build_payload("generate-ideas", 0, args, "cold-start")
+
+    def poll(method, path, **kwargs):
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                response = requests.request(method, f"{server_url}{path}", timeout=args.timeout, **kwargs)
+                if response.status_code == 200:
+                    return round(time.monotonic() - spawned, 3)
+                if response.status_code == 404:
+                    return None
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} during startup")
+        raise RuntimeError(f"{path} did not succeed within {timeout}s of startup")
+
+    with ThreadPoolExecutor(3) as pool:
+        health = pool.submit(poll, "GET", "/health")
+        ready = pool.submit(poll, "GET", "/ready")
+        first = pool.submit(poll, "POST", "/generate-ideas", json=payload)
+        return {"health_s": health.result(), "ready_s": ready.result(), "first_response_s": first.result()}
+
+# --- Memory ---
+def process_tree(pid):
+    """pid and all its descendants (gunicorn workers, reloader children)"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces; ppid follows the closing paren
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    tree, frontier = [pid], [pid]
+    while frontier:
+        children = [child for child, parent in parents.items() if parent in frontier]
+        tree.extend(children)
+        frontier = children
+    return tree
+
+def status_kb(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+class RSSSampler:
+    """Samples the summed RSS of a process tree; VmHWM is used as well so
+    spikes between samples are not missed for single-process servers."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            tree = process_tree(self.pid)
+            self.peak_kb = max(self.peak_kb, sum(status_kb(pid, "VmRSS") for pid in tree))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.isdir("/proc"):
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        tree = process_tree(self.pid) if os.path.isdir("/proc") else []
+        if len(tree) == 1:
+            self.peak_kb = max(self.peak_kb, status_kb(self.pid, "VmHWM"))
+
+# --- Load ---
+def build_payload(endpoint, index, args, run_id):
+    """Request body for the index-th request; unique per run so neither the
+    response cache nor request coalescing hides upstream work."""
+    if endpoint == "generate-ideas":
+        return {"content": f"Benchmark note {run_id}-{index}: make onboarding feel calmer", "boardId": BOARD_ID}
+    shape_ids = [f"{run_id}-{index}-{n}" for n in range(args.shapes)]
+    return {"boardId": BOARD_ID, "selectedShapeIds": shape_ids}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[rank]
+
+def speculative_generated(base_url):
+    """Pre-generated suggestions the server reports so far"""
+    text = requests.get(f"{base_url}/metrics", timeout=10).text
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+               if line.startswith("konzepta_speculative_ideas_total{") and 'outcome="generated"' in line)
+
+def pre_generate(base_url, run_id, args, timeout=120):
+    """Report every note of the run as edited through /webhooks/miro, as
+    Miro would while people type, and wait until all are pre-generated"""
+    before = speculative_generated(base_url)
+    for index in range(args.requests):
+        content = build_payload("generate-ideas", index, args, run_id)["content"]
+        send_board_event(f"{base_url}/webhooks/miro", BOARD_ID, f"{run_id}-{index}", f"<p>{content}</p>",
+                         secret=WEBHOOK_SECRET)
+    deadline = time.monotonic() + timeout
+    while speculative_generated(base_url) < before + args.requests:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Notes were not pre-generated within {timeout}s")
+        time.sleep(0.1)
+
+def run_scenario(base_url, endpoint, concurrency, args, server_pid):
+    run_id = uuid.uuid4().hex[:8]
+    sessions = threading.local()
+    url = f"{base_url}/{endpoint}"
+    if args.stream:
+        url += "?stream=ndjson"
+
+    def one(index):
+        session = getattr(sessions, "session", None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(url, json=build_payload(endpoint, index, args, run_id), timeout=args.timeout)
+            if args.stream:
+                ok = response.status_code == 200 and b'"event": "error"' not in response.content
+            else:
+                data = response.json()
+                ok = response.status_code == 200 and not data.get("error") and not data.get("errors")
+        except (requests.RequestException, ValueError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    for index in range(args.warmup):
+        one(-1 - index)
+    if args.speculative and endpoint == "generate-ideas":
+        pre_generate(base_url, run_id, args)
+
+    with RSSSampler(server_pid) as rss, ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        outcomes = list(pool.map(one, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, ok in outcomes if ok)
+    ms = lambda value: None if value is None else round(value * 1000, 1)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(outcomes),
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "peak_rss_mb": round(rss.peak_kb / 1024, 1)
+    }
+
+# --- Reporting ---
+COLUMNS = ("endpoint", "concurrency", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+
+def print_table(results):
+    rows = [COLUMNS] + [tuple("-" if r[c] is None else str(r[c]) for c in COLUMNS) for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    for n, row in enumerate(rows):
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+        if n == 0:
+            print("  ".join("-" * width for width in widths))
+
+def compare(results, cold_start, baseline, tolerance):
+    """Regression messages for results that are worse than the baseline"""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    base_start = baseline.get("cold_start") or {}
+    if base_start.get("first_response_s") and cold_start["first_response_s"] > base_start["first_response_s"] * (1 + tolerance):
+        regressions.append(f"cold start: first response {base_start['first_response_s']} -> {cold_start['first_response_s']}s")
+    for r in results:
+        base = previous.get((r["endpoint"], r["concurrency"]))
+        if not base:
+            continue
+        name = f"{r['endpoint']} @ {r['concurrency']}"
+        if base["throughput_rps"] and r["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {r['throughput_rps']} rps")
+        for key in ("p95_ms", "p99_ms", "peak_rss_mb"):
+            if base.get(key) and r.get(key) and r[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {base[key]} -> {r[key]}")
+        if r["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {r['errors']}")
+    return regressions
+
+# --- Processes ---
+def start_fake_upstreams(args, port, log):
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "fake_upstreams.py"), "--port", str(port),
+        "--chat-latency", str(args.chat_latency), "--image-latency", str(args.image_latency),
+        "--miro-latency", str(args.miro_latency), "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate), "--image-bytes", str(args.image_bytes),
+        "--slow-rate", str(args.slow_rate), "--slow-latency", str(args.slow_latency),
+        "--image-format", args.image_format, "--seed", str(args.seed)
+    ]
+    return subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+
+def start_server(args, port, upstream_url, log):
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"{upstream_url}/v1",
+        MIRO_API_BASE=upstream_url,
+        MIRO_TOKEN="bench",
+        MIRO_BOARD_ID=BOARD_ID,
+        PYTHONUNBUFFERED="1"
+    )
+    if args.cache:
+        env["SEMANTIC_CACHE"] = "1"
+    else:
+        env["CACHE_TTL_SECONDS"] = "0"
+        env["SEMANTIC_CACHE"] = "0"
+    if args.speculative:
+        env.update(SPECULATIVE_IDEAS="1", MIRO_WEBHOOK_SECRET=WEBHOOK_SECRET, SPECULATIVE_DEBOUNCE="0.1",
+                   SPECULATIVE_BOARD_BUDGET="100000000", SPECULATIVE_CONCURRENCY="8")
+    env["WARM_UP"] = "0" if args.no_warm_up else "1"
+    if not args.rate_limits:
+        # Measure the service, not our own client-side quotas
+        for name in ("OPENAI_TEXT_RPM", "OPENAI_TEXT_TPM", "OPENAI_IMAGE_RPM", "MIRO_RPM"):
+            env[name] = "100000000"
+
+    if args.server == "gunicorn":
+        command = ["gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(args.workers),
+                   "--threads", str(args.threads), "--timeout", "300", "OpenAI_API:create_app()"]
+    elif args.server == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-c",
+                   f"from OpenAI_API import create_app; create_app().run(host='127.0.0.1', port={port}, threaded=True)"]
+    return subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated endpoints to drive")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests before each level")
+    parser.add_argument("--shapes", type=int, default=2, help="selected shapes per image request")
+    parser.add_argument("--stream", action="store_true", help="request NDJSON streams instead of JSON")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--server", choices=["gunicorn", "asgi", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn threads per worker")
+    parser.add_argument("--cache", action="store_true", help="keep the response and semantic caches enabled")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the default upstream rate limits")
+    parser.add_argument("--no-warm-up", action="store_true", help="start the server with WARM_UP=0")
+    parser.add_argument("--speculative", action="store_true",
+                        help="report the notes as edited via webhooks and pre-generate them before measuring")
+    parser.add_argument("--chat-latency", type=float, default=0.8)
+    parser.add_argument("--image-latency", type=float, default=4.0)
+    parser.add_argument("--miro-latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of completions stalled (long tail)")
+    parser.add_argument("--slow-latency", type=float, default=20.0, help="seconds a stalled completion takes extra")
+    parser.add_argument("--image-bytes", type=int, default=1_500_000)
+    parser.add_argument("--image-format", choices=["url", "b64"], default="url")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    endpoints = [e.strip().strip("/") for e in args.endpoints.split(",") if e.strip()]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    log_dir = tempfile.mkdtemp(prefix="konzepta-bench-")
+    upstream_port, server_port = free_port(), free_port()
+    upstream_url, server_url = f"http://127.0.0.1:{upstream_port}", f"http://127.0.0.1:{server_port}"
+    processes = []
+    try:
+        with open(os.path.join(log_dir, "upstreams.log"), "w") as upstream_log, \
+                open(os.path.join(log_dir, "server.log"), "w") as server_log:
+            processes.append(start_fake_upstreams(args, upstream_port, upstream_log))
+            wait_until_up(f"{upstream_url}/healthz", processes[-1])
+            spawned = time.monotonic()
+            server = start_server(args, server_port, upstream_url, server_log)
+            processes.append(server)
+            cold_start = measure_cold_start(server_url, server, spawned, args)
+
+            results = []
+            for endpoint in endpoints:
+                for level in levels:
+                    print(f"Running {endpoint} at concurrency {level}...", file=sys.stderr, flush=True)
+                    results.append(run_scenario(server_url, endpoint, level, args, server.pid))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print_table(results)
+    print("\nCold start: " + ", ".join(
+        f"{name[:-2].replace('_', ' ')} {'-' if seconds is None else f'{seconds}s'}" for name, seconds in cold_start.items()
+    ))
+    print(f"\nServer and upstream logs: {log_dir}")
+
+    report = {
+        "timestamp": time.time(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+        "cold_start": cold_start,
+        "results": results
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, cold_start, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Pillow post-processing for generated images.
+
+Runs inside the process pool of OpenAI_API, so it is kept apart from the
+app: under gunicorn or uvicorn, pool workers import this module and Pillow,
+not Flask or OpenAI. (Started with `python OpenAI_API.py`, the spawned
+workers re-import the main module, and so the app's imports, once each.)
+"""
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:  # optional; without it images are served as generated
+    Image = None
+
+# format name -> (Pillow format, MIME type)
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png")
+}
+
+def flatten(image, background=(255, 255, 255)):
+    """Composite transparent pixels onto a solid background (JPEG has no alpha)"""
+    image = image.convert("RGBA")
+    flat = Image.new("RGB", image.size, background)
+    flat.paste(image, mask=image.getchannel("A"))
+    return flat
+
+def transcode(path, width, fmt, quality):
+    """Resize the image at `path` to at most `width` pixels wide, keeping its
+    aspect ratio and never upscaling (0 keeps the size), and encode it as
+    `fmt`. Returns the encoded bytes."""
+    pil_format = FORMATS[fmt][0]
+    with Image.open(path) as image:
+        image.load()
+    if width and image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+
+    if pil_format == "JPEG":
+        if image.mode != "RGB":
+            image = flatten(image) if "A" in image.getbands() or image.mode == "P" else image.convert("RGB")
+        options = {"quality": quality, "optimize": True, "progressive": True}
+    elif pil_format == "WEBP":
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        options = {"quality": quality, "method": 4}
+    else:
+        options = {"optimize": True}
+
+    output = BytesIO()
+    image.save(output, pil_format, **options)
+    return output.getvalue()
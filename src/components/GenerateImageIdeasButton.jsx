@@ -225,7 +225,7 @@ const GenerateImageIdeasButton = () => {
       const centerY = viewport.y + viewport.height / 2;
       
       for (const image of selected) {
-        const dataUri = `data:image/png;base64,${image.base64_image}`;
+        const imageUrl = image.image_url || `data:image/png;base64,${image.base64_image}`;
         
         try {
           // First try to find the original item
@@ -244,7 +244,7 @@ const GenerateImageIdeasButton = () => {
           
           // Create the image on the board
           const createdImage = await miro.board.createImage({
-            url: dataUri,
+            url: imageUrl,
             x,
             y,
             width: 300, // Set a reasonable default width
@@ -401,7 +401,7 @@ const GenerateImageIdeasButton = () => {
                 }}
               >
                 <img
-                  src={`data:image/png;base64,${img.base64_image}`}
+                  src={img.image_url || `data:image/png;base64,${img.base64_image}`}
                   alt=""
                   width="180"
                   onClick={() => handleToggleSelect(img.id)}
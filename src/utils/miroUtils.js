@@ -139,7 +139,8 @@ export async function generateImageIdeas(setImageLoading, stickyNoteText, prompt
       boardId,
       positionData: placement.positionData,
       geometryData: placement.geometryData,
-      prompt: prompt
+      prompt: prompt,
+      groups: true // one row per prompt, laid out by the backend
     };
 
     const res = await fetch(`${config.apiBaseUrl}/generate-image-ideas`, {
@@ -153,7 +154,9 @@ export async function generateImageIdeas(setImageLoading, stickyNoteText, prompt
     if (!res.ok) throw new Error(result.error || 'Unknown error');
 
     // 🔁 UPDATED: Now explicitly place the image using our frontend logic
-    if (result.status === 'success' && Array.isArray(result.image_urls)) {
+    if (result.status === 'success' && Array.isArray(result.groups)) {
+      await placeImageGroups(result.groups, placement);
+    } else if (result.status === 'success' && Array.isArray(result.image_urls)) {
       for (const imageUrl of result.image_urls) {
         await createImageOnBoard(imageUrl, placement.positionData, placement.geometryData);
       }
@@ -193,7 +196,8 @@ export async function generateImagesFromSelection(setImageLoading, prompt) {
       boardId,
       positionData: placement.positionData,
       geometryData: placement.geometryData,
-      prompt: prompt
+      prompt: prompt,
+      groups: true // one row per prompt, laid out by the backend
     };
 
     const res = await fetch(`${config.apiBaseUrl}/generate-image-ideas`, {
@@ -207,7 +211,9 @@ export async function generateImagesFromSelection(setImageLoading, prompt) {
     if (!res.ok) throw new Error(result.error || 'Unknown error');
 
     // 🔁 UPDATED: use frontend positioning for placing images
-    if (result.status === 'success' && Array.isArray(result.image_urls)) {
+    if (result.status === 'success' && Array.isArray(result.groups)) {
+      await placeImageGroups(result.groups, placement);
+    } else if (result.status === 'success' && Array.isArray(result.image_urls)) {
       for (const imageUrl of result.image_urls) {
         await createImageOnBoard(imageUrl, placement.positionData, placement.geometryData);
       }
@@ -221,6 +227,19 @@ export async function generateImagesFromSelection(setImageLoading, prompt) {
   }
 }
 
+/**
+ * Place image ideas grouped by prompt: one row per prompt, at the positions
+ * the backend laid out from our placement
+ */
+async function placeImageGroups(groups, placement) {
+  for (const group of groups) {
+    for (const [i, imageUrl] of group.image_urls.entries()) {
+      const positionData = group.positions?.[i] ?? placement.positionData;
+      await createImageOnBoard(imageUrl, positionData, placement.geometryData);
+    }
+  }
+}
+
 export async function createImageOnBoard(url, positionData, geometryData) {
   const userInfo = await miro.board.getUserInfo();
   const image = await miro.board.createImage({
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+# OpenAI_API reads its configuration at import time: keep the tests off the
+# network and out of the shared temp directories
+_state = tempfile.mkdtemp(prefix="konzepta-tests-")
+os.environ.update(
+    OPENAI_API_KEY="test-key",
+    MIRO_TOKEN="test-token",
+    WARM_UP="0",
+    CACHE_BACKEND="memory",
+    IMAGE_STORE_DIR=os.path.join(_state, "images"),
+    JOB_STORE_DIR=os.path.join(_state, "jobs"),
+    MIRO_WEBHOOK_SECRET="test-secret",
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import OpenAI_API
+
+
+class Clock:
+    """Stands in for time.monotonic so TTLs can be tested without sleeping"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(OpenAI_API.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def wall_clock(monkeypatch):
+    """Like clock, for code that keeps wall-clock expiry times (time.time)"""
+    clock = Clock()
+    clock.now = 1_700_000_000.0
+    monkeypatch.setattr(OpenAI_API.time, "time", clock)
+    return clock
@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+import OpenAI_API
+import asgi
+
+
+def completion(content):
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": OpenAI_API.TEXT_MODEL,
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Routes the ASGI app's OpenAI calls to `upstream.openai(request)`"""
+    monkeypatch.setattr(OpenAI_API.SCHEDULER, "_buckets", {})
+    monkeypatch.setattr(OpenAI_API, "UPSTREAM_MAX_RETRIES", 0)
+    monkeypatch.setattr(asgi, "UPSTREAM_MAX_RETRIES", 0)
+
+    class Upstream:
+        requests = []
+
+        def handle(self, request):
+            self.requests.append(request)
+            return self.openai(request)
+
+    upstream = Upstream()
+    yield upstream
+    asgi.clients.clear()
+
+
+def run(upstream, send):
+    async def main():
+        transport = httpx.MockTransport(upstream.handle)
+        asgi.clients.update(
+            openai=AsyncOpenAI(api_key="test-key", base_url="http://openai.test/v1", max_retries=0,
+                               http_client=httpx.AsyncClient(transport=transport)),
+            image_slots=asyncio.Semaphore(1),
+        )
+        return await send(asgi.app.test_client())
+
+    return asyncio.run(main())
+
+
+def test_generate_ideas_goes_through_the_scheduler(upstream):
+    upstream.openai = lambda request: httpx.Response(200, json=completion("Idea 1: fresh"))
+
+    async def send(client):
+        response = await client.post("/generate-ideas", json={"content": "onboarding"})
+        return response.status_code, await response.get_json()
+
+    status, body = run(upstream, send)
+
+    assert status == 200
+    assert body == {"suggestions": "Idea 1: fresh"}
+    assert len(upstream.requests) == 1
+    assert OpenAI_API.SCHEDULER.bucket(f"openai:{OpenAI_API.TEXT_MODEL}").tokens < \
+        OpenAI_API.SCHEDULER.bucket(f"openai:{OpenAI_API.TEXT_MODEL}").capacity
+
+
+def test_generate_ideas_maps_an_openai_429_to_429(upstream):
+    upstream.openai = lambda request: httpx.Response(
+        429, headers={"Retry-After": "7"}, json={"error": {"message": "slow down", "type": "rate_limit"}}
+    )
+
+    async def send(client):
+        response = await client.post("/generate-ideas", json={"content": "onboarding"})
+        return response.status_code, response.headers.get("Retry-After"), await response.get_json()
+
+    status, retry_after, body = run(upstream, send)
+
+    assert status == 429
+    assert retry_after == "7"
+    assert body["error"] == "Upstream rate limit exceeded, please retry"
+    # The SDK's own retries are off; the scheduler made the only attempt
+    assert len(upstream.requests) == 1
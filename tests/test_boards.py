@@ -0,0 +1,88 @@
+import pytest
+
+import OpenAI_API
+from OpenAI_API import SHAPE_TYPES, BoardSnapshotStore, UpstreamRateLimited
+
+
+@pytest.fixture
+def miro(monkeypatch):
+    """Board items by id; ids missing from it are 404s. `miro.fetched`
+    records every id the store asked for."""
+
+    class Miro(dict):
+        fetched = []
+        error = None
+
+    miro = Miro()
+
+    def fetch_board_items(board_id, item_ids):
+        miro.fetched.extend(item_ids)
+        return [(i, miro.get(i), miro.error) for i in dict.fromkeys(item_ids)]
+
+    monkeypatch.setattr(OpenAI_API, "fetch_board_items", fetch_board_items)
+    return miro
+
+
+def item(item_id, type="sticky_note", content="text"):
+    return {"id": item_id, "type": type, "data": {"content": content}}
+
+
+def test_lookup_fetches_selected_items_in_request_order(miro):
+    miro.update(a=item("a"), b=item("b", "shape"))
+    store = BoardSnapshotStore(max_boards=4)
+
+    assert store.lookup("board", ["b", "missing", "a", "b"], SHAPE_TYPES) == [miro["b"], miro["a"]]
+    assert miro.fetched == ["b", "missing", "a"]
+
+
+def test_lookup_refetches_known_items_so_their_text_is_current(miro):
+    miro["a"] = item("a", content="old")
+    store = BoardSnapshotStore(max_boards=4)
+    store.lookup("board", ["a"], SHAPE_TYPES)
+
+    miro["a"] = item("a", content="new")
+
+    assert store.lookup("board", ["a"], SHAPE_TYPES) == [miro["a"]]
+
+
+def test_lookup_skips_ids_known_to_be_of_other_types(miro):
+    miro.update(img=item("img", "image"), note=item("note"))
+    store = BoardSnapshotStore(max_boards=4)
+    store.lookup("board", ["img", "note"])
+    miro.fetched.clear()
+
+    assert store.lookup("board", ["img", "note"], SHAPE_TYPES) == [miro["note"]]
+    assert miro.fetched == ["note"]
+
+
+def test_webhook_events_update_the_index(miro):
+    store = BoardSnapshotStore(max_boards=4)
+    store.lookup("board", [])
+    store.apply_event("board", "create", item("img", "image"))
+
+    assert store.lookup("board", ["img"], SHAPE_TYPES) == []
+    assert miro.fetched == []
+
+    store.apply_event("board", "delete", {"id": "img"})
+    store.lookup("board", ["img"], SHAPE_TYPES)
+    assert miro.fetched == ["img"]
+
+
+def test_lookup_drops_failed_items_but_raises_rate_limits(miro):
+    miro["a"] = item("a")
+    store = BoardSnapshotStore(max_boards=4)
+
+    miro.error = RuntimeError("timeout")
+    assert store.lookup("board", ["a"]) == []
+
+    miro.error = UpstreamRateLimited("Rate limit for miro exceeded", 3)
+    with pytest.raises(UpstreamRateLimited):
+        store.lookup("board", ["a"])
+
+
+def test_store_keeps_the_most_recent_boards(miro):
+    store = BoardSnapshotStore(max_boards=2)
+    for board in ("one", "two", "three"):
+        store.lookup(board, [])
+
+    assert list(store._snapshots) == ["two", "three"]
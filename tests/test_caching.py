@@ -0,0 +1,214 @@
+import threading
+import time
+
+from OpenAI_API import PRIORITY_SPECULATIVE, ResponseCache, SemanticCache, SingleFlight
+
+
+def test_response_cache_expires_entries(clock):
+    cache = ResponseCache(max_entries=10, max_bytes=10_000, ttl=60)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2}, ttl=120)
+
+    clock.advance(61)
+    assert cache.get("a") is None
+    assert cache.get("b") == {"v": 2}
+    assert cache.stats()["entries"] == 1
+
+
+def test_response_cache_evicts_least_recently_used(clock):
+    cache = ResponseCache(max_entries=2, max_bytes=10_000, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_response_cache_bounds_bytes(clock):
+    cache = ResponseCache(max_entries=10, max_bytes=20, ttl=60)
+    cache.set("a", "x" * 10)
+    cache.set("b", "y" * 10)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 10
+
+    cache.set("huge", "z" * 100)
+    assert cache.get("huge") is None
+    assert cache.stats()["bytes"] == 12
+
+
+def test_response_cache_drops_expired_entries_before_live_ones(clock):
+    cache = ResponseCache(max_entries=2, max_bytes=10_000, ttl=60)
+    cache.set("old", 1, ttl=10)
+    cache.set("live", 2)
+    clock.advance(11)
+    cache.set("new", 3)
+
+    assert cache.get("live") == 2
+    assert cache.stats()["evictions"] == 0
+
+
+def test_semantic_cache_returns_close_matches_only(clock):
+    cache = SemanticCache(threshold=0.9, max_entries=10, max_scopes=10, ttl=60)
+    cache.add("board", [1.0, 0.0], "ideas", text="a note")
+
+    assert cache.lookup("board", [0.99, 0.05])[0] == "ideas"
+    value, similarity = cache.lookup("board", [0.0, 1.0])
+    assert value is None and similarity < 0.9
+    assert cache.lookup("other board", [1.0, 0.0])[0] is None
+
+
+def test_semantic_cache_skips_the_exact_same_text(clock):
+    cache = SemanticCache(threshold=0.9, max_entries=10, max_scopes=10, ttl=60)
+    cache.add("board", [1.0, 0.0], "ideas", text="a note")
+
+    assert cache.lookup("board", [1.0, 0.0], text="a note")[0] is None
+    assert cache.lookup("board", [1.0, 0.0], text="a  note")[0] == "ideas"
+
+
+def test_semantic_cache_ignores_expired_entries(clock):
+    cache = SemanticCache(threshold=0.9, max_entries=10, max_scopes=10, ttl=60)
+    cache.add("board", [1.0, 0.0], "ideas")
+    clock.advance(61)
+
+    assert cache.lookup("board", [1.0, 0.0])[0] is None
+
+
+def test_semantic_cache_grows_then_overwrites_least_recently_used(clock):
+    cache = SemanticCache(threshold=0.99, max_entries=20, max_scopes=10, ttl=60)
+    for index in range(20):
+        cache.add("board", [1.0, float(index)], index)
+    assert cache.stats()["entries"] == 20
+
+    cache.lookup("board", [1.0, 0.0])
+    cache.add("board", [0.0, -1.0], "new")
+
+    assert cache.stats()["entries"] == 20
+    assert cache.lookup("board", [1.0, 0.0])[0] == 0
+    assert cache.lookup("board", [0.0, -1.0])[0] == "new"
+    assert cache.lookup("board", [1.0, 1.0])[0] is None
+
+
+def test_semantic_cache_evicts_least_recently_used_scope(clock):
+    cache = SemanticCache(threshold=0.9, max_entries=10, max_scopes=2, ttl=60)
+    cache.add("a", [1.0, 0.0], "a")
+    cache.add("b", [1.0, 0.0], "b")
+    cache.lookup("a", [1.0, 0.0])
+    cache.add("c", [1.0, 0.0], "c")
+
+    assert cache.stats()["scopes"] == 2
+    assert cache.lookup("b", [1.0, 0.0])[0] is None
+    assert cache.lookup("a", [1.0, 0.0])[0] == "a"
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+    follower.start()
+    while not flight.coalesced:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert results == ["result", "result"]
+    assert len(calls) == 1
+
+
+def test_single_flight_propagates_errors_to_every_caller():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while not flight.coalesced:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert [str(e) for e in errors] == ["upstream failed", "upstream failed"]
+    # The failed call isn't remembered; the next caller runs again
+    assert flight.do("key", lambda: "retried") == "retried"
+
+
+def test_single_flight_does_not_queue_clicks_behind_speculative_calls():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def speculative():
+        started.set()
+        release.wait(5)
+        return "pre-generated"
+
+    results = []
+    background = threading.Thread(target=lambda: results.append(flight.do("key", speculative, PRIORITY_SPECULATIVE)))
+    background.start()
+    started.wait(5)
+
+    # The click runs its own call instead of waiting on the pre-generation
+    assert flight.do("key", lambda: "clicked") == "clicked"
+    assert flight.coalesced == 0
+
+    release.set()
+    background.join(5)
+    assert results == ["pre-generated"]
+    assert flight._calls == {}
+
+
+def test_single_flight_lets_speculative_calls_join_clicks():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def click():
+        started.set()
+        release.wait(5)
+        return "clicked"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", click)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(
+        flight.do("key", lambda: "pre-generated", PRIORITY_SPECULATIVE)))
+    follower.start()
+    while not flight.coalesced:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert results == ["clicked", "clicked"]
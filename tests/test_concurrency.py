@@ -0,0 +1,76 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from OpenAI_API import iter_bounded, run_bounded
+
+
+def test_iter_bounded_yields_results_and_errors():
+    def work(item):
+        if item == "bad":
+            raise ValueError(item)
+        return item.upper()
+
+    with ThreadPoolExecutor(2) as pool:
+        outcomes = run_bounded(work, ["a", "bad", "c"], pool, 2)
+
+    assert outcomes[0] == ("A", None)
+    assert isinstance(outcomes[1][1], ValueError)
+    assert outcomes[2] == ("C", None)
+
+
+def test_iter_bounded_times_items_from_when_they_start():
+    with ThreadPoolExecutor(1) as pool:
+        outcomes = run_bounded(lambda seconds: time.sleep(seconds) or seconds, [0.2, 0.2, 0.2], pool, 3, timeout=0.3)
+
+    assert outcomes == [(0.2, None)] * 3
+
+
+def test_iter_bounded_reports_items_that_run_too_long():
+    release = threading.Event()
+    with ThreadPoolExecutor(2) as pool:
+        outcomes = run_bounded(lambda item: release.wait(5) if item == "slow" else item,
+                               ["slow", "fast"], pool, 2, timeout=0.1)
+        release.set()
+
+    assert isinstance(outcomes[0][1], TimeoutError)
+    assert outcomes[1] == ("fast", None)
+
+
+def test_iter_bounded_drops_queued_items_when_the_caller_stops():
+    started = []
+
+    def work(item):
+        started.append(item)
+        time.sleep(0.05 if item else 0)
+        return item
+
+    with ThreadPoolExecutor(1) as pool:
+        outcomes = iter_bounded(work, range(10), pool, 10)
+        assert next(outcomes) == (0, 0, None)
+        outcomes.close()
+
+    assert len(started) <= 2
+
+
+def test_iter_bounded_keeps_the_slot_of_a_timed_out_item_until_it_finishes():
+    release = threading.Event()
+    events = []
+
+    def work(item):
+        events.append(("start", item))
+        if item == "slow":
+            release.wait(5)
+        events.append(("end", item))
+        return item
+
+    with ThreadPoolExecutor(2) as pool:
+        outcomes = iter_bounded(work, ["slow", "fast"], pool, 1, timeout=0.05)
+        index, _, error = next(outcomes)
+        assert index == 0 and isinstance(error, TimeoutError)
+        time.sleep(0.05)
+        assert ("start", "fast") not in events
+        release.set()
+        assert next(outcomes) == (1, "fast", None)
+
+    assert events == [("start", "slow"), ("end", "slow"), ("start", "fast"), ("end", "fast")]
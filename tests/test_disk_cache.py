@@ -0,0 +1,65 @@
+import os
+
+from OpenAI_API import DiskCache
+
+
+def test_disk_cache_round_trips_values(tmp_path):
+    cache = DiskCache(str(tmp_path), max_entries=10, max_bytes=10_000, ttl=60)
+    cache.set("key", {"images": ["a", "b"]})
+
+    assert cache.get("key") == {"images": ["a", "b"]}
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_disk_cache_is_shared_between_instances(tmp_path):
+    writer = DiskCache(str(tmp_path), max_entries=10, max_bytes=10_000, ttl=60)
+    reader = DiskCache(str(tmp_path), max_entries=10, max_bytes=10_000, ttl=60)
+    writer.set("key", "value")
+
+    assert reader.get("key") == "value"
+
+
+def test_disk_cache_expires_entries(tmp_path, wall_clock):
+    cache = DiskCache(str(tmp_path), max_entries=10, max_bytes=10_000, ttl=60)
+    cache.set("key", "value")
+    wall_clock.advance(61)
+
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path, wall_clock):
+    cache = DiskCache(str(tmp_path), max_entries=2, max_bytes=10_000, ttl=60)
+    cache.set("a", 1)
+    wall_clock.advance(1)
+    cache.set("b", 2)
+    wall_clock.advance(1)
+    cache.get("a")
+    wall_clock.advance(1)
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_cache_drops_expired_entries_first(tmp_path, wall_clock):
+    cache = DiskCache(str(tmp_path), max_entries=2, max_bytes=10_000, ttl=60)
+    cache.set("old", 1, ttl=5)
+    cache.set("live", 2)
+    wall_clock.advance(10)
+    cache.set("new", 3)
+
+    assert cache.get("live") == 2
+    assert cache.stats()["evictions"] == 0
+
+
+def test_disk_cache_delete_removes_the_payload(tmp_path):
+    cache = DiskCache(str(tmp_path), max_entries=10, max_bytes=10_000, ttl=60)
+    cache.set("key", "value")
+    cache.delete("key")
+    cache.delete("key")
+
+    assert cache.get("key") is None
+    assert os.listdir(cache.payload_dir) == []
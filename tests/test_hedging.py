@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+import OpenAI_API
+from OpenAI_API import LatencyTracker, hedge_delay, race_completions
+
+
+class FakeStream:
+    """A streamed completion that sends `deltas`, waiting `delay` seconds
+    before each, unless it is closed first"""
+
+    def __init__(self, deltas, delay=0.0, error=None):
+        self.deltas = deltas
+        self.delay = delay
+        self.error = error
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+    def __iter__(self):
+        for delta in self.deltas:
+            if self.closed.wait(self.delay):
+                return
+            yield delta
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """model -> FakeStream its next completion returns"""
+    streams = {}
+    monkeypatch.setattr(OpenAI_API, "TEXT_MODEL", "primary")
+    monkeypatch.setattr(OpenAI_API, "TEXT_FALLBACK_MODEL", "fallback")
+    monkeypatch.setattr(OpenAI_API, "TEXT_LATENCY", LatencyTracker(window=50))
+    monkeypatch.setattr(OpenAI_API, "TEXT_HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(OpenAI_API, "TEXT_HEDGE_MAX_DELAY", 0.05)
+    monkeypatch.setattr(OpenAI_API, "stream_completion", lambda client, model, prompt: streams[model])
+    monkeypatch.setattr(OpenAI_API, "iter_deltas", lambda stream, model: iter(stream))
+    return streams
+
+
+def test_fast_completions_are_not_hedged(models):
+    models["primary"] = FakeStream(["Idea 1: ", "fresh"])
+
+    winner = race_completions(None, "prompt", "complete")
+
+    assert (winner.model, winner.text) == ("primary", "Idea 1: fresh")
+    assert "fallback" not in models
+
+
+def test_slow_completions_are_hedged_to_the_fallback_model(models):
+    models["primary"] = FakeStream(["slow"], delay=5)
+    models["fallback"] = FakeStream(["Idea 1: ", "quick"])
+
+    winner = race_completions(None, "prompt", "complete")
+
+    assert (winner.model, winner.text) == ("fallback", "Idea 1: quick")
+    # The losing primary is cancelled, and what it took so far still counts
+    assert models["primary"].closed.wait(1)
+    assert OpenAI_API.TEXT_LATENCY.percentile("primary:first_token", 50) >= 0.05
+
+
+def test_streams_race_to_the_first_token(models):
+    models["primary"] = FakeStream(["Idea 1: ", "fresh"], delay=0.2)
+    models["fallback"] = FakeStream(["Idea 1: ", "quick"], delay=5)
+
+    winner = race_completions(None, "prompt", "first_token")
+
+    assert winner.model == "primary"
+    assert "".join(winner.deltas()) == "Idea 1: fresh"
+    assert models["fallback"].closed.wait(1)
+
+
+def test_the_primary_error_is_raised_when_every_attempt_fails(models):
+    models["primary"] = FakeStream([], error=ValueError("primary failed"))
+
+    with pytest.raises(ValueError, match="primary failed"):
+        race_completions(None, "prompt", "complete")
+
+
+def test_hedge_delay_follows_the_observed_percentile(models, monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "TEXT_HEDGE_MIN_SAMPLES", 3)
+    monkeypatch.setattr(OpenAI_API, "TEXT_HEDGE_PERCENTILE", 50)
+
+    assert hedge_delay("complete") == 0.05
+    for seconds in (0.02, 0.03, 0.04):
+        OpenAI_API.TEXT_LATENCY.observe("primary:complete", seconds)
+    assert hedge_delay("complete") == 0.03
+
+    OpenAI_API.TEXT_LATENCY.observe("primary:complete", 0.001)
+    OpenAI_API.TEXT_LATENCY.observe("primary:complete", 0.001)
+    assert hedge_delay("complete") == 0.02
+    OpenAI_API.TEXT_LATENCY.observe("primary:first_token", 1)
+    assert hedge_delay("first_token") == 0.05
@@ -0,0 +1,43 @@
+from OpenAI_API import IdeaStreamParser, format_suggestions, parse_batch_ideas
+
+
+def test_parser_emits_ideas_once_they_are_complete():
+    parser = IdeaStreamParser()
+
+    assert parser.feed("Idea 1: Map the") == []
+    assert parser.feed(" journey\n\nIdea 2: Sketch") == [{"index": 1, "text": "Map the journey"}]
+    assert parser.feed(" flows Idea 3:") == [{"index": 2, "text": "Sketch flows"}]
+    assert parser.feed(" Test early") == []
+    assert parser.finish() == [{"index": 3, "text": "Test early"}]
+    assert parser.finish() == []
+
+
+def test_parser_handles_markers_split_across_deltas():
+    parser = IdeaStreamParser()
+    ideas = []
+    for delta in "Idea 1: one\nIdea 2： two\nIdea 3: three":
+        ideas += parser.feed(delta)
+    ideas += parser.finish()
+
+    assert [idea["text"] for idea in ideas] == ["one", "two", "three"]
+
+
+def test_parser_replays_formatted_suggestions():
+    parser = IdeaStreamParser()
+    text = format_suggestions(["alpha", "beta"])
+
+    assert parser.feed(text) + parser.finish() == [
+        {"index": 1, "text": "alpha"}, {"index": 2, "text": "beta"}
+    ]
+
+
+def test_parse_batch_ideas_keeps_well_formed_keys():
+    text = '{"n1": ["a", " b ", ""], "n2": "not a list", "n3": [], "extra": ["x"]}'
+
+    assert parse_batch_ideas(text, ["n1", "n2", "n3", "n4"]) == {"n1": ["a", "b"]}
+
+
+def test_parse_batch_ideas_rejects_malformed_responses():
+    assert parse_batch_ideas("not json", ["n1"]) == {}
+    assert parse_batch_ideas('["n1"]', ["n1"]) == {}
+    assert parse_batch_ideas(None, ["n1"]) == {}
@@ -0,0 +1,36 @@
+import OpenAI_API
+from OpenAI_API import get_image_idea_layout, get_images_per_prompt, image_idea_calls, image_idea_position
+
+
+def test_one_call_per_prompt_where_the_model_makes_several_images(monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "IMAGE_MODEL", "gpt-image-1")
+
+    assert image_idea_calls(2, 4) == [(0, 4), (1, 4)]
+    assert image_idea_calls(1, 23) == [(0, 10), (0, 10), (0, 3)]
+
+
+def test_one_call_per_image_for_single_image_models(monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "IMAGE_MODEL", "dall-e-3")
+
+    assert image_idea_calls(2, 2) == [(0, 1), (0, 1), (1, 1), (1, 1)]
+    assert image_idea_calls(0, 3) == []
+
+
+def test_images_per_prompt_is_capped(monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "IMAGE_IDEAS_PER_PROMPT", 1)
+    monkeypatch.setattr(OpenAI_API, "IMAGE_IDEAS_MAX_PER_PROMPT", 6)
+
+    assert get_images_per_prompt({"imagesPerPrompt": 3}, {}) == 3
+    assert get_images_per_prompt({}, {"imagesPerPrompt": "9"}) == 6
+    assert get_images_per_prompt({"imagesPerPrompt": -2}, {}) == 1
+    assert get_images_per_prompt({"imagesPerPrompt": "many"}, {}) == 1
+    assert get_images_per_prompt(None, {}) == 1
+
+
+def test_images_are_laid_out_one_row_per_prompt():
+    pos, geo = get_image_idea_layout({"positionData": {"x": 100, "y": 50, "origin": "center"},
+                                      "geometryData": {"width": 200}})
+
+    assert geo == {"width": 200, "height": 200}
+    assert image_idea_position(pos, geo, 0, 0) == {"x": 100, "y": 50, "origin": "center"}
+    assert image_idea_position(pos, geo, 1, 2) == {"x": 600, "y": 300, "origin": "center"}
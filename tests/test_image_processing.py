@@ -0,0 +1,54 @@
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import image_processing
+from OpenAI_API import get_image_variant
+
+
+def write_image(path, size=(800, 400), mode="RGBA"):
+    Image.new(mode, size, (255, 0, 0, 0) if mode == "RGBA" else "red").save(path, "PNG")
+    return str(path)
+
+
+def decode(data):
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image
+
+
+def test_transcode_resizes_keeping_the_aspect_ratio(tmp_path):
+    image = decode(image_processing.transcode(write_image(tmp_path / "in.png"), 200, "webp", 80))
+
+    assert image.format == "WEBP"
+    assert image.size == (200, 100)
+
+
+def test_transcode_never_upscales(tmp_path):
+    path = write_image(tmp_path / "in.png", size=(100, 50))
+
+    assert decode(image_processing.transcode(path, 400, "png", 80)).size == (100, 50)
+    assert decode(image_processing.transcode(path, 0, "png", 80)).size == (100, 50)
+
+
+def test_transcode_flattens_transparency_for_jpeg(tmp_path):
+    image = decode(image_processing.transcode(write_image(tmp_path / "in.png"), 0, "jpeg", 80))
+
+    assert image.format == "JPEG" and image.mode == "RGB"
+    assert image.getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_images_are_served_as_generated_unless_a_format_is_asked_for():
+    assert get_image_variant({}, {}) is None
+    assert get_image_variant({"format": "original"}, {}) is None
+    assert get_image_variant({"format": "gif"}, {}) is None
+
+
+def test_variant_takes_width_from_the_board_geometry():
+    variant = get_image_variant({"format": "jpg", "geometryData": {"width": 300}, "quality": 500}, {})
+
+    assert (variant.format, variant.width, variant.quality) == ("jpeg", 320, 100)
+    assert variant.key == "jpeg-w320q100"
+    assert get_image_variant({}, {"format": "webp", "width": "64", "thumbnail": "1"}).key == "webp-w64q80-t"
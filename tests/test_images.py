@@ -0,0 +1,91 @@
+from urllib.parse import urlsplit
+
+import pytest
+
+import OpenAI_API
+from OpenAI_API import ImageStore
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageStore(str(tmp_path), max_bytes=1 << 20, ttl=3600, secret="test-secret")
+
+
+def query(url):
+    return dict(part.split("=", 1) for part in urlsplit(url).query.split("&"))
+
+
+def test_images_are_content_addressed(store):
+    image_id = store.save(DATA)
+
+    assert image_id.endswith(".png")
+    assert store.save(DATA) == image_id
+    assert open(store.path(image_id), "rb").read() == DATA
+    assert store.path("../etc/passwd") is None
+
+
+def test_signed_urls_verify_until_they_expire(store, wall_clock):
+    image_id = store.save(DATA)
+    url = store.signed_url(image_id, "https://api.example.com", ttl=60)
+    params = query(url)
+
+    assert url.startswith(f"https://api.example.com/images/{image_id}?")
+    assert store.verify(image_id, params["expires"], params["sig"])
+    assert not store.verify(image_id, params["expires"], "0" + params["sig"][1:])
+    assert not store.verify(image_id, str(int(params["expires"]) + 60), params["sig"])
+    assert not store.verify(store.save(b"other"), params["expires"], params["sig"])
+
+    wall_clock.advance(61)
+    assert not store.verify(image_id, params["expires"], params["sig"])
+
+
+def test_stores_without_a_secret_share_a_generated_one(tmp_path):
+    first = ImageStore(str(tmp_path), 1 << 20, 3600)
+    second = ImageStore(str(tmp_path), 1 << 20, 3600)
+
+    assert first.secret == second.secret
+    assert len(first.secret) > 20
+
+
+@pytest.fixture
+def served():
+    """A stored image and the Flask app's signed path for it"""
+    image_id = OpenAI_API.IMAGE_STORE.save(DATA)
+    url = OpenAI_API.IMAGE_STORE.signed_url(image_id, "http://localhost")
+    client = OpenAI_API.create_app(warm_up=False).test_client()
+    return client, image_id, url[len("http://localhost"):]
+
+
+def test_image_route_answers_conditional_requests(served):
+    client, image_id, path = served
+
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.get_data() == DATA
+    assert response.headers["ETag"] == f'"{image_id.split(".")[0]}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+    revalidated = client.get(path, headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b""
+
+
+def test_image_route_serves_byte_ranges(served):
+    client, _, path = served
+
+    response = client.get(path, headers={"Range": "bytes=10-19"})
+
+    assert response.status_code == 206
+    assert response.get_data() == DATA[10:20]
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(DATA)}"
+
+
+def test_image_route_rejects_unsigned_and_missing_images(served):
+    client, image_id, path = served
+
+    assert client.get(f"/images/{image_id}").status_code == 403
+    missing = "f" * 64 + ".png"
+    signed = OpenAI_API.IMAGE_STORE.signed_url(missing, "")
+    assert client.get(signed).status_code == 404
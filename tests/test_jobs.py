@@ -0,0 +1,77 @@
+import threading
+import time
+from functools import partial
+
+import pytest
+
+from OpenAI_API import DiskCache, JobQueueFull, JobStore
+
+
+def wait_until_finished(store, job_id):
+    deadline = time.monotonic() + 5
+    while store.get(job_id)["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    return store.get(job_id)
+
+
+def test_job_runs_items_and_records_results_and_errors():
+    store = JobStore(workers=1, max_pending=5, ttl=60)
+
+    def work(item):
+        if item == "bad":
+            raise ValueError("no image")
+        return {"prompt": item}
+
+    job = store.submit("test", lambda job: job.run_items(work, ["a", "bad", "c"], lambda item: {"prompt": item}))
+    snapshot = wait_until_finished(store, job.id)
+
+    assert snapshot["status"] == "completed"
+    assert snapshot["results"] == [{"index": 0, "prompt": "a"}, {"index": 2, "prompt": "c"}]
+    assert snapshot["errors"] == [{"index": 1, "prompt": "bad", "error": "no image"}]
+    assert snapshot["progress"] == 1.0
+
+
+def test_failing_job_is_reported():
+    store = JobStore(workers=1, max_pending=5, ttl=60)
+    job = store.submit("test", lambda job: 1 / 0)
+
+    assert wait_until_finished(store, job.id)["status"] == "failed"
+
+
+def test_queue_is_bounded_and_queued_jobs_can_be_cancelled():
+    store = JobStore(workers=1, max_pending=2, ttl=60)
+    release = threading.Event()
+    running = store.submit("test", lambda job: release.wait(5))
+    queued = store.submit("test", lambda job: None)
+
+    with pytest.raises(JobQueueFull):
+        store.submit("test", lambda job: None)
+    store.cancel(queued.id)
+    release.set()
+
+    assert wait_until_finished(store, queued.id)["status"] == "cancelled"
+    assert wait_until_finished(store, running.id)["status"] == "completed"
+
+
+def test_unknown_jobs_are_none():
+    assert JobStore(workers=1, max_pending=5, ttl=60).get("nope") is None
+
+
+def test_shared_store_is_created_on_first_use_and_read_by_other_workers(tmp_path):
+    created = []
+
+    def shared():
+        created.append(1)
+        return DiskCache(str(tmp_path), 100, 1_000_000, 60)
+
+    store = JobStore(workers=1, max_pending=5, ttl=60, shared=shared)
+    assert created == [] and list(tmp_path.iterdir()) == []
+
+    job = store.submit("test", lambda job: job.results.append({"index": 0, "ok": True}))
+    wait_until_finished(store, job.id)
+    other_worker = JobStore(workers=1, max_pending=5, ttl=60,
+                            shared=partial(DiskCache, str(tmp_path), 100, 1_000_000, 60))
+
+    assert created == [1]
+    assert other_worker.get(job.id)["results"] == [{"index": 0, "ok": True}]
@@ -0,0 +1,49 @@
+from OpenAI_API import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    requests = registry.register(Counter("test_requests_total", "Requests"))
+    in_flight = registry.register(Gauge("test_in_flight", "Requests in flight"))
+    registry.collector(lambda: [("test_ready", "1 when ready", "gauge", 1)])
+
+    requests.inc(endpoint="/a")
+    requests.inc(2, endpoint="/a")
+    requests.inc(endpoint="/b")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+
+    assert registry.render().splitlines() == [
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{endpoint="/a"} 3',
+        'test_requests_total{endpoint="/b"} 1',
+        "# HELP test_in_flight Requests in flight",
+        "# TYPE test_in_flight gauge",
+        "test_in_flight 1",
+        "# HELP test_ready 1 when ready",
+        "# TYPE test_ready gauge",
+        "test_ready 1",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, stage="x")
+
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{stage="x",le="0.1"} 1',
+        'test_seconds_bucket{stage="x",le="1"} 2',
+        'test_seconds_bucket{stage="x",le="+Inf"} 3',
+        'test_seconds_sum{stage="x"} 5.55',
+        'test_seconds_count{stage="x"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter("test_total", "Escaping")
+    counter.inc(path='say "hi"\\')
+
+    assert counter.render()[2] == 'test_total{path="say \\"hi\\"\\\\"} 1'
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+import OpenAI_API
+from OpenAI_API import MiroAPIError, fetch_board_items, image_prompts
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.headers = {}
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeMiro:
+    """Stands in for the pooled Miro session: `items` by id, `statuses` for
+    ids that should fail. Tracks the calls in flight at once."""
+
+    def __init__(self, items=None, statuses=None, delay=0):
+        self.items = items or {}
+        self.statuses = statuses or {}
+        self.delay = delay
+        self.urls = []
+        self.in_flight = self.peak = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self._lock:
+            self.urls.append(url)
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        item_id = url.rsplit("/", 1)[1]
+        if item_id in self.statuses:
+            return FakeResponse(self.statuses[item_id])
+        if item_id not in self.items:
+            return FakeResponse(404)
+        return FakeResponse(200, self.items[item_id])
+
+
+@pytest.fixture
+def miro(monkeypatch):
+    monkeypatch.setattr(OpenAI_API.SCHEDULER, "_buckets", {})
+    monkeypatch.setattr(OpenAI_API, "UPSTREAM_MAX_RETRIES", 0)
+    session = FakeMiro()
+    monkeypatch.setitem(OpenAI_API._clients, "session:miro", session)
+    return session
+
+
+def note(item_id, content):
+    return {"id": item_id, "type": "sticky_note", "data": {"content": content}}
+
+
+def test_fetch_board_items_fetches_each_id_once_in_first_seen_order(miro):
+    miro.items.update(a=note("a", "first"), b=note("b", "second"))
+    miro.statuses["broken"] = 500
+
+    outcomes = fetch_board_items("board", ["b", "a", "missing", "b", "broken", "a"])
+
+    assert [(item_id, item) for item_id, item, _ in outcomes] == [
+        ("b", miro.items["b"]), ("a", miro.items["a"]), ("missing", None), ("broken", None)
+    ]
+    assert [error is None for _, _, error in outcomes] == [True, True, True, False]
+    assert isinstance(outcomes[3][2], MiroAPIError) and outcomes[3][2].status_code == 500
+    assert sorted(url.rsplit("/", 1)[1] for url in miro.urls) == ["a", "b", "broken", "missing"]
+    assert all(url.startswith(f"{OpenAI_API.MIRO_API_BASE}/v2/boards/board/items/") for url in miro.urls)
+
+
+def test_fetch_board_items_bounds_concurrent_calls(miro, monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "MIRO_FETCH_CONCURRENCY", 2)
+    miro.delay = 0.02
+    miro.items.update({str(i): note(str(i), f"note {i}") for i in range(6)})
+
+    outcomes = fetch_board_items("board", [str(i) for i in range(6)])
+
+    assert [item["id"] for _, item, _ in outcomes] == [str(i) for i in range(6)]
+    assert miro.peak == 2
+
+
+def test_image_prompts_use_shapes_and_free_text_and_report_failed_items():
+    fetched = [
+        ("a", note("a", "<p>Calm &amp; quiet</p>"), None),
+        ("img", {"id": "img", "type": "image", "data": {}}, None),
+        ("gone", None, None),
+        ("broken", None, MiroAPIError("Failed to fetch Miro item broken: 500", 500)),
+    ]
+
+    prompts, errors = image_prompts(fetched, "a sunrise")
+
+    assert prompts == ["Calm & quiet", "a sunrise"]
+    assert errors == [
+        {"id": "gone", "error": "Item not found"},
+        {"id": "broken", "error": "Failed to fetch Miro item broken: 500"},
+    ]
@@ -0,0 +1,303 @@
+"""The same requests against the Flask app and the ASGI app, with OpenAI
+answered by a mock transport: both front ends must give the same replies."""
+import asyncio
+import base64
+import json
+from urllib.parse import urlsplit
+
+import httpx
+import pytest
+from openai import AsyncOpenAI, OpenAI
+
+import OpenAI_API
+import asgi
+
+IMAGE_BYTES = b"\x89PNG\r\n\x1a\n-test-image"
+
+
+def completion(content):
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": OpenAI_API.TEXT_MODEL,
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+def stream_chunks(content):
+    """Server-sent events of a streamed completion, a few characters at a time"""
+    chunks = [{"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0,
+               "model": OpenAI_API.TEXT_MODEL,
+               "choices": [{"index": 0, "delta": {"content": content[i:i + 5]}, "finish_reason": None}]}
+              for i in range(0, len(content), 5)]
+    return "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks).encode() + b"data: [DONE]\n\n"
+
+
+class Upstream:
+    """Mock OpenAI API; `chat` gives the completion text for a request body"""
+
+    def __init__(self):
+        self.requests = []
+        self.chat = lambda body: "Idea 1: fresh\n\nIdea 2: angle"
+        self.status = 200
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if self.status != 200:
+            return httpx.Response(self.status, headers={"Retry-After": "7"},
+                                  json={"error": {"message": "upstream says no", "type": "error"}})
+        body = json.loads(request.content)
+        if request.url.path.endswith("/images/generations"):
+            image = {"b64_json": base64.b64encode(IMAGE_BYTES).decode()}
+            return httpx.Response(200, json={"created": 0, "data": [image] * body.get("n", 1)})
+        if body.get("stream"):
+            return httpx.Response(200, headers={"Content-Type": "text/event-stream"},
+                                  content=stream_chunks(self.chat(body)))
+        return httpx.Response(200, json=completion(self.chat(body)))
+
+
+class Reply:
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+    @property
+    def json(self):
+        return json.loads(self.data)
+
+
+class FlaskFrontEnd:
+    def __init__(self, upstream, monkeypatch):
+        client = OpenAI(api_key="test-key", base_url="http://openai.test/v1", max_retries=0,
+                        http_client=httpx.Client(transport=httpx.MockTransport(upstream)))
+        monkeypatch.setitem(OpenAI_API._clients, "openai", client)
+        self.client = OpenAI_API.create_app(warm_up=False).test_client()
+
+    def request(self, method, path, **kwargs):
+        response = self.client.open(path, method=method, **kwargs)
+        return Reply(response.status_code, response.headers, response.get_data())
+
+
+class AsgiFrontEnd:
+    def __init__(self, upstream, monkeypatch):
+        self.upstream = upstream
+        monkeypatch.setattr(asgi, "clients", {})
+
+    def request(self, method, path, json=None, headers=None):
+        async def send():
+            asgi.clients.update(
+                openai=AsyncOpenAI(api_key="test-key", base_url="http://openai.test/v1", max_retries=0,
+                                   http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.upstream))),
+                image_slots=asyncio.Semaphore(4),
+            )
+            response = await asgi.app.test_client().open(path, method=method, json=json, headers=headers)
+            return Reply(response.status_code, response.headers, await response.get_data())
+
+        return asyncio.run(send())
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(OpenAI_API.SCHEDULER, "_buckets", {})
+    monkeypatch.setattr(OpenAI_API, "UPSTREAM_MAX_RETRIES", 0)
+    monkeypatch.setattr(asgi, "UPSTREAM_MAX_RETRIES", 0)
+    monkeypatch.setattr(OpenAI_API.REQUEST_CACHE, "_entries", type(OpenAI_API.REQUEST_CACHE._entries)())
+    return Upstream()
+
+
+@pytest.fixture(params=["flask", "asgi"])
+def app(request, upstream, monkeypatch):
+    front_end = FlaskFrontEnd if request.param == "flask" else AsgiFrontEnd
+    return front_end(upstream, monkeypatch)
+
+
+def test_generate_ideas(app, upstream):
+    reply = app.request("POST", "/generate-ideas", json={"content": "<p>onboarding</p>", "boardId": "b1"})
+
+    assert reply.status == 200
+    assert reply.json == {"suggestions": "Idea 1: fresh\n\nIdea 2: angle"}
+    assert "onboarding" in json.loads(upstream.requests[0].content)["messages"][0]["content"]
+
+
+@pytest.mark.parametrize("body, error", [
+    ({}, "No JSON data provided"),
+    ({"content": "  "}, "No sticky note content provided"),
+])
+def test_generate_ideas_rejects_bad_requests(app, upstream, body, error):
+    reply = app.request("POST", "/generate-ideas", json=body)
+
+    assert reply.status == 400
+    assert reply.json == {"error": error}
+    assert upstream.requests == []
+
+
+def test_generate_ideas_maps_upstream_rate_limits_to_429(app, upstream):
+    upstream.status = 429
+
+    reply = app.request("POST", "/generate-ideas", json={"content": "onboarding"})
+
+    assert reply.status == 429
+    assert reply.headers["Retry-After"] == "7"
+    assert reply.json["error"] == "Upstream rate limit exceeded, please retry"
+
+
+def test_generate_ideas_reports_upstream_errors(app, upstream):
+    upstream.status = 400
+
+    reply = app.request("POST", "/generate-ideas", json={"content": "onboarding"})
+
+    assert reply.status == 500
+    assert reply.json["error"] == "OpenAI API error"
+
+
+def test_generate_ideas_streams_ndjson(app, upstream):
+    reply = app.request("POST", "/generate-ideas?stream=ndjson", json={"content": "onboarding"})
+
+    events = [json.loads(line) for line in reply.data.decode().splitlines()]
+    assert reply.status == 200
+    assert reply.headers["Content-Type"].startswith("application/x-ndjson")
+    assert events == [
+        {"event": "idea", "index": 1, "text": "fresh"},
+        {"event": "idea", "index": 2, "text": "angle"},
+        {"event": "done", "suggestions": "Idea 1: fresh\n\nIdea 2: angle"},
+    ]
+
+
+def test_generate_ideas_batch(app, upstream):
+    upstream.chat = lambda body: json.dumps({"n1": ["a", "b"], "n3": ["c"]})
+
+    reply = app.request("POST", "/generate-ideas/batch", json={"notes": [
+        {"id": "first", "content": "onboarding"}, {"id": "empty", "content": ""}, "checkout"
+    ]})
+
+    assert reply.status == 200
+    assert reply.json == {"status": "success", "count": 2, "failed": 1, "results": [
+        {"id": "first", "suggestions": "Idea 1: a\n\nIdea 2: b", "ideas": ["a", "b"]},
+        {"id": "empty", "error": "No sticky note content provided"},
+        {"id": "2", "suggestions": "Idea 1: c", "ideas": ["c"]},
+    ]}
+
+
+def test_generate_ideas_batch_rejects_missing_notes(app):
+    reply = app.request("POST", "/generate-ideas/batch", json={"notes": []})
+
+    assert reply.status == 400
+    assert reply.json == {"error": "No notes provided"}
+
+
+def test_sketches_are_served_from_signed_links(app, upstream):
+    reply = app.request("POST", "/generate-text2image-sketches", json={"content": "a calm onboarding flow",
+                                                                         "boardId": "b1"})
+
+    assert reply.status == 200
+    assert reply.json["count"] == 1
+    image = reply.json["images"][0]
+    assert image["id"] == "direct_content"
+    link = urlsplit(image["image_url"])
+    assert link.path.startswith("/images/")
+
+    served = app.request("GET", f"{link.path}?{link.query}")
+    assert served.status == 200
+    assert served.data == IMAGE_BYTES
+    forged = app.request("GET", f"{link.path}?{link.query.replace('sig=', 'sig=0')}")
+    assert forged.status == 403
+
+
+def test_sketches_stream_one_event_per_image(app, upstream):
+    reply = app.request("POST", "/generate-text2image-sketches?stream=ndjson",
+                        json={"content": "a calm onboarding flow", "boardId": "b1"})
+
+    image, done = [json.loads(line) for line in reply.data.decode().splitlines()]
+    assert image["event"] == "image" and image["index"] == 0 and "/images/" in image["image_url"]
+    assert done == {"event": "done", "status": "success", "count": 1, "errors": 0}
+
+
+def test_sketches_need_a_board(app, monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "DEFAULT_BOARD_ID", "")
+
+    reply = app.request("POST", "/generate-text2image-sketches", json={"content": "x"})
+
+    assert reply.status == 400
+    assert reply.json["error"].startswith("No board ID provided")
+
+
+def test_sketches_answer_preflight_requests(app):
+    reply = app.request("OPTIONS", "/generate-text2image-sketches", headers={
+        "Origin": "http://localhost:3000", "Access-Control-Request-Method": "POST"
+    })
+
+    assert reply.status == 200
+    assert reply.headers["Access-Control-Allow-Origin"] == "http://localhost:3000"
+
+
+def test_image_ideas(app, upstream):
+    reply = app.request("POST", "/generate-image-ideas", json={"content": "a calm onboarding flow",
+                                                                 "boardId": "b1", "imagesPerPrompt": 2})
+
+    assert reply.status == 200
+    assert reply.json["status"] == "success"
+    assert len(reply.json["image_urls"]) == 2
+    # Without PUBLIC_BASE_URL the board gets the images inline, as before links existed
+    assert all(url.startswith("data:image/png;base64,") for url in reply.json["image_urls"])
+    assert "groups" not in reply.json
+    assert len(upstream.requests) == 1
+
+
+def test_image_ideas_link_to_the_public_base_url(app, monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "IMAGE_IDEAS_DELIVERY", "url")
+
+    reply = app.request("POST", "/generate-image-ideas", json={"content": "x", "boardId": "b1"})
+
+    url, = reply.json["image_urls"]
+    assert "/images/" in url and "sig=" in url
+
+
+def test_image_ideas_groups_on_request(app, upstream):
+    reply = app.request("POST", "/generate-image-ideas", json={"content": "x", "boardId": "b1", "groups": True,
+                                                                 "positionData": {"x": 10, "y": 20}})
+
+    group, = reply.json["groups"]
+    assert group["prompt"] == "x"
+    assert group["positions"] == [{"x": 10, "y": 20}]
+    assert reply.json["geometryData"] == {"width": 600, "height": 600}
+
+
+def test_image_ideas_stream(app, upstream):
+    reply = app.request("POST", "/generate-image-ideas?stream=ndjson",
+                        json={"content": "x", "boardId": "b1", "imagesPerPrompt": 2})
+
+    events = [json.loads(line) for line in reply.data.decode().splitlines()]
+    assert [event["event"] for event in events] == ["image", "image", "done"]
+    assert events[0]["prompt"] == "x" and "positionData" not in events[0]
+    assert events[-1]["count"] == 2
+
+
+def test_unknown_jobs_are_404(app):
+    assert app.request("GET", "/jobs/missing").status == 404
+    assert app.request("DELETE", "/jobs/missing").json == {"error": "Job not found"}
+
+
+def test_root_lists_the_endpoints(app):
+    reply = app.request("GET", "/")
+
+    assert reply.status == 200
+    assert "/generate-ideas" in reply.json["endpoints"]
+
+
+def test_metrics_count_requests_and_upstream_calls(app, upstream, monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "METRICS_SERVER_TIMING", True)
+    monkeypatch.setattr(asgi, "METRICS_SERVER_TIMING", True)
+
+    reply = app.request("POST", "/generate-ideas", json={"content": "metrics"})
+    metrics = app.request("GET", "/metrics")
+
+    assert "rate_limit_wait;dur=" in reply.headers["Server-Timing"]
+    assert metrics.status == 200
+    assert metrics.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = metrics.data.decode()
+    assert 'konzepta_request_seconds_count{endpoint="generate_ideas",status="200"}' in text
+    assert 'konzepta_upstream_responses_total{status="200",upstream="openai"}' in text
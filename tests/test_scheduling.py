@@ -0,0 +1,164 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import OpenAI_API
+from OpenAI_API import (
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, TokenBucket, UpstreamRateLimited, UpstreamScheduler,
+    upstream_deadline,
+)
+
+
+def wait_for_waiters(bucket, count):
+    while len(bucket._waiters) < count:
+        time.sleep(0.001)
+
+
+def test_token_bucket_serves_waiters_by_priority():
+    # 10 tokens a second, holding at most one
+    bucket = TokenBucket("test", per_minute=600, burst_seconds=0.1)
+    bucket.acquire()
+    order = []
+
+    def take(name, priority):
+        bucket.acquire(priority=priority, timeout=5)
+        order.append(name)
+
+    bulk = threading.Thread(target=take, args=("bulk", PRIORITY_BULK))
+    bulk.start()
+    wait_for_waiters(bucket, 1)
+    interactive = threading.Thread(target=take, args=("interactive", PRIORITY_INTERACTIVE))
+    interactive.start()
+    bulk.join(5)
+    interactive.join(5)
+
+    assert order == ["interactive", "bulk"]
+
+
+def test_token_bucket_serves_equal_priorities_in_arrival_order():
+    bucket = TokenBucket("test", per_minute=600, burst_seconds=0.1)
+    bucket.acquire()
+    order = []
+    threads = []
+    for name in ("first", "second", "third"):
+        thread = threading.Thread(target=lambda name=name: (bucket.acquire(timeout=5), order.append(name)))
+        thread.start()
+        wait_for_waiters(bucket, len(threads) + 1)
+        threads.append(thread)
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["first", "second", "third"]
+
+
+def test_token_bucket_gives_up_when_the_wait_is_too_long():
+    bucket = TokenBucket("test", per_minute=6, burst_seconds=1)  # one token per 10s
+    bucket.acquire()
+
+    with pytest.raises(UpstreamRateLimited):
+        bucket.acquire(timeout=0.1)
+    assert not bucket._waiters
+
+
+def test_token_bucket_reserve_waits_for_its_turn():
+    bucket = TokenBucket("test", per_minute=60, burst_seconds=2)
+    first = bucket.enqueue(PRIORITY_BULK)
+    second = bucket.enqueue(PRIORITY_INTERACTIVE)
+
+    assert bucket.reserve(first) > 0
+    assert bucket.reserve(second) == 0
+    bucket.dequeue(second)
+    assert bucket.reserve(first) == 0
+    bucket.dequeue(first)
+    assert bucket.tokens < 1
+
+
+def test_token_bucket_refund_returns_tokens():
+    bucket = TokenBucket("test", per_minute=6, burst_seconds=1)
+    bucket.acquire()
+    bucket.refund()
+
+    bucket.acquire(timeout=0)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class Upstream:
+    """Answers calls from a script of responses and exceptions, in order"""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        outcome = self.script.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "UPSTREAM_MAX_RETRIES", 3)
+    monkeypatch.setattr(OpenAI_API, "UPSTREAM_BACKOFF_BASE", 0.001)
+    return UpstreamScheduler(default_rpm=6000)
+
+
+def test_call_retries_server_errors_until_a_response_succeeds(scheduler):
+    upstream = Upstream(FakeResponse(503), requests.exceptions.ConnectionError(), FakeResponse(200))
+
+    assert scheduler.call("miro", upstream).status_code == 200
+    assert upstream.calls == 3
+
+
+def test_call_returns_other_client_errors_without_retrying(scheduler):
+    upstream = Upstream(FakeResponse(404))
+
+    assert scheduler.call("miro", upstream).status_code == 404
+    assert upstream.calls == 1
+
+
+def test_call_gives_up_on_rate_limits_after_its_retries(scheduler):
+    upstream = Upstream(*[FakeResponse(429, {"Retry-After": "0.01"})] * 4)
+
+    with pytest.raises(UpstreamRateLimited) as raised:
+        scheduler.call("miro", upstream)
+
+    assert raised.value.retry_after == 0.01
+    assert upstream.calls == 4
+    assert scheduler.bucket("miro").rate < scheduler.bucket("miro").max_rate
+
+
+def test_call_does_not_retry_timeouts_of_non_idempotent_calls(scheduler):
+    upstream = Upstream(requests.exceptions.Timeout(), FakeResponse(200))
+
+    with pytest.raises(requests.exceptions.Timeout):
+        scheduler.call("openai:images", upstream, idempotent=False)
+    assert upstream.calls == 1
+
+    assert scheduler.call("openai:text", Upstream(requests.exceptions.Timeout(), FakeResponse(200))).status_code == 200
+
+
+def test_call_stops_retrying_at_the_deadline(scheduler):
+    upstream = Upstream(FakeResponse(429, {"Retry-After": "5"}), FakeResponse(200))
+
+    with upstream_deadline(1), pytest.raises(UpstreamRateLimited):
+        scheduler.call("miro", upstream)
+    assert upstream.calls == 1
+
+
+def test_call_fails_fast_once_the_deadline_has_passed(scheduler, clock):
+    upstream = Upstream(FakeResponse(200))
+
+    with upstream_deadline(1):
+        clock.advance(2)
+        with pytest.raises(TimeoutError):
+            scheduler.call("miro", upstream)
+    assert upstream.calls == 0
@@ -0,0 +1,126 @@
+import asyncio
+import sys
+import threading
+
+import pytest
+
+import OpenAI_API
+import asgi
+from OpenAI_API import LazyModule, WarmUp, create_app
+
+
+def test_lazy_modules_import_on_first_use(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    colorsys = LazyModule("colorsys")
+
+    assert "colorsys" not in sys.modules
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert "colorsys" in sys.modules
+
+
+def wait_for(warmup):
+    warmup._thread.join(5)
+
+
+def test_warm_up_reruns_only_failed_checks(monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "WARM_UP_RETRY_AFTER", 0)
+    runs = []
+
+    def flaky():
+        runs.append("flaky")
+        if runs.count("flaky") == 1:
+            raise ConnectionError("no route to host")
+
+    warmup = WarmUp({"steady": lambda: runs.append("steady"), "flaky": flaky})
+    warmup.start()
+    wait_for(warmup)
+
+    assert not warmup.ready
+    assert warmup.results == {"steady": "ok", "flaky": "ConnectionError: no route to host"}
+
+    warmup.start()
+    wait_for(warmup)
+
+    assert warmup.ready
+    assert sorted(runs) == ["flaky", "flaky", "steady"]
+
+
+def test_warm_up_waits_before_retrying(monkeypatch):
+    monkeypatch.setattr(OpenAI_API, "WARM_UP_RETRY_AFTER", 60)
+    warmup = WarmUp({"failing": lambda: 1 / 0})
+    warmup.start()
+    wait_for(warmup)
+    thread = warmup._thread
+
+    warmup.start()
+
+    assert warmup._thread is thread
+
+
+@pytest.fixture
+def warmup(monkeypatch):
+    """A WarmUp whose single check runs until `warmup.release` is set"""
+    release = threading.Event()
+    warmup = WarmUp({"openai": lambda: release.wait(5)})
+    warmup.release = release
+    monkeypatch.setattr(OpenAI_API, "WARMUP", warmup)
+    return warmup
+
+
+def test_create_app_only_warms_up_when_asked(warmup):
+    create_app(warm_up=False)
+    assert warmup._thread is None
+
+    create_app(warm_up=True)
+    assert warmup._thread is not None
+    warmup.release.set()
+
+
+def test_ready_reports_warm_up_progress(warmup):
+    client = create_app(warm_up=False).test_client()
+
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "warming_up"
+    assert response.get_json()["checks"] == {"openai": "pending"}
+    assert "import" in response.get_json()["startup_seconds"]
+
+    warmup.release.set()
+    wait_for(warmup)
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "ready"
+    assert client.get("/health").status_code == 200
+
+
+def test_forwarded_headers_are_only_trusted_behind_proxies(monkeypatch):
+    headers = {"X-Forwarded-Host": "attacker.example", "X-Forwarded-Proto": "https"}
+    base_url = []
+
+    def show_base_url():
+        base_url.append(OpenAI_API.public_base_url())
+        return {}
+
+    for hops in (0, 1):
+        monkeypatch.setattr(OpenAI_API, "PROXY_HOPS", hops)
+        app = create_app(warm_up=False)
+        app.add_url_rule("/base-url", view_func=show_base_url)
+        app.test_client().get("/base-url", headers=headers)
+
+    assert base_url == ["http://localhost", "https://attacker.example"]
+
+
+def test_asgi_ready_reports_its_own_warm_up(monkeypatch):
+    async def check():
+        pass
+
+    async def main():
+        warmup = asgi.AsyncWarmUp({"openai": check})
+        monkeypatch.setattr(asgi, "WARMUP", warmup)
+        client = asgi.app.test_client()
+        first = await client.get("/ready")
+        await warmup._task
+        second = await client.get("/ready")
+        return first.status_code, second.status_code, (await second.get_json())["checks"]
+
+    assert asyncio.run(main()) == (503, 200, {"openai": "ok"})
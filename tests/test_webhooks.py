@@ -0,0 +1,59 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+
+import OpenAI_API
+from OpenAI_API import BoardSnapshotStore, IdeasRequest, handle_miro_webhook, verify_webhook_signature
+
+
+def sign(body, secret="test-secret"):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def test_signature_matches_the_raw_body():
+    body = b'{"events": []}'
+
+    assert verify_webhook_signature(body, sign(body))
+    assert not verify_webhook_signature(body + b" ", sign(body))
+    assert not verify_webhook_signature(body, sign(body, "other-secret"))
+
+
+def test_signature_fails_closed():
+    body = b'{"events": []}'
+
+    assert not verify_webhook_signature(body, None)
+    assert not verify_webhook_signature(body, "")
+    assert not verify_webhook_signature(body, sign(body, ""), secret="")
+
+
+def test_webhook_answers_the_challenge_and_rejects_unsigned_events():
+    snapshots = BoardSnapshotStore(max_boards=10)
+
+    assert handle_miro_webhook(b'{"challenge": "abc"}', None, snapshots) == ({"challenge": "abc"}, 200)
+    assert handle_miro_webhook(b'{"events": []}', None, snapshots)[1] == 401
+
+
+def test_webhook_rejects_malformed_bodies():
+    snapshots = BoardSnapshotStore(max_boards=10)
+    for body in (b"[1]", b'{"events": {"type": "create"}}', b"not json"):
+        assert handle_miro_webhook(body, sign(body), snapshots)[1] == 400
+
+
+def test_webhook_accepts_signed_events():
+    body = json.dumps({"events": ["not an event", {"type": "board_subscription_changed"}]}).encode()
+
+    assert handle_miro_webhook(body, sign(body), BoardSnapshotStore(max_boards=10))[1] == 200
+
+
+@pytest.mark.parametrize("last_prompt, remembered", [(False, {}), (True, {"b1": "as haiku"})])
+def test_clicks_set_the_pre_generation_prompt_only_when_opted_in(monkeypatch, last_prompt, remembered):
+    monkeypatch.setattr(OpenAI_API, "SPECULATIVE_ENABLED", True)
+    monkeypatch.setattr(OpenAI_API, "SPECULATIVE_LAST_PROMPT", last_prompt)
+    monkeypatch.setattr(OpenAI_API.SPECULATOR, "_prompts", type(OpenAI_API.SPECULATOR._prompts)())
+
+    ideas = IdeasRequest({"content": "onboarding", "prompt": "as haiku", "boardId": "b1"}, {}, {})
+
+    assert ideas.take_cached() is None
+    assert dict(OpenAI_API.SPECULATOR._prompts) == remembered